@@ -0,0 +1,209 @@
+import json
+import sys
+import logging
+from os import path
+import numpy as np
+import yaml
+from .embedding_index import EmbeddingIndex
+from .preprocessing.cleaning.data_cleaner import clean_line
+from .preprocessing.training_data.context_windows import context_windows
+from .preprocessing.training_data.pvdm_classifier_training_builder import PARAGRAPH_STOP_WORDS
+from .preprocessing.training_data.vocabulary import Vocabulary
+
+# How a message gets its paragraph vector: inferred by gradient steps on the frozen PV-DM weights, or (faster, and
+# rougher) the mean of the vectors of its words
+QUERY_VECTORS = ("infer", "average")
+# How the similarities of the paragraphs of a blog post found for a message make its score: the best one, or their sum
+AGGREGATES = ("max", "sum")
+
+
+class BlogFinder(object):
+    """
+    The blog posts nearest to chat messages, by the PV-DM paragraph vectors of BlogClassifier: a message is cleaned
+    and encoded like the paragraphs were, gets a vector in the space of the paragraph vectors, and the paragraphs
+    nearest to it in an EmbeddingIndex make the scores of their blog posts.
+
+    A message vector is inferred like PV-DM infers the vector of an unseen paragraph: the word vectors and the
+    softmax stay frozen, only the message vector takes gradient steps to predict the words of the message from their
+    contexts. As the message vector is the only thing that changes, the context part of the logits is computed once
+    and every step takes just one (messages x vocabulary) product. All messages of a batch are inferred together.
+    With a large vocabulary the steps take a softmax over the candidates likeliest words only, see _samples.
+    """
+
+    def __init__(self, vocabulary, word_vectors, output_weights, output_biases, paragraph_vectors, doc_to_paragraph_ids,
+                 window_size, lists=0, steps=10, learning_rate=0.25, candidates=2048, seed=0):
+        self.logger = logging.getLogger(__name__)
+        self.vocabulary = vocabulary
+        self.word_vectors = np.asarray(word_vectors, dtype=np.float32)
+        # Softmax weights (vector size, vocabulary size) and biases, i.e. those of the Dense layer
+        self.output_weights = np.asarray(output_weights, dtype=np.float32)
+        self.output_biases = np.asarray(output_biases, dtype=np.float32)
+        self.window_size = window_size
+        self.steps = steps
+        self.learning_rate = learning_rate
+        self.candidates = candidates
+        self.index = EmbeddingIndex.from_paragraphs(paragraph_vectors, doc_to_paragraph_ids, lists, seed)
+        self.docs = list(doc_to_paragraph_ids)
+        # Doc (index into docs) of every paragraph id
+        self.paragraph_docs = np.full(int(self.index.ids.max()) + 1, -1, dtype=np.int64)
+        for doc, paragraph_ids in enumerate(doc_to_paragraph_ids.values()):
+            self.paragraph_docs[paragraph_ids] = doc
+
+    @staticmethod
+    def load(inference_file, doc_to_paragraph_ids_file, vocabulary, window_size, **kwargs):
+        # From the weights BlogClassifier saves after training, see BlogClassifier.save_inference_weights
+        with open(doc_to_paragraph_ids_file) as doc_to_paragraph_ids:
+            docs = json.load(doc_to_paragraph_ids)
+        with np.load(inference_file) as weights:
+            return BlogFinder(
+                vocabulary, weights["word_vectors"], weights["output_weights"], weights["output_biases"],
+                weights["paragraph_vectors"], docs, window_size, **kwargs
+            )
+
+    def encode(self, messages):
+        # Flat word ids and offsets of the messages, cleaned like the paragraphs of the blog posts. Words out of the
+        # vocabulary say nothing about what a message is about, they're left out
+        ids, offsets = self.vocabulary.encode([clean_line(message, PARAGRAPH_STOP_WORDS) for message in messages])
+        known = ids > self.vocabulary.oov_id
+        return ids[known], np.concatenate(([0], np.cumsum(known)))[offsets]
+
+    def _average(self, ids, offsets):
+        lengths = np.diff(offsets)
+        sums = np.zeros((len(lengths), self.word_vectors.shape[1]), dtype=np.float32)
+        np.add.at(sums, np.repeat(np.arange(len(lengths)), lengths), self.word_vectors[ids])
+        return sums / np.maximum(1, lengths)[:, None]
+
+    def _samples(self, ids, offsets, vectors):
+        """
+        The PV-DM samples of the messages: message, context logits (without the message vector) and focus word.
+
+        With candidates, the softmax is cut down to the candidates words likeliest in any sample at the starting
+        vectors, and the focus words: the other words hardly change the gradient, so they're taken as a constant part
+        of the partition function and the steps skip them. The samples then also have the softmax weights of those
+        words and the log of the rest of the partition function of every sample.
+        """
+        contexts, focus_words = context_windows(ids, offsets, self.window_size)
+        messages = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        keep = focus_words != 0
+        contexts, focus_words, messages = contexts[keep], focus_words[keep], messages[keep]
+        # The hidden layer is the mean of the message vector and the 2 * window_size context vectors
+        scale = 1.0 / (2 * self.window_size + 1)
+        hidden = self.word_vectors[contexts].sum(axis=1) * scale
+        if not self.candidates or self.candidates >= len(self.output_biases):
+            return messages, hidden @ self.output_weights + self.output_biases, focus_words
+        # One pass over the whole vocabulary, at the starting vectors
+        logits = (hidden + vectors[messages] * scale) @ self.output_weights + self.output_biases
+        likeliest = np.argpartition(-logits.max(axis=0), self.candidates - 1)[:self.candidates]
+        words = np.union1d(likeliest, focus_words)
+        maximum = logits.max(axis=1, keepdims=True)
+        np.exp(logits - maximum, out=logits)
+        rest = logits.sum(axis=1) - logits[:, words].sum(axis=1)
+        rest = maximum[:, 0] + np.log(np.maximum(rest, 1e-30))
+        output_weights = np.ascontiguousarray(self.output_weights[:, words])
+        return (
+            messages, hidden @ output_weights + self.output_biases[words], np.searchsorted(words, focus_words),
+            output_weights, rest,
+        )
+
+    def _loss_and_gradient(self, vectors, messages, context_logits, focus_words, output_weights=None, rest=None):
+        # Mean cross entropy of the samples of every message and its gradient with respect to the message vectors.
+        # With output_weights the softmax is over those columns only, and rest is the log of what the other words add
+        # to the partition function of every sample
+        output_weights = self.output_weights if output_weights is None else output_weights
+        scale = 1.0 / (2 * self.window_size + 1)
+        logits = context_logits + (vectors @ output_weights * scale)[messages]
+        maximum = logits.max(axis=1, keepdims=True)
+        if rest is not None:
+            maximum = np.maximum(maximum, rest[:, None])
+        logits -= maximum
+        probabilities = np.exp(logits)
+        partition = probabilities.sum(axis=1, keepdims=True)
+        if rest is not None:
+            partition += np.exp(rest[:, None] - maximum)
+        probabilities /= partition
+        samples = np.arange(len(focus_words))
+        counts = np.maximum(1, np.bincount(messages, minlength=len(vectors)))[:, None]
+        losses = np.bincount(messages, -np.log(probabilities[samples, focus_words] + 1e-12), len(vectors))
+        probabilities[samples, focus_words] -= 1
+        # Summed over the samples of every message (which are in message order) before going back through the
+        # softmax weights
+        errors = np.zeros((len(vectors), probabilities.shape[1]), dtype=np.float32)
+        present, starts = np.unique(messages, return_index=True)
+        errors[present] = np.add.reduceat(probabilities, starts, axis=0)
+        return losses / counts[:, 0], (errors @ output_weights.T) * scale / counts
+
+    def query_vectors(self, messages, method="infer"):
+        """
+        The (messages, vector size) vectors of the messages. Messages without any known word get a zero vector.
+        """
+        if method not in QUERY_VECTORS:
+            raise ValueError(f"Unknown query vector method {method}, expected one of {QUERY_VECTORS}")
+        ids, offsets = self.encode(messages)
+        # The mean of the word vectors is the starting point of the inference as well
+        vectors = self._average(ids, offsets)
+        if method == "average" or len(ids) == 0:
+            return vectors
+        samples = self._samples(ids, offsets, vectors)
+        # A message vector only makes up 1 / (2 * window_size + 1) of the hidden layer, going in and coming back:
+        # learning_rate is the size of a step in the hidden layer
+        step = self.learning_rate * (2 * self.window_size + 1) ** 2
+        for _ in range(self.steps):
+            _, gradient = self._loss_and_gradient(vectors, *samples)
+            vectors -= step * gradient
+        return vectors
+
+    def find(self, messages, k=5, method="infer", paragraphs=50, probes=None, aggregate="max"):
+        """
+        The k blog posts nearest to every message, as lists of (blog post, score), by the paragraphs nearest to the
+        message vector (see query_vectors), searched in batch.
+        """
+        if aggregate not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate {aggregate}, expected one of {AGGREGATES}")
+        vectors = self.query_vectors(messages, method)
+        ids, scores = self.index.search(vectors, paragraphs, probes)
+        results = []
+        for message_ids, message_scores, vector in zip(ids, scores, vectors):
+            if not vector.any():
+                results.append([])
+                continue
+            found = message_ids >= 0
+            docs = self.paragraph_docs[message_ids[found]]
+            if aggregate == "max":
+                # Hits are sorted by similarity, the first hit of a doc is its best
+                unique_docs, first = np.unique(docs, return_index=True)
+                doc_scores = message_scores[found][first]
+            else:
+                unique_docs, inverse = np.unique(docs, return_inverse=True)
+                doc_scores = np.bincount(inverse, message_scores[found])
+            best = np.argsort(-doc_scores, kind="stable")[:k]
+            results.append([(self.docs[unique_docs[i]], float(doc_scores[i])) for i in best])
+        return results
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    dir_name = path.dirname(__file__)
+    config_file = path.join(dir_name, "../config.yaml")
+    config_dict = None
+    with open(config_file) as config:
+        config_dict = yaml.load(config, Loader=yaml.Loader)
+    vocabulary = Vocabulary.load(path.join(dir_name, "..", config_dict["vocabulary"]))
+    output_head = config_dict["pvdm_output_head"]
+    model_name = "pv-dm" if output_head == "softmax" else f"pv-dm_{output_head}"
+    blog_finder = BlogFinder.load(
+        path.join(dir_name, f"../data/5_models/{model_name}_inference.npz"),
+        path.join(dir_name, "../data/4_training_data/doc_classifier/doc_to_paragraph_ids.json"),
+        vocabulary,
+        config_dict["window_size"],
+        lists=config_dict["index_lists"],
+    )
+    # Messages from the command line, or one per line from stdin
+    messages = sys.argv[1:] or [line.strip() for line in sys.stdin]
+    for message, blogs in zip(messages, blog_finder.find(messages)):
+        print(message)
+        for blog, score in blogs:
+            print(f"    {score:.3f} {blog}")
+
+
+if __name__ == "__main__":
+    main()
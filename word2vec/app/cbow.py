@@ -1,4 +1,9 @@
-from .preprocessing.training_data.training_data_builder import load_training_data, load_tokenizer
+from .preprocessing.training_data.training_data_builder import load_training_data
+from .preprocessing.training_data.vocabulary import Vocabulary
+from .preprocessing.training_data.cbow_training_builder import CbowTrainingBuilder
+from .sampled_output import SampledOutput, sampled_loss
+from .input_pipeline import array_dataset, stream_dataset, epoch_callback, fit, held_out_split, scaled_learning_rate
+from .checkpoint import similarity_correlation, training_settings
 from os import path
 import yaml
 from keras import Input, Model
@@ -6,25 +11,25 @@ from keras.backend import mean
 from keras.layers import Lambda
 from keras.layers.core import Dense, Reshape
 from keras.layers.core.embedding import Embedding
-from keras.utils import np_utils
+from keras.optimizers import RMSprop
+import tensorflow as tf
 import numpy as np
 from codetiming import Timer
 import logging
 
 
-def batch(a_list, b_list, batch_size):
-    for i in range(0, min(len(a_list), len(b_list)), batch_size):
-        yield a_list[i : i + batch_size], b_list[i : i + batch_size]
-
-
 class CBOW(object):
     logging.basicConfig(level=logging.INFO)
 
-    def __init__(self, window_size, vector_size, vocabulary_size):
+    def __init__(self, window_size, vector_size, vocabulary_size, output_head="softmax", num_sampled=64,
+                 word_counts=None, learning_rate=0.001):
         dir_name = path.dirname(__file__)
         self.input_size = window_size * 2
         self.vocab_size = vocabulary_size
-        self.model_file = path.join(dir_name, "../data/5_models/cbow.h5")
+        # "softmax", or "sampled_softmax"/"negative_sampling" (see SampledOutput), which have weights of their own
+        self.output_head = output_head
+        model_name = "cbow" if output_head == "softmax" else f"cbow_{output_head}"
+        self.model_file = path.join(dir_name, f"../data/5_models/{model_name}.h5")
         self.logger = logging.getLogger(__name__)
 
         # Neural network to compute word vectors CBOW-style
@@ -39,58 +44,70 @@ class CBOW(object):
         reshape = Reshape((vector_size, self.input_size))(context_words_embedding)
         # A single lambda node computes the mean of all input vectors
         avg = Lambda(lambda x: mean(x, axis=1))(reshape)
-        # A dense output layer that selects the focus-word-to-be by index using softmax
-        output = Dense(vocabulary_size, activation="softmax")(avg)
-        self.model = Model(inputs=context_words_input, outputs=output)
-        # Loss function: categorical cross entropy as we select across many different choices
-        self.model.compile(loss="categorical_crossentropy")
+        if output_head == "softmax":
+            # A dense output layer that selects the focus-word-to-be by index using softmax
+            output = Dense(vocabulary_size, activation="softmax")(avg)
+            self.model = Model(inputs=context_words_input, outputs=output)
+            # Loss function: categorical cross entropy as we select across many different choices, on the integer
+            # focus word ids rather than batch size x vocabulary size one-hot targets
+            self.model.compile(loss="sparse_categorical_crossentropy", optimizer=RMSprop(learning_rate=learning_rate))
+        else:
+            # The focus word id is an input of the sampled output layer, which outputs the loss itself
+            focus_word_input = Input(shape=(1,), dtype='int32')
+            output = SampledOutput(vocabulary_size, num_sampled, output_head, word_counts)([avg, focus_word_input])
+            self.model = Model(inputs=[context_words_input, focus_word_input], outputs=output)
+            self.model.compile(loss=sampled_loss, optimizer=RMSprop(learning_rate=learning_rate))
         self.model.summary(print_fn=self.logger.info)
         # Preload word vectors if some training has already been done
         if path.exists(self.model_file):
             self.weights = self.model.load_weights(self.model_file)
 
-    def train_model(self, training_data_file, epochs=3):
+    def train_model(self, training_data_file, epochs=3, batch_size=100, checkpoints=None, early_stopping=None,
+                    held_out_fraction=0.0, evaluate=None):
+        # The held out rows at the end aren't trained on, see fit for the checkpoints and the early stopping
         X_y = load_training_data(training_data_file)
-        all_X = X_y["X"]
-        all_y = X_y["y"]
-        batch_size = min(100, len(all_y))
+        columns, held_out = held_out_split(X_y.columns, int(len(X_y) * held_out_fraction))
+        validation = array_dataset(held_out, batch_size, self._to_model) if held_out else None
+        self._fit(
+            lambda epoch: array_dataset(columns, batch_size, self._to_model, seed=epoch), epochs, checkpoints,
+            early_stopping, validation, evaluate,
+        )
+
+    def train_stream(self, training_stream, epochs=3, checkpoints=None, early_stopping=None, evaluate=None):
+        # Trains on batches of context windows produced while training, see CbowTrainingBuilder.cbow_training_stream
+        columns = {"X": (np.int32, (self.input_size,)), "y": (np.int32, ())}
+        with training_stream:
+            self._fit(
+                lambda epoch: stream_dataset(training_stream, columns, self._to_model, epoch), epochs, checkpoints,
+                early_stopping, None, evaluate,
+            )
+
+    def _to_model(self, batch):
+        if self.output_head == "softmax":
+            return batch["X"], batch["y"]
+        return (batch["X"], batch["y"]), tf.zeros(tf.shape(batch["y"]), dtype=tf.float32)
+
+    def _fit(self, datasets, epochs, checkpoints, early_stopping, validation, evaluate):
         timer = Timer(
             name="CBOW training timer",
             text="Epoch training time: {minutes:.2f} minutes",
             logger=self.logger.info,
         )
-        for epoch in range(epochs):
-            loss = 0.0
-            timer.start()
-            for x, y in batch(all_X, all_y, batch_size):
-                if len(x[0]) != self.input_size or len(x) != len(y):
-                    logging.error(
-                        "Error! x[0]: {}, len(x): {}, len(y): {}".format(
-                            len(x[0]), len(x), len(y)
-                        )
-                    )
-                    break
-                loss += self.model.train_on_batch(
-                    x=np.array(list(x)),
-                    y=np.array(
-                        list(
-                            np_utils.to_categorical(focus_word_id, self.vocab_size)
-                            for focus_word_id in y
-                        )
-                    ),
-                )
-            timer.stop()
-            self.logger.info("Epoch #{}, loss: {}".format(epoch + 1, loss))
+        callback = epoch_callback(lambda epoch: timer.start(), lambda epoch: timer.stop())
+        fit(self.model, datasets, epochs, [callback], checkpoints, early_stopping, validation, evaluate)
         self.model.save_weights(self.model_file)
 
+    def word_vectors(self):
+        return self.model.layers[1].get_weights()[0]
+
 
 def main():
     dir_name = path.dirname(__file__)
     training_data_file = path.join(
         dir_name, "../data/4_training_data/cbow/training_data.dat"
     )
-    tokenizer = load_tokenizer(path.join(dir_name, "../data/4_training_data/dictionary.dat"))
-    vocabulary_size = len(tokenizer.word_index) + 1
+    vocabulary = Vocabulary.load(path.join(dir_name, "../data/4_training_data/dictionary.vocab"))
+    vocabulary_size = vocabulary.vocabulary_size()
     config_file = path.join(dir_name, "../config.yaml")
     config_dict = None
     with open(config_file) as config:
@@ -98,8 +115,34 @@ def main():
     window_size = config_dict["window_size"]
     vector_size = config_dict["vector_size"]
     epochs = config_dict["epochs"]
-    cbow_model = CBOW(window_size, vector_size, vocabulary_size)
-    cbow_model.train_model(training_data_file, epochs)
+    output_head = config_dict["cbow_output_head"]
+    word_counts = vocabulary.counts if config_dict["sampled_unigrams"] else None
+    batch_size = config_dict["batch_size"]
+    learning_rate = scaled_learning_rate(
+        config_dict["learning_rate"], batch_size, config_dict["learning_rate_scaling"]
+    )
+    cbow_model = CBOW(
+        window_size, vector_size, vocabulary_size, output_head, config_dict["sampled_words"], word_counts,
+        learning_rate
+    )
+    checkpoints, early_stopping, similarity = training_settings(config_dict, f"cbow_{output_head}", vocabulary)
+    evaluate = (lambda: similarity_correlation(cbow_model.word_vectors(), *similarity)) if similarity else None
+    if config_dict["streaming_training"]:
+        cbow_training_builder = CbowTrainingBuilder(
+            path.join(dir_name, "..", config_dict["cleaned_directory"]),
+            window_size,
+            path.join(dir_name, "..", config_dict["vocabulary"]),
+            workers=config_dict["encoder_workers"],
+        )
+        training_stream = cbow_training_builder.cbow_training_stream(
+            batch_size, config_dict["prefetch_batches"], config_dict["seed"]
+        )
+        cbow_model.train_stream(training_stream, epochs, checkpoints, early_stopping, evaluate)
+    else:
+        cbow_model.train_model(
+            training_data_file, epochs, batch_size, checkpoints, early_stopping, config_dict["held_out_fraction"],
+            evaluate
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,159 @@
+import glob
+import json
+import os
+import re
+import logging
+from os import path
+import numpy as np
+
+_STATE = "__state__"
+
+
+class Checkpoints(object):
+    """
+    Numbered checkpoints of a training run in a directory: named arrays (weights and optimizer state) plus a json
+    state (position in the run, random generator state, ...) in one .npz file per checkpoint. A checkpoint is written
+    to a .tmp file and renamed when complete, so a crash while saving never leaves a broken checkpoint behind, and
+    only the max_to_keep latest are kept. every is how often (in batches) the trainers save one.
+    """
+
+    def __init__(self, directory, prefix="checkpoint", max_to_keep=3, every=1000):
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory
+        self.prefix = prefix
+        self.max_to_keep = max_to_keep
+        self.every = every
+
+    def _file(self, step):
+        return path.join(self.directory, f"{self.prefix}-{step:010d}.npz")
+
+    def steps(self):
+        # Steps of the checkpoints in the directory, oldest first
+        pattern = re.compile(re.escape(self.prefix) + r"-(\d+)\.npz$")
+        matches = (pattern.search(file) for file in glob.glob(path.join(self.directory, f"{self.prefix}-*.npz")))
+        return sorted(int(match.group(1)) for match in matches if match)
+
+    def latest(self):
+        steps = self.steps()
+        return self._file(steps[-1]) if steps else None
+
+    def save(self, step, arrays, state):
+        os.makedirs(self.directory, exist_ok=True)
+        checkpoint_file = self._file(step)
+        with open(checkpoint_file + ".tmp", "wb") as checkpoint:
+            np.savez(checkpoint, **arrays, **{_STATE: np.array(json.dumps(state))})
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+        os.replace(checkpoint_file + ".tmp", checkpoint_file)
+        for old_step in self.steps()[:-self.max_to_keep]:
+            os.remove(self._file(old_step))
+        self.logger.info(f"Saved checkpoint {checkpoint_file}")
+        return checkpoint_file
+
+    def load(self, checkpoint_file=None):
+        """
+        Returns the arrays and the state of a checkpoint, by default the latest one, or None when there's none.
+        """
+        checkpoint_file = checkpoint_file or self.latest()
+        if checkpoint_file is None:
+            return None
+        with np.load(checkpoint_file) as checkpoint:
+            arrays = {name: checkpoint[name] for name in checkpoint.files if name != _STATE}
+            state = json.loads(str(checkpoint[_STATE]))
+        self.logger.info(f"Loaded checkpoint {checkpoint_file}")
+        return arrays, state
+
+
+class EarlyStopping(object):
+    """
+    Tells when to stop training: once a metric, e.g. a held out loss ("min") or a word similarity correlation ("max"),
+    hasn't improved by more than min_delta for patience epochs in a row.
+    """
+
+    def __init__(self, patience=2, min_delta=0.0, mode="min"):
+        if mode not in ("min", "max"):
+            raise ValueError(f"Unknown early stopping mode {mode}, expected min or max")
+        self.patience = patience
+        self.min_delta = min_delta
+        self.mode = mode
+        self.best = None
+        self.best_epoch = None
+        self.wait = 0
+
+    def _improved(self, value):
+        if self.best is None:
+            return True
+        if self.mode == "min":
+            return value < self.best - self.min_delta
+        return value > self.best + self.min_delta
+
+    def update(self, epoch, value):
+        # Records the metric of an epoch, returns whether to stop
+        if self._improved(value):
+            self.best, self.best_epoch, self.wait = value, epoch, 0
+        else:
+            self.wait += 1
+        return self.wait >= self.patience
+
+    def state(self):
+        return {"best": self.best, "best_epoch": self.best_epoch, "wait": self.wait}
+
+    def restore(self, state):
+        self.best, self.best_epoch, self.wait = state["best"], state["best_epoch"], state["wait"]
+
+
+def load_similarity_pairs(similarity_file, vocabulary):
+    """
+    Reads word similarity judgements, lines of "word word score" (like WordSim-353 or SimLex-999, tab or space
+    separated, # comments), returns the (pairs, 2) word ids and the scores of the pairs of words in the vocabulary.
+    """
+    words = []
+    scores = []
+    with open(similarity_file, encoding="utf-8") as lines:
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 3 or line.startswith("#"):
+                continue
+            try:
+                score = float(fields[2])
+            except ValueError:
+                # A header line
+                continue
+            words.extend(word.lower() for word in fields[:2])
+            scores.append(score)
+    ids = vocabulary.lookup(words).reshape(-1, 2)
+    known = np.all(ids > vocabulary.oov_id, axis=1)
+    return ids[known], np.asarray(scores, dtype=np.float32)[known]
+
+
+def similarity_correlation(embeddings, pairs, scores):
+    # Spearman correlation between the cosine similarities of the word pairs and their scores
+    vectors = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    similarities = np.einsum("ij,ij->i", vectors[pairs[:, 0]], vectors[pairs[:, 1]])
+    ranks = [np.argsort(np.argsort(values)) for values in (similarities, scores)]
+    return float(np.corrcoef(*ranks)[0, 1])
+
+
+def training_settings(config_dict, run_name, vocabulary=None):
+    """
+    The Checkpoints of the run run_name and its EarlyStopping (None when early_stopping_patience is 0), from the
+    settings of config.yaml, plus the word similarity (pairs, scores) that drives the early stopping, None when the
+    held out loss does.
+    """
+    dir_name = path.join(path.dirname(__file__), "..")
+    checkpoints = Checkpoints(
+        path.join(dir_name, config_dict["checkpoint_directory"], run_name),
+        max_to_keep=config_dict["checkpoints_to_keep"],
+        every=config_dict["checkpoint_every"],
+    )
+    if not config_dict["early_stopping_patience"]:
+        return checkpoints, None, None
+    similarity = None
+    mode = "min"
+    if config_dict["similarity_pairs"] and vocabulary is not None:
+        similarity = load_similarity_pairs(path.join(dir_name, config_dict["similarity_pairs"]), vocabulary)
+        mode = "max"
+    early_stopping = EarlyStopping(
+        config_dict["early_stopping_patience"], config_dict["early_stopping_min_delta"], mode
+    )
+    return checkpoints, early_stopping, similarity
@@ -0,0 +1,227 @@
+import json
+import os
+import sys
+import time
+import logging
+from os import path
+import numpy as np
+import yaml
+from .preprocessing.training_data.vocabulary import Vocabulary
+
+
+def _normalized(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def _merge_top_k(scores, ids, block_scores, block_ids, k):
+    # The k best of the current top k and the scores of a block, per query, unsorted
+    scores = np.concatenate([scores, block_scores], axis=1)
+    ids = np.concatenate([ids, block_ids], axis=1)
+    if scores.shape[1] > k:
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, best, axis=1)
+        ids = np.take_along_axis(ids, best, axis=1)
+    return scores, ids
+
+
+def _sorted_top_k(scores, ids):
+    order = np.argsort(-scores, axis=1, kind="stable")
+    return np.take_along_axis(ids, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+class EmbeddingIndex(object):
+    """
+    Top k cosine similarity search over embeddings, e.g. word vectors or PV-DM paragraph vectors. Every row of the
+    index has an id (the word or paragraph id) and optionally a key (the word, or the blog post of a paragraph).
+
+    Exact search takes blocked matrix multiplies of the normalized vectors: block_size vectors at a time against a
+    batch of queries, keeping a running top k, so that the queries x vectors score matrix is never built. With lists
+    > 0 the index is also an inverted file (IVF): the vectors are clustered by spherical k-means into lists, stored
+    list by list, and approximate search only scores the vectors of the probes lists nearest to a query.
+    """
+
+    def __init__(self, vectors, ids=None, keys=None, lists=0, block_size=16384, seed=0, normalized=False):
+        self.logger = logging.getLogger(__name__)
+        vectors = vectors if normalized else _normalized(vectors)
+        ids = np.arange(len(vectors), dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+        self.block_size = block_size
+        self.centroids = None
+        self.list_offsets = None
+        if lists and len(vectors) > lists:
+            self.centroids, assignments = self._kmeans(vectors, lists, np.random.default_rng(seed))
+            # The vectors of a list are stored together, list_offsets[i]:list_offsets[i + 1] are those of list i
+            order = np.argsort(assignments, kind="stable")
+            vectors, ids = vectors[order], ids[order]
+            keys = None if keys is None else [keys[row] for row in order]
+            self.list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=lists))))
+        self.vectors = vectors
+        self.ids = ids
+        self.keys = None if keys is None else list(keys)
+        self._rows_by_id = None
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def _assign(self, vectors, centroids):
+        # Nearest centroid of every vector, a block at a time
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), self.block_size):
+            block = vectors[start:start + self.block_size]
+            assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        return assignments
+
+    def _kmeans(self, vectors, lists, random, iterations=10, sample_per_list=256):
+        # Spherical k-means on a sample of the vectors, then every vector is assigned to its nearest centroid
+        sample = vectors[random.choice(len(vectors), min(len(vectors), lists * sample_per_list), replace=False)]
+        centroids = sample[random.choice(len(sample), lists, replace=False)]
+        for _ in range(iterations):
+            assignments = self._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            empty = np.bincount(assignments, minlength=lists) == 0
+            # An empty list gets a random vector of the sample as its centroid again
+            sums[empty] = sample[random.choice(len(sample), int(empty.sum()))]
+            centroids = _normalized(sums)
+        return centroids, self._assign(vectors, centroids)
+
+    def search(self, queries, k=10, probes=None, query_batch=256):
+        """
+        The ids and cosine similarities of the k vectors nearest to every query (one per row), both (queries, k)
+        and sorted by descending similarity. With probes, and lists, the search is approximate: only the vectors of
+        the probes lists nearest to a query are scored. Missing results (fewer than k vectors) get id -1.
+        """
+        queries = _normalized(np.atleast_2d(queries))
+        k = min(k, len(self))
+        if probes and self.centroids is not None and probes < len(self.centroids):
+            return self._search_lists(queries, k, probes)
+        ids = np.empty((len(queries), k), dtype=np.int64)
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        for start in range(0, len(queries), query_batch):
+            batch = queries[start:start + query_batch]
+            ids[start:start + len(batch)], scores[start:start + len(batch)] = self._search_exact(batch, k)
+        return ids, scores
+
+    def _search_exact(self, queries, k):
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(self), self.block_size):
+            block_scores = queries @ self.vectors[start:start + self.block_size].T
+            block_rows = np.broadcast_to(np.arange(start, start + block_scores.shape[1]), block_scores.shape)
+            best_scores, best_rows = _merge_top_k(best_scores, best_rows, block_scores, block_rows, k)
+        rows, scores = _sorted_top_k(best_scores, best_rows)
+        return self.ids[rows], scores
+
+    def _search_lists(self, queries, k, probes):
+        probed = np.argpartition(-(queries @ self.centroids.T), probes - 1, axis=1)[:, :probes]
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for query, lists in enumerate(probed):
+            rows = np.concatenate([np.arange(self.list_offsets[i], self.list_offsets[i + 1]) for i in lists])
+            query_scores = self.vectors[rows] @ queries[query]
+            best = np.argpartition(-query_scores, k - 1)[:k] if len(query_scores) > k else np.arange(len(rows))
+            best = best[np.argsort(-query_scores[best], kind="stable")]
+            ids[query, :len(best)] = self.ids[rows[best]]
+            scores[query, :len(best)] = query_scores[best]
+        return ids, scores
+
+    def key(self, index_id):
+        # The key of the row with id index_id
+        if self._rows_by_id is None:
+            self._rows_by_id = dict(zip(self.ids.tolist(), range(len(self.ids))))
+        return self.keys[self._rows_by_id[index_id]]
+
+    def nearest_keys(self, query, k=10, probes=None):
+        """
+        The k distinct keys nearest to a query vector, with the similarity of their nearest vector: e.g. the blog
+        posts of the paragraphs nearest to a query.
+        """
+        nearest = {}
+        candidates = k
+        while len(nearest) < k:
+            ids, scores = self.search(query, candidates, probes)
+            nearest = {}
+            for index_id, score in zip(ids[0], scores[0]):
+                if index_id >= 0:
+                    nearest.setdefault(self.key(index_id), float(score))
+            if candidates >= len(self):
+                break
+            candidates *= 4
+        return list(nearest.items())[:k]
+
+    def save(self, index_file):
+        arrays = {"vectors": self.vectors, "ids": self.ids}
+        if self.centroids is not None:
+            arrays.update(centroids=self.centroids, list_offsets=self.list_offsets)
+        if self.keys is not None:
+            arrays["keys"] = np.frombuffer("\n".join(self.keys).encode("utf-8"), dtype=np.uint8)
+        with open(index_file + ".tmp", "wb") as index:
+            np.savez(index, **arrays)
+        os.replace(index_file + ".tmp", index_file)
+
+    @staticmethod
+    def load(index_file, block_size=16384):
+        with np.load(index_file) as arrays:
+            index = EmbeddingIndex(arrays["vectors"], arrays["ids"], block_size=block_size, normalized=True)
+            if "centroids" in arrays:
+                index.centroids = arrays["centroids"]
+                index.list_offsets = arrays["list_offsets"]
+            if "keys" in arrays:
+                index.keys = arrays["keys"].tobytes().decode("utf-8").split("\n")
+        return index
+
+    @staticmethod
+    def from_word_vectors(word_vectors_file, vocabulary, lists=0, seed=0):
+        # Index of the vectors of the words of a vocabulary, without padding and the out-of-vocabulary token
+        vectors = np.load(word_vectors_file)
+        vectors = np.reshape(vectors, (vocabulary.vocabulary_size(), -1))
+        words = vocabulary.words_by_id()
+        ids = np.arange(vocabulary.oov_id + 1, vocabulary.vocabulary_size())
+        return EmbeddingIndex(vectors[ids], ids, [words[i] for i in ids], lists, seed=seed)
+
+    @staticmethod
+    def from_paragraphs(paragraph_vectors, doc_to_paragraph_ids, lists=0, seed=0):
+        # Index of the PV-DM paragraph vectors, keyed by the blog post (doc) of the paragraph
+        vectors = np.reshape(paragraph_vectors, (-1, np.shape(paragraph_vectors)[-1]))
+        ids = np.array(
+            [paragraph_id for paragraph_ids in doc_to_paragraph_ids.values() for paragraph_id in paragraph_ids]
+        )
+        keys = [doc for doc, paragraph_ids in doc_to_paragraph_ids.items() for _ in paragraph_ids]
+        return EmbeddingIndex(vectors[ids], ids, keys, lists, seed=seed)
+
+    @staticmethod
+    def from_paragraph_vectors(paragraph_vectors_file, doc_to_paragraph_ids_file, lists=0, seed=0):
+        with open(doc_to_paragraph_ids_file) as doc_to_paragraph_ids:
+            docs = json.load(doc_to_paragraph_ids)
+        return EmbeddingIndex.from_paragraphs(np.load(paragraph_vectors_file), docs, lists, seed)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    dir_name = path.dirname(__file__)
+    # words <word vectors .npy> or paragraphs <paragraph vectors .npy>, both in data/5_models
+    kind, vectors_file = sys.argv[1], path.join(dir_name, "../data/5_models", sys.argv[2])
+    config_file = path.join(dir_name, "../config.yaml")
+    config_dict = None
+    with open(config_file) as config:
+        config_dict = yaml.load(config, Loader=yaml.Loader)
+    start = time.perf_counter()
+    if kind == "words":
+        vocabulary = Vocabulary.load(path.join(dir_name, "..", config_dict["vocabulary"]))
+        index = EmbeddingIndex.from_word_vectors(vectors_file, vocabulary, config_dict["index_lists"])
+    elif kind == "paragraphs":
+        doc_to_paragraph_ids_file = path.join(
+            dir_name, "../data/4_training_data/doc_classifier/doc_to_paragraph_ids.json"
+        )
+        index = EmbeddingIndex.from_paragraph_vectors(
+            vectors_file, doc_to_paragraph_ids_file, config_dict["index_lists"]
+        )
+    else:
+        raise ValueError(f"Unknown embeddings {kind}, expected words or paragraphs")
+    index_file = path.join(dir_name, f"../data/5_models/{kind}.index.npz")
+    index.save(index_file)
+    logging.info(f"Indexed {len(index)} {kind} in {time.perf_counter() - start:.2f} seconds: {index_file}")
+
+
+if __name__ == "__main__":
+    main()
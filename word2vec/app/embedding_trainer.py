@@ -0,0 +1,404 @@
+from .preprocessing.training_data.training_data_builder import load_training_data
+from .preprocessing.training_data.vocabulary import Vocabulary
+from .preprocessing.training_data.skip_gram_pairs import AliasTable
+from .preprocessing.training_data.glove_training_builder import co_occurrence_counts
+from .checkpoint import similarity_correlation, training_settings
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+from os import path
+import sys
+import threading
+import logging
+import yaml
+import numpy as np
+from codetiming import Timer
+
+
+def _scatter_add(array, rows, values):
+    # array[rows] += values, summing the values of repeated rows (like np.add.at, but a lot faster): the rows are
+    # sorted once and the values of every run of equal rows reduced together
+    order = np.argsort(rows, kind="stable")
+    unique_rows, starts = np.unique(rows[order], return_index=True)
+    array[unique_rows] += np.add.reduceat(values[order], starts, axis=0)
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-np.clip(x, -30, 30)))
+
+
+def _log_loss(labels, scores):
+    return float(-np.sum(np.log(np.where(labels == 1, scores, 1.0 - scores) + 1e-7)))
+
+
+class EmbeddingTrainer(ABC):
+    """
+    Trains word vectors on the training data of the cbow, skip-gram or glove stage straight on NumPy arrays,
+    without Keras: every batch is a handful of vectorized gathers, dot products and scatter adds.
+
+    The rows of the training data are split in shards, which are trained on by threads Hogwild style: all threads
+    update the same arrays without any locking, a (rare) lost update on a word shared by two batches doesn't
+    matter to SGD. Most of the time goes to NumPy, which releases the GIL, so the threads do run in parallel.
+    Every epoch the shards are trained in another order; the learning rate decays linearly over all epochs.
+
+    With checkpoints, the parameters, the optimizer state, the position in the run and the random generator state
+    are saved every checkpoints.every batches and after every epoch, and a run picks up where the latest checkpoint
+    left off, in the middle of an epoch if need be.
+    """
+
+    logging.basicConfig(level=logging.INFO)
+
+    def __init__(self, vocabulary_size, vector_size, learning_rate, threads=0, batch_size=4096, seed=0):
+        self.logger = logging.getLogger(__name__)
+        self.vocabulary_size = vocabulary_size
+        self.vector_size = vector_size
+        self.learning_rate = learning_rate
+        self.threads = threads or cpu_count()
+        self.batch_size = batch_size
+        self.random = np.random.default_rng(seed)
+        # Rows trained on so far, over all epochs and threads, for the learning rate decay
+        self._progress = 0
+        self._progress_lock = threading.Lock()
+
+    def _uniform_vectors(self):
+        return ((self.random.random((self.vocabulary_size, self.vector_size), dtype=np.float32) - 0.5)
+                / self.vector_size)
+
+    @abstractmethod
+    def train_batch(self, X, y, learning_rate, random):
+        # Updates the vectors with the samples of a batch, returns their summed loss. random is the random generator
+        # of the thread
+        pass
+
+    @abstractmethod
+    def batch_loss(self, X, y, random):
+        # The summed loss of the samples of a batch, without training on them
+        pass
+
+    @abstractmethod
+    def parameters(self):
+        # The arrays trained, including the optimizer state, by name
+        pass
+
+    @abstractmethod
+    def embeddings(self):
+        # The (vocabulary size, vector size) word vectors
+        pass
+
+    def _targets(self, training_data):
+        return training_data["y"]
+
+    def _train_shard(self, training_data, start, end, total_rows, seed):
+        random = np.random.default_rng(seed)
+        loss = 0.0
+        for batch_start in range(start, end, self.batch_size):
+            batch_end = min(end, batch_start + self.batch_size)
+            rows = batch_start + random.permutation(batch_end - batch_start)
+            with self._progress_lock:
+                progress = self._progress / total_rows
+                self._progress += len(rows)
+            learning_rate = self.learning_rate * max(1e-4, 1.0 - progress)
+            # Rows of a batch are read sorted (sequentially from the memory map) and trained on shuffled
+            X = np.asarray(training_data["X"][batch_start:batch_end])[rows - batch_start]
+            y = np.asarray(self._targets(training_data)[batch_start:batch_end])[rows - batch_start]
+            loss += self.train_batch(X, y, learning_rate, random)
+        return loss
+
+    def held_out_loss(self, training_data, start):
+        # Mean loss of the rows from start on, which aren't trained on
+        random = np.random.default_rng(0)
+        loss = 0.0
+        for batch_start in range(start, len(training_data), self.batch_size):
+            batch = slice(batch_start, min(len(training_data), batch_start + self.batch_size))
+            loss += self.batch_loss(
+                np.asarray(training_data["X"][batch]), np.asarray(self._targets(training_data)[batch]), random
+            )
+        return loss / max(1, len(training_data) - start)
+
+    def _save_checkpoint(self, checkpoints, step, position, early_stopping):
+        state = dict(position, progress=self._progress)
+        if early_stopping:
+            state["early_stopping"] = early_stopping.state()
+        checkpoints.save(step, self.parameters(), state)
+
+    def _restore_checkpoint(self, checkpoints, early_stopping):
+        checkpoint = checkpoints.load()
+        if checkpoint is None:
+            return None
+        arrays, state = checkpoint
+        for name, array in self.parameters().items():
+            array[...] = arrays[name]
+        self._progress = state["progress"]
+        if early_stopping and "early_stopping" in state:
+            early_stopping.restore(state["early_stopping"])
+        return state
+
+    def train(self, training_data, epochs=1, embeddings_file=None, checkpoints=None, early_stopping=None,
+              held_out=0, evaluate=None):
+        """
+        Trains for epochs epochs on training data (see load_training_data), saving the embeddings to
+        embeddings_file_<epoch>.npy after every epoch when given. Returns the mean loss of every epoch.
+
+        checkpoints (see Checkpoints) are saved while training, and the run is resumed from the latest one. The last
+        held_out rows of the training data aren't trained on. With early_stopping (see EarlyStopping), training
+        stops once the metric of the epochs stops improving: evaluate(embeddings) when given, e.g. a word similarity
+        correlation, otherwise the loss of the held out rows (or, without any, the training loss).
+        """
+        rows = len(training_data) - held_out
+        shard_rows = self.batch_size * 16
+        shards = [(start, min(rows, start + shard_rows)) for start in range(0, rows, shard_rows)]
+        # Shards trained on between checkpoints
+        group = max(1, checkpoints.every // 16) if checkpoints else max(1, len(shards))
+        timer = Timer(name="Embedding training timer", text="Epoch training time: {:.2f} seconds",
+                      logger=self.logger.info)
+        self._progress = 0
+        position = {"epoch": 0, "shard": 0, "loss": 0.0, "losses": [], "random": self.random.bit_generator.state}
+        state = self._restore_checkpoint(checkpoints, early_stopping) if checkpoints else None
+        if state:
+            position = {name: state[name] for name in position}
+            self.logger.info(f"Resuming at epoch #{position['epoch'] + 1}, shard {position['shard']}")
+        losses = position["losses"]
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            for epoch in range(position["epoch"], epochs):
+                timer.start()
+                # The shard order and seeds of an epoch are drawn from the state saved with its checkpoints, so a
+                # resumed epoch trains the shards left in the same order
+                epoch_random = position["random"] if epoch == position["epoch"] else self.random.bit_generator.state
+                self.random.bit_generator.state = epoch_random
+                seeds = self.random.integers(0, 2 ** 31, len(shards))
+                order = self.random.permutation(len(shards))
+                first_shard = position["shard"] if epoch == position["epoch"] else 0
+                epoch_loss = position["loss"] if epoch == position["epoch"] else 0.0
+                for first in range(first_shard, len(shards), group):
+                    shard_losses = executor.map(
+                        lambda shard: self._train_shard(training_data, *shards[shard], rows * epochs, seeds[shard]),
+                        order[first:first + group],
+                    )
+                    epoch_loss += sum(shard_losses)
+                    done = min(len(shards), first + group)
+                    if checkpoints and done < len(shards):
+                        position = {"epoch": epoch, "shard": done, "loss": epoch_loss, "losses": losses,
+                                    "random": epoch_random}
+                        self._save_checkpoint(checkpoints, epoch * len(shards) + done, position, early_stopping)
+                losses.append(epoch_loss / max(1, rows))
+                timer.stop()
+                self.logger.info(f"Epoch #{epoch + 1}, loss: {losses[-1]}")
+                if embeddings_file:
+                    np.save(f"{embeddings_file}_{epoch}", self.embeddings())
+                stop = False
+                if early_stopping:
+                    if evaluate:
+                        metric = evaluate(self.embeddings())
+                    else:
+                        metric = self.held_out_loss(training_data, rows) if held_out else losses[-1]
+                    self.logger.info(f"Epoch #{epoch + 1}, early stopping metric: {metric}")
+                    stop = early_stopping.update(epoch, metric)
+                if checkpoints:
+                    position = {"epoch": epoch + 1, "shard": 0, "loss": 0.0, "losses": losses,
+                                "random": self.random.bit_generator.state}
+                    self._save_checkpoint(checkpoints, (epoch + 1) * len(shards), position, early_stopping)
+                if stop:
+                    self.logger.info(
+                        f"Stopping early, the best epoch was #{early_stopping.best_epoch + 1}: {early_stopping.best}"
+                    )
+                    break
+        return losses
+
+
+class SkipGramTrainer(EmbeddingTrainer):
+    """
+    Skip-gram with negative sampling on the (target, context) word pairs and 1/0 labels of the skip-gram training
+    data, the negative pairs are part of the training data.
+    """
+
+    def __init__(self, vocabulary_size, vector_size, learning_rate=0.025, threads=0, batch_size=4096, seed=0):
+        super().__init__(vocabulary_size, vector_size, learning_rate, threads, batch_size, seed)
+        self.word_vectors = self._uniform_vectors()
+        self.context_vectors = np.zeros_like(self.word_vectors)
+
+    def _forward(self, X):
+        word_vectors = self.word_vectors[X[:, 0]]
+        context_vectors = self.context_vectors[X[:, 1]]
+        return word_vectors, context_vectors, _sigmoid(np.einsum("ij,ij->i", word_vectors, context_vectors))
+
+    def train_batch(self, X, y, learning_rate, random):
+        word_vectors, context_vectors, scores = self._forward(X)
+        gradients = ((y - scores) * learning_rate).astype(np.float32)[:, None]
+        _scatter_add(self.word_vectors, X[:, 0], gradients * context_vectors)
+        _scatter_add(self.context_vectors, X[:, 1], gradients * word_vectors)
+        return _log_loss(y, scores)
+
+    def batch_loss(self, X, y, random):
+        return _log_loss(y, self._forward(X)[2])
+
+    def parameters(self):
+        return {"word_vectors": self.word_vectors, "context_vectors": self.context_vectors}
+
+    def embeddings(self):
+        return self.word_vectors
+
+
+class CbowTrainer(EmbeddingTrainer):
+    """
+    CBOW with negative sampling on the context windows (0 is padding) and focus words of the cbow training data:
+    the mean of the context vectors is trained to tell the focus word from negative_samples words drawn from the
+    unigram distribution raised to the power 0.75.
+    """
+
+    def __init__(self, vocabulary_size, vector_size, word_counts, negative_samples=5, learning_rate=0.05,
+                 threads=0, batch_size=4096, seed=0):
+        super().__init__(vocabulary_size, vector_size, learning_rate, threads, batch_size, seed)
+        self.negative_samples = negative_samples
+        weights = np.asarray(word_counts, dtype=np.float64) ** 0.75
+        weights[0] = 0
+        self.negative_table = AliasTable(weights if weights.sum() > 0 else np.ones(len(weights)))
+        self.word_vectors = self._uniform_vectors()
+        self.context_vectors = np.zeros_like(self.word_vectors)
+
+    def _forward(self, X, y, random):
+        context_mask = X != 0
+        context_counts = np.maximum(1, context_mask.sum(axis=1)).astype(np.float32)[:, None]
+        hidden = np.einsum("ijk,ij->ik", self.word_vectors[X], context_mask.astype(np.float32)) / context_counts
+        # The focus word and its negative samples, per sample
+        outputs = np.empty((len(y), self.negative_samples + 1), dtype=np.int64)
+        outputs[:, 0] = y
+        outputs[:, 1:] = self.negative_table.sample((len(y), self.negative_samples), random)
+        labels = np.zeros(outputs.shape, dtype=np.float32)
+        labels[:, 0] = 1
+        output_vectors = self.context_vectors[outputs]
+        scores = _sigmoid(np.einsum("ik,ijk->ij", hidden, output_vectors))
+        return context_mask, context_counts, hidden, outputs, labels, output_vectors, scores
+
+    def train_batch(self, X, y, learning_rate, random):
+        context_mask, context_counts, hidden, outputs, labels, output_vectors, scores = self._forward(X, y, random)
+        gradients = ((labels - scores) * learning_rate).astype(np.float32)
+        hidden_gradients = np.einsum("ij,ijk->ik", gradients, output_vectors) / context_counts
+        _scatter_add(self.context_vectors, outputs.ravel(), (gradients[:, :, None] * hidden[:, None, :]).reshape(
+            -1, self.vector_size))
+        rows, columns = np.nonzero(context_mask)
+        _scatter_add(self.word_vectors, X[rows, columns], hidden_gradients[rows])
+        return _log_loss(labels, scores)
+
+    def batch_loss(self, X, y, random):
+        _, _, _, _, labels, _, scores = self._forward(X, y, random)
+        return _log_loss(labels, scores)
+
+    def parameters(self):
+        return {"word_vectors": self.word_vectors, "context_vectors": self.context_vectors}
+
+    def embeddings(self):
+        return self.word_vectors
+
+
+class GloveTrainer(EmbeddingTrainer):
+    """
+    GloVe's weighted least squares with AdaGrad, as in the paper: word and context vectors plus biases are trained
+    so that w_i . c_j + b_i + b_j = log X_ij, weighted by f(X_ij) = min(1, (X_ij / x_max) ^ alpha), on the count
+    column of the glove training data. The embeddings are the sum of the word and context vectors.
+    """
+
+    def __init__(self, vocabulary_size, vector_size, x_max=100.0, alpha=0.75, learning_rate=0.05, threads=0,
+                 batch_size=4096, seed=0):
+        super().__init__(vocabulary_size, vector_size, learning_rate, threads, batch_size, seed)
+        self.x_max = x_max
+        self.alpha = alpha
+        self.word_vectors = self._uniform_vectors()
+        self.context_vectors = self._uniform_vectors()
+        self.word_biases = np.zeros(vocabulary_size, dtype=np.float32)
+        self.context_biases = np.zeros(vocabulary_size, dtype=np.float32)
+        # AdaGrad's sums of squared gradients, starting at 1 like the reference implementation
+        self.word_gradients = np.ones_like(self.word_vectors)
+        self.context_gradients = np.ones_like(self.context_vectors)
+        self.word_bias_gradients = np.ones_like(self.word_biases)
+        self.context_bias_gradients = np.ones_like(self.context_biases)
+
+    def _targets(self, training_data):
+        return co_occurrence_counts(training_data)
+
+    def parameters(self):
+        return {
+            "word_vectors": self.word_vectors,
+            "context_vectors": self.context_vectors,
+            "word_biases": self.word_biases,
+            "context_biases": self.context_biases,
+            "word_gradients": self.word_gradients,
+            "context_gradients": self.context_gradients,
+            "word_bias_gradients": self.word_bias_gradients,
+            "context_bias_gradients": self.context_bias_gradients,
+        }
+
+    def _forward(self, X, y):
+        co_occurrences = y.astype(np.float32)
+        word_vectors = self.word_vectors[X[:, 0]]
+        context_vectors = self.context_vectors[X[:, 1]]
+        weights = np.minimum(1.0, (co_occurrences / self.x_max) ** self.alpha).astype(np.float32)
+        differences = (np.einsum("ij,ij->i", word_vectors, context_vectors) + self.word_biases[X[:, 0]]
+                       + self.context_biases[X[:, 1]] - np.log(co_occurrences))
+        return word_vectors, context_vectors, weights, differences
+
+    def batch_loss(self, X, y, random):
+        _, _, weights, differences = self._forward(X, y)
+        return float(0.5 * np.sum(weights * differences * differences))
+
+    def train_batch(self, X, y, learning_rate, random):
+        i = X[:, 0]
+        j = X[:, 1]
+        word_vectors, context_vectors, weights, differences = self._forward(X, y)
+        weighted = weights * differences
+        word_updates = weighted[:, None] * context_vectors
+        context_updates = weighted[:, None] * word_vectors
+        # AdaGrad: every parameter's step is scaled down by the root of the sum of its squared gradients so far
+        _scatter_add(self.word_vectors, i,
+                     -learning_rate * word_updates / np.sqrt(self.word_gradients[i]))
+        _scatter_add(self.context_vectors, j,
+                     -learning_rate * context_updates / np.sqrt(self.context_gradients[j]))
+        _scatter_add(self.word_biases, i, -learning_rate * weighted / np.sqrt(self.word_bias_gradients[i]))
+        _scatter_add(self.context_biases, j, -learning_rate * weighted / np.sqrt(self.context_bias_gradients[j]))
+        _scatter_add(self.word_gradients, i, word_updates ** 2)
+        _scatter_add(self.context_gradients, j, context_updates ** 2)
+        _scatter_add(self.word_bias_gradients, i, weighted ** 2)
+        _scatter_add(self.context_bias_gradients, j, weighted ** 2)
+        return float(0.5 * np.sum(weighted * differences))
+
+    def embeddings(self):
+        return self.word_vectors + self.context_vectors
+
+
+def main():
+    dir_name = path.dirname(__file__)
+    model_name = sys.argv[1]
+    config_file = path.join(dir_name, "../config.yaml")
+    config_dict = None
+    with open(config_file) as config:
+        config_dict = yaml.load(config, Loader=yaml.Loader)
+    vector_size = config_dict["vector_size"]
+    threads = config_dict["trainer_threads"]
+    seed = config_dict["seed"]
+    vocabulary = Vocabulary.load(path.join(dir_name, "..", config_dict["vocabulary"]))
+    vocabulary_size = vocabulary.vocabulary_size()
+    if model_name == "cbow":
+        trainer = CbowTrainer(vocabulary_size, vector_size, vocabulary.counts, threads=threads, seed=seed)
+    elif model_name == "skip_gram":
+        trainer = SkipGramTrainer(vocabulary_size, vector_size, threads=threads, seed=seed)
+    elif model_name == "glove":
+        trainer = GloveTrainer(
+            vocabulary_size, vector_size, config_dict["glove_x_max"], config_dict["glove_alpha"], threads=threads,
+            seed=seed
+        )
+    else:
+        raise ValueError(f"Unknown model {model_name}, expected cbow, skip_gram or glove")
+    training_data = load_training_data(path.join(dir_name, f"../data/4_training_data/{model_name}/training_data.dat"))
+    embeddings_file = path.join(dir_name, f"../data/5_models/{model_name}_embeddings")
+    checkpoints, early_stopping, similarity = training_settings(config_dict, f"numpy_{model_name}", vocabulary)
+    evaluate = None
+    if similarity:
+        def evaluate(embeddings):
+            return similarity_correlation(embeddings, *similarity)
+    held_out = int(len(training_data) * config_dict["held_out_fraction"])
+    trainer.train(
+        training_data, config_dict["epochs"], embeddings_file, checkpoints, early_stopping, held_out, evaluate
+    )
+
+
+if __name__ == "__main__":
+    main()
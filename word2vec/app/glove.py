@@ -1,7 +1,13 @@
-from .preprocessing.training_data.training_data_builder import load_training_data, load_tokenizer
+from .preprocessing.training_data.training_data_builder import load_training_data
+from .preprocessing.training_data.vocabulary import Vocabulary
+from .preprocessing.training_data.glove_training_builder import GloveTrainingBuilder, co_occurrence_counts
+from .input_pipeline import array_dataset, stream_dataset, epoch_callback, fit, held_out_split, scaled_learning_rate
+from .checkpoint import similarity_correlation, training_settings
 from os import path
 from keras import Input, Model
-from keras.layers import Dot
+from keras.layers import Add, Dot
+from keras.initializers import RandomUniform
+from keras.optimizers import Adagrad, RMSprop
 from keras.layers.core import Dense, Reshape
 from keras.layers.embeddings import Embedding
 from tensorflow.keras.utils import plot_model
@@ -9,27 +15,61 @@ import logging
 import yaml
 from codetiming import Timer
 import numpy as np
+import tensorflow as tf
 
 
-def batch(i_list, j_list, out_list, batch_size):
-    for i in range(0, min(len(i_list), len(j_list), len(out_list)), batch_size):
-        yield i_list[i: i + batch_size], j_list[i: i + batch_size], out_list[i: i + batch_size]
+# Training objectives: the GloVe paper's weighted least squares, or the sigmoid of the dot product against the capped
+# log co-occurrence count under plain mean squared error (what was trained before)
+OBJECTIVES = ("weighted_least_squares", "sigmoid_mse")
 
 
 class Glove(object):
     logging.basicConfig(level=logging.INFO)
 
-    def __init__(self, vector_size, vocabulary_size, word_vector_file):
+    def __init__(self, vector_size, vocabulary_size, word_vector_file, objective="sigmoid_mse", x_max=100.0,
+                 alpha=0.75, learning_rate=None):
         dir_name = path.dirname(__file__)
         self.logger = logging.getLogger(__name__)
-        self.model_file = path.join(dir_name, "../data/5_models/glove.h5")
+        if objective not in OBJECTIVES:
+            raise ValueError(f"Unknown GloVe objective {objective}, expected one of {OBJECTIVES}")
+        self.objective = objective
+        model_name = "glove" if objective == "sigmoid_mse" else f"glove_{objective}"
+        self.model_file = path.join(dir_name, f"../data/5_models/{model_name}.h5")
+        self.embeddings_file = path.join(dir_name, f"../data/5_models/{model_name}_embeddings")
+        self.vector_size = vector_size
         self.vocabulary_size = vocabulary_size
+        # Weighting function f(x) = min(1, (x / x_max) ^ alpha) of the weighted least squares
+        self.x_max = x_max
+        self.alpha = alpha
 
+        # AdaGrad's learning rate of the paper for the weighted least squares, RMSprop's default for sigmoid_mse
+        if objective == "weighted_least_squares":
+            self.model = self._weighted_least_squares_model(vector_size, learning_rate or 0.05)
+        else:
+            self.model = self._sigmoid_mse_model(vector_size, learning_rate or 0.001)
+
+        self.model.summary(print_fn=self.logger.info)
+        # plot_model(model=self.model, to_file="Glove model.png", show_shapes=True)
+        # Preload word vectors if some training has already been done
+        if word_vector_file and path.exists(path.join(dir_name, f"../data/5_models/{word_vector_file}")):
+            word_vectors = np.load(path.join(dir_name, f"../data/5_models/{word_vector_file}"))
+            word_vectors = np.reshape(word_vectors, (1, vocabulary_size, vector_size))
+            if objective == "weighted_least_squares":
+                # Split evenly between the word and the context vectors, which add up to the word vectors
+                self.model.get_layer("word_vectors").set_weights(word_vectors / 2)
+                self.model.get_layer("context_vectors").set_weights(word_vectors / 2)
+            else:
+                self.model.layers[2].set_weights(word_vectors)
+                self.model.layers[3].set_weights(word_vectors)
+        if path.exists(self.model_file):
+            self.model.load_weights(self.model_file)
+
+    def _sigmoid_mse_model(self, vector_size, learning_rate):
         word_i_input = Input((1,))
         word_j_input = Input((1,))
 
         word_i_embedding = Embedding(
-            input_dim=vocabulary_size,
+            input_dim=self.vocabulary_size,
             output_dim=vector_size,
             embeddings_initializer="glorot_uniform",
             input_length=1,
@@ -39,7 +79,7 @@ class Glove(object):
         word_i_graph = Reshape((vector_size, 1))(word_i_embedding)
 
         word_j_embedding = Embedding(
-            input_dim=vocabulary_size,
+            input_dim=self.vocabulary_size,
             output_dim=vector_size,
             embeddings_initializer="glorot_uniform",
             input_length=1,
@@ -52,49 +92,94 @@ class Glove(object):
         dot_product = Dot(axes=1)([word_i_graph, word_j_graph])
         dot_product_reshaped = Reshape((1,))(dot_product)
         output = Dense(1, activation="sigmoid")(dot_product_reshaped)
-        self.model = Model(inputs=[word_i_input, word_j_input], outputs=output)
+        model = Model(inputs=[word_i_input, word_j_input], outputs=output)
         # Loss function is mean squared error from a predicted co-occurrence likelihood value
-        self.model.compile(loss="mse")
-
-        self.model.summary(print_fn=self.logger.info)
-        # plot_model(model=self.model, to_file="Glove model.png", show_shapes=True)
-        # Preload word vectors if some training has already been done
-        if word_vector_file and path.exists(path.join(dir_name, f"../data/5_models/{word_vector_file}")):
-            word_vectors = np.load(path.join(dir_name, f"../data/5_models/{word_vector_file}"))
-            self.model.layers[2].set_weights(word_vectors)
-            self.model.layers[3].set_weights(word_vectors)
-        if path.exists(self.model_file):
-            self.model.load_weights(self.model_file)
-
-    def train_model(self, training_data_file, epochs=3):
+        model.compile(loss="mse", optimizer=RMSprop(learning_rate=learning_rate))
+        return model
+
+    def _weighted_least_squares_model(self, vector_size, learning_rate):
+        # w_i . c_j + b_i + b_j is fitted to log X_ij: separate (trainable) word and context vectors and biases,
+        # weighted by f(X_ij) through the sample weights, with AdaGrad as in the paper
+        word_i_input = Input((1,), dtype="int32")
+        word_j_input = Input((1,), dtype="int32")
+        initializer = RandomUniform(-0.5 / vector_size, 0.5 / vector_size)
+        word_i_embedding = Embedding(
+            self.vocabulary_size, vector_size, embeddings_initializer=initializer, input_length=1, name="word_vectors"
+        )(word_i_input)
+        word_j_embedding = Embedding(
+            self.vocabulary_size, vector_size, embeddings_initializer=initializer, input_length=1,
+            name="context_vectors"
+        )(word_j_input)
+        word_i_bias = Embedding(
+            self.vocabulary_size, 1, embeddings_initializer="zeros", input_length=1, name="word_biases"
+        )(word_i_input)
+        word_j_bias = Embedding(
+            self.vocabulary_size, 1, embeddings_initializer="zeros", input_length=1, name="context_biases"
+        )(word_j_input)
+        dot_product = Dot(axes=2)([word_i_embedding, word_j_embedding])
+        output = Reshape((1,))(Add()([dot_product, word_i_bias, word_j_bias]))
+        model = Model(inputs=[word_i_input, word_j_input], outputs=output)
+        model.compile(loss="mse", optimizer=Adagrad(learning_rate=learning_rate, initial_accumulator_value=1.0))
+        return model
+
+    def word_vectors(self):
+        if self.objective == "weighted_least_squares":
+            # The sum of the word and context vectors, as in the paper
+            return (self.model.get_layer("word_vectors").get_weights()[0]
+                    + self.model.get_layer("context_vectors").get_weights()[0])
+        return self.model.layers[2].get_weights()[0]
+
+    def train_model(self, training_data_file, epochs=3, batch_size=100, checkpoints=None, early_stopping=None,
+                    held_out_fraction=0.0, evaluate=None):
+        # Column views into the memory mapped training data, batches are only read when trained on. The held out
+        # rows at the end aren't trained on, see fit for the checkpoints and the early stopping
         X_y = load_training_data(training_data_file)
-        word_pairs = X_y["X"]
-        i_words, j_words = zip(*word_pairs)
-        i_words = np.array(i_words, dtype="int32")
-        j_words = np.array(j_words, dtype="int32")
-        expected_out = X_y["y"]
-        batch_size = min(100, len(expected_out))
+        if self.objective == "sigmoid_mse":
+            columns = {"X": X_y["X"], "y": X_y["y"]}
+        else:
+            columns = {"X": X_y["X"], "count": co_occurrence_counts(X_y)}
+        columns, held_out = held_out_split(columns, int(len(X_y) * held_out_fraction))
+        validation = array_dataset(held_out, batch_size, self._to_model) if held_out else None
+        self._fit(
+            lambda epoch: array_dataset(columns, batch_size, self._to_model, seed=epoch), epochs, checkpoints,
+            early_stopping, validation, evaluate,
+        )
+
+    def train_stream(self, training_stream, epochs=3, checkpoints=None, early_stopping=None, evaluate=None):
+        # Trains on batches of co-occurrences read while training, see GloveTrainingBuilder.glove_training_stream
+        # (with counts=True for the weighted least squares)
+        target = "y" if self.objective == "sigmoid_mse" else "count"
+        columns = {"X": (np.int32, (2,)), target: (np.float32, ())}
+        with training_stream:
+            self._fit(
+                lambda epoch: stream_dataset(training_stream, columns, self._to_model, epoch), epochs, checkpoints,
+                early_stopping, None, evaluate,
+            )
+
+    def _to_model(self, batch):
+        x = (batch["X"][:, 0], batch["X"][:, 1])
+        if self.objective == "sigmoid_mse":
+            return x, batch["y"]
+        counts = tf.cast(batch["count"], tf.float32)
+        weights = tf.minimum(1.0, tf.pow(counts / self.x_max, self.alpha))
+        return x, tf.math.log(counts), weights
+
+    def _fit(self, datasets, epochs, checkpoints, early_stopping, validation, evaluate):
         timer = Timer(
             name="GloVe training timer",
             text="Epoch training time: {minutes:.2f} minutes",
             logger=self.logger.info,
         )
-        for epoch in range(epochs):
-            loss = 0.0
-            training_file = path.join(path.dirname(__file__), f"../data/5_models/glove_embeddings_{epoch+20}")
-            np.save(training_file, self.model.layers[2].get_weights())
-            timer.start()
-            for iw_batch, jw_batch, expect_out_batch in batch(
-                    i_words, j_words, expected_out, batch_size
-            ):
-                loss += self.model.train_on_batch(
-                    x=[np.array(iw_batch), np.array(jw_batch)], y=np.array(expect_out_batch)
-                )
-            timer.stop()
-            logging.info("Epoch #{}, loss: {}".format(epoch + 1, loss))
+        callback = epoch_callback(lambda epoch: timer.start(), lambda epoch: self._end_epoch(epoch, timer))
+        fit(self.model, datasets, epochs, [callback], checkpoints, early_stopping, validation, evaluate)
+        self.model.save_weights(self.model_file)
+
+    def _end_epoch(self, epoch, timer):
+        timer.stop()
+        if self.objective == "sigmoid_mse":
             trained_embeddings = self.model.layers[2].get_weights()
             self.model.layers[3].set_weights(trained_embeddings)
-        self.model.save_weights(self.model_file)
+        np.save(f"{self.embeddings_file}_{epoch}", self.word_vectors())
 
 
 def main():
@@ -110,16 +195,47 @@ def main():
     with open(config_file) as config:
         config_dict = yaml.load(config, Loader=yaml.Loader)
     vector_size = config_dict["vector_size"]
-    tokenizer = load_tokenizer(path.join(dir_name, "../data/4_training_data/dictionary.dat"))
-    vocabulary_size = len(tokenizer.word_index) + 1
+    vocabulary = Vocabulary.load(path.join(dir_name, "../data/4_training_data/dictionary.vocab"))
+    vocabulary_size = vocabulary.vocabulary_size()
     # test data:
     # vector_size = 3
     epochs = config_dict["epochs"]
     # glove_model = Glove(vector_size, vocabulary_size, "glove_embeddings_5.npy")
-    glove_model = Glove(vector_size, vocabulary_size, None)
+    objective = config_dict["glove_objective"]
+    batch_size = config_dict["batch_size"]
+    if objective == "sigmoid_mse":
+        learning_rate = scaled_learning_rate(
+            config_dict["learning_rate"], batch_size, config_dict["learning_rate_scaling"]
+        )
+    else:
+        # AdaGrad scales its steps by the gradients seen so far, its learning rate is used as it is
+        learning_rate = config_dict["glove_learning_rate"]
+    glove_model = Glove(
+        vector_size, vocabulary_size, None, objective, config_dict["glove_x_max"], config_dict["glove_alpha"],
+        learning_rate
+    )
     # test data:
     # glove_model = Glove(vector_size, 89)
-    glove_model.train_model(training_data_file, epochs)
+    checkpoints, early_stopping, similarity = training_settings(config_dict, f"glove_{objective}", vocabulary)
+    evaluate = (lambda: similarity_correlation(glove_model.word_vectors(), *similarity)) if similarity else None
+    if config_dict["streaming_training"]:
+        glove_training_builder = GloveTrainingBuilder(
+            path.join(dir_name, "..", config_dict["cleaned_directory"]),
+            config_dict["window_size"],
+            path.join(dir_name, "..", config_dict["vocabulary"]),
+            workers=config_dict["encoder_workers"],
+            distance_weighting=config_dict["glove_distance_weighting"],
+            memory_budget=config_dict["glove_memory_mb"] * 1024 * 1024,
+        )
+        training_stream = glove_training_builder.glove_training_stream(
+            batch_size, config_dict["prefetch_batches"], config_dict["seed"], counts=objective != "sigmoid_mse"
+        )
+        glove_model.train_stream(training_stream, epochs, checkpoints, early_stopping, evaluate)
+    else:
+        glove_model.train_model(
+            training_data_file, epochs, batch_size, checkpoints, early_stopping, config_dict["held_out_fraction"],
+            evaluate
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,236 @@
+import json
+import math
+import logging
+import numpy as np
+import tensorflow as tf
+from keras.callbacks import Callback, LambdaCallback
+from .preprocessing.training_data.sentence_classifier_training_builder import sentence_batches
+
+# Batch size the learning rates of the models were tuned for, when they were trained 100 samples at a time
+BASE_BATCH_SIZE = 100
+
+
+def scaled_learning_rate(learning_rate, batch_size, scaling="sqrt", base_batch_size=BASE_BATCH_SIZE):
+    """
+    The learning rate for batch_size, given the one for base_batch_size: scaled linearly with the batch size
+    ("linear", Goyal et al.), with its square root ("sqrt", safer for adaptive optimizers) or not at all ("none").
+    """
+    if scaling == "linear":
+        return learning_rate * batch_size / base_batch_size
+    if scaling == "sqrt":
+        return learning_rate * math.sqrt(batch_size / base_batch_size)
+    if scaling in (None, "none"):
+        return learning_rate
+    raise ValueError(f"Unknown learning rate scaling {scaling}, expected linear, sqrt or none")
+
+
+def _shuffled(index, batch, seed):
+    # The rows of a dict of columns, all in the same random order. Stateless: the order only depends on the seed and
+    # the index of the block, however the parallel calls are scheduled
+    columns = list(batch.values())
+    keys = tf.random.stateless_uniform(tf.shape(columns[0])[:1], seed=tf.stack([tf.constant(seed, tf.int64), index]))
+    order = tf.argsort(keys)
+    return {name: tf.gather(column, order) for name, column in batch.items()}
+
+
+def _model_batches(dataset, batch_size, to_model, seed, shuffle_blocks):
+    # Blocks of rows to shuffled batches of batch_size rows, mapped to what model.fit takes
+    return (
+        dataset.enumerate()
+        .map(lambda index, block: _shuffled(index, block, seed), num_parallel_calls=tf.data.AUTOTUNE)
+        .unbatch()
+        .shuffle(shuffle_blocks * batch_size, seed=seed, reshuffle_each_iteration=True)
+        .batch(batch_size)
+        .map(to_model, num_parallel_calls=tf.data.AUTOTUNE)
+        .prefetch(tf.data.AUTOTUNE)
+    )
+
+
+def array_dataset(columns, batch_size, to_model, seed=0, shuffle_blocks=16):
+    """
+    A shuffled, prefetched tf.data dataset of the training data columns (e.g. the memory mapped columns of
+    TrainingData), to train on with model.fit.
+
+    Rows are read in blocks of batch_size rows, by parallel reads of the memory map; every epoch the blocks are read
+    in another order, and their rows are shuffled and mixed with those of the shuffle_blocks blocks read before them.
+    Nothing but the blocks in flight is held in memory. to_model maps every batch, a dict of the columns as tensors,
+    to what model.fit takes, (x, y) or (x, y, sample_weight); it runs in parallel as well. The order of the rows only
+    depends on the seed: fit takes a dataset per epoch, seeded with the epoch.
+    """
+    names = list(columns)
+    rows = len(columns[names[0]])
+    dtypes = [tf.as_dtype(columns[name].dtype) for name in names]
+    row_shapes = [tuple(columns[name].shape[1:]) for name in names]
+
+    def read_block(block):
+        start = int(block) * batch_size
+        return [np.asarray(columns[name][start:start + batch_size]) for name in names]
+
+    def read(block):
+        values = tf.numpy_function(read_block, [block], dtypes)
+        for value, row_shape in zip(values, row_shapes):
+            value.set_shape((None,) + row_shape)
+        return dict(zip(names, values))
+
+    blocks = tf.data.Dataset.range(-(-rows // batch_size))
+    blocks = blocks.shuffle(-(-rows // batch_size), seed=seed, reshuffle_each_iteration=True)
+    return _model_batches(
+        blocks.map(read, num_parallel_calls=tf.data.AUTOTUNE), batch_size, to_model, seed, shuffle_blocks
+    )
+
+
+def stream_dataset(training_stream, columns, to_model, epoch=0, shuffle_blocks=16):
+    """
+    A tf.data dataset of the batches of an epoch of a TrainingStream, to train on with model.fit. columns declares
+    the name -> (dtype, row shape) of the two columns of the (X, y) batches, like the columns of a
+    TrainingDataWriter.
+    """
+    names = list(columns)
+
+    def batches():
+        for X, y in training_stream.epoch(epoch):
+            yield dict(zip(names, (X, y)))
+
+    signature = {
+        name: tf.TensorSpec((None,) + tuple(row_shape), tf.as_dtype(np.dtype(dtype)))
+        for name, (dtype, row_shape) in columns.items()
+    }
+    dataset = tf.data.Dataset.from_generator(batches, output_signature=signature)
+    return _model_batches(dataset, training_stream.batch_size, to_model, epoch, shuffle_blocks)
+
+
+def sentence_dataset(training_data, batch_size, to_model, seed=0, messages=None, bucket_messages=0):
+    """
+    A tf.data dataset of the bigram/trigram pairs of the sentence classifier training data (the word ids of every
+    message with their lengths, and a label per message, see SentenceClassifierTrainingBuilder), to train on with
+    model.fit. The batches of pairs are made in NumPy by sentence_batches, from the messages (all by default) in the
+    order of the seed, and mapped by to_model in parallel.
+    """
+    signature = {
+        "bigrams": tf.TensorSpec((None, 2), tf.int32),
+        "trigrams": tf.TensorSpec((None, 3), tf.int32),
+        "y": tf.TensorSpec((None,), tf.int32),
+    }
+    offsets = training_data.offsets("ids")
+
+    def batches():
+        return sentence_batches(
+            training_data["ids"], offsets, training_data["y"], batch_size, seed, messages, bucket_messages
+        )
+
+    return (
+        tf.data.Dataset.from_generator(batches, output_signature=signature)
+        .map(to_model, num_parallel_calls=tf.data.AUTOTUNE)
+        .prefetch(tf.data.AUTOTUNE)
+    )
+
+
+def held_out_split(columns, held_out):
+    # The columns without their last held_out rows, and those rows
+    if not held_out:
+        return columns, None
+    rows = len(next(iter(columns.values()))) - held_out
+    return {name: column[:rows] for name, column in columns.items()}, \
+        {name: column[rows:] for name, column in columns.items()}
+
+
+class TrainingCheckpoint(Callback):
+    """
+    Checkpoints of a Keras training run, in the directory of checkpoints (see Checkpoints): the model weights, the
+    optimizer state, the position in the run (the epoch and the batches of it trained on) and the early stopping
+    state. They're saved every checkpoints.every batches while training and by fit after every epoch, with
+    tf.train.CheckpointManager, which writes them atomically and only keeps the checkpoints.max_to_keep latest.
+    """
+
+    def __init__(self, checkpoints, model):
+        super().__init__()
+        self.logger = logging.getLogger(__name__)
+        self.every = checkpoints.every
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.batch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.early_stopping = tf.Variable("", dtype=tf.string, trainable=False)
+        # Batches of the epoch skipped when resuming, the batch numbers of model.fit start over from 0
+        self.first_batch = 0
+        checkpoint = tf.train.Checkpoint(
+            model=model, optimizer=model.optimizer, epoch=self.epoch, batch=self.batch,
+            early_stopping=self.early_stopping,
+        )
+        self.manager = tf.train.CheckpointManager(checkpoint, checkpoints.directory, checkpoints.max_to_keep)
+
+    def restore(self, early_stopping=None):
+        """
+        Restores the latest checkpoint, if any, and returns the epoch and batch to resume at. The optimizer state
+        is restored when the optimizer creates its variables, on the first batch trained.
+        """
+        if self.manager.latest_checkpoint is None:
+            return 0, 0
+        self.manager.checkpoint.restore(self.manager.latest_checkpoint)
+        if early_stopping and self.early_stopping.numpy():
+            early_stopping.restore(json.loads(self.early_stopping.numpy().decode("utf-8")))
+        self.logger.info(f"Resuming {self.manager.latest_checkpoint} at epoch #{int(self.epoch) + 1}, "
+                         f"batch {int(self.batch)}")
+        return int(self.epoch), int(self.batch)
+
+    def save(self, epoch, batch, early_stopping=None):
+        self.epoch.assign(epoch)
+        self.batch.assign(batch)
+        if early_stopping:
+            self.early_stopping.assign(json.dumps(early_stopping.state()))
+        self.manager.save()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch.assign(epoch)
+
+    def on_train_batch_end(self, batch, logs=None):
+        batch = self.first_batch + batch + 1
+        if batch % self.every == 0:
+            self.save(int(self.epoch), batch)
+
+
+def fit(model, datasets, epochs, callbacks=(), checkpoints=None, early_stopping=None, validation=None,
+        evaluate=None):
+    """
+    model.fit for epochs epochs, an epoch at a time on datasets(epoch), the training data in the order of that epoch
+    (see array_dataset), so that a run can be resumed in the middle of an epoch: with checkpoints (see
+    TrainingCheckpoint) the run resumes from the latest checkpoint, skipping the batches of the epoch it has
+    trained on.
+
+    With early_stopping (see EarlyStopping) training stops once the metric of the epochs stops improving:
+    evaluate() when given, e.g. a word similarity correlation, otherwise the loss on the validation dataset (or,
+    without any, the training loss).
+    """
+    checkpoint = TrainingCheckpoint(checkpoints, model) if checkpoints else None
+    first_epoch, first_batch = checkpoint.restore(early_stopping) if checkpoint else (0, 0)
+    callbacks = list(callbacks) + ([checkpoint] if checkpoint else [])
+    for epoch in range(first_epoch, epochs):
+        skip = first_batch if epoch == first_epoch else 0
+        if checkpoint:
+            checkpoint.first_batch = skip
+        history = model.fit(
+            datasets(epoch).skip(skip), initial_epoch=epoch, epochs=epoch + 1, verbose=2, callbacks=callbacks
+        )
+        stop = False
+        if early_stopping:
+            if evaluate:
+                metric = evaluate()
+            elif validation is not None:
+                metric = model.evaluate(validation, verbose=0)
+            else:
+                metric = history.history["loss"][-1]
+            logging.getLogger(__name__).info(f"Epoch #{epoch + 1}, early stopping metric: {metric}")
+            stop = early_stopping.update(epoch, metric)
+        if checkpoint:
+            checkpoint.save(epoch + 1, 0, early_stopping)
+        if stop:
+            logging.getLogger(__name__).info(
+                f"Stopping early, the best epoch was #{early_stopping.best_epoch + 1}: {early_stopping.best}"
+            )
+            break
+
+
+def epoch_callback(on_epoch_begin=None, on_epoch_end=None):
+    # Per epoch work of the trainers, e.g. saving the embeddings, as a model.fit callback taking the epoch number
+    return LambdaCallback(
+        on_epoch_begin=(lambda epoch, logs: on_epoch_begin(epoch)) if on_epoch_begin else None,
+        on_epoch_end=(lambda epoch, logs: on_epoch_end(epoch)) if on_epoch_end else None,
+    )
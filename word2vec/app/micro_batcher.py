@@ -0,0 +1,92 @@
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+
+# Put on the queue by close, the worker stops once the requests before it are answered
+_CLOSE = object()
+
+
+class MicroBatcher(object):
+    """
+    Answers single requests from many threads with batched calls: a worker thread takes the requests submitted while
+    the first of a batch waits (at most max_wait seconds, or until there are max_batch_size of them) and answers them
+    all with one call of handle_batch, which takes a list of requests and returns a list of results in the same order.
+
+    A request is answered through the Future submit returns; if handle_batch fails, all requests of the batch fail.
+    """
+
+    def __init__(self, handle_batch, max_batch_size=256, max_wait=0.002):
+        self.logger = logging.getLogger(__name__)
+        self.handle_batch = handle_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._requests = queue.Queue()
+        self._closed = False
+        # Nothing is submitted after close
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._work, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, request):
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The micro batcher is closed")
+            self._requests.put((request, future))
+        return future
+
+    def __call__(self, request, timeout=None):
+        # Blocks until the batch of the request is handled
+        return self.submit(request).result(timeout)
+
+    def _next_batch(self):
+        first = self._requests.get()
+        if first is _CLOSE:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                request = self._requests.get(timeout=timeout) if timeout > 0 else self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is _CLOSE:
+                # Handled after this batch
+                self._requests.put(_CLOSE)
+                break
+            batch.append(request)
+        return batch
+
+    def _work(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            requests = [request for request, _ in batch]
+            try:
+                results = self.handle_batch(requests)
+            except Exception as error:
+                self.logger.exception(f"Batch of {len(requests)} requests failed")
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def close(self):
+        # Answers the requests already submitted, then stops the worker
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._requests.put(_CLOSE)
+        self._worker.join()
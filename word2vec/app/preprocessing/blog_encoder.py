@@ -1,49 +1,131 @@
+import os
+import time
 import numpy as np
 import h5py
+import yaml
 from os import path, listdir
 import logging
-from app.preprocessing.cleaning.data_cleaner import DataCleaner
-from app.preprocessing.parsing.blog_parser import get_blog_as_string
+from app.preprocessing.cleaning.data_cleaner import clean_line, load_stop_words
+from app.preprocessing.manifest import StageManifest, MANIFEST_DIR
+from app.preprocessing.parsing.blog_parser import parse_blog
+from app.pretrained_glove import load_glove
 
-def load_embeddings(embeddings_file):
-    embeddings = dict()
-    with open(embeddings_file, "r", encoding="UTF-8") as emb:
-        for line in emb:
-            word_embedding = line.split()
-            word = word_embedding[0]
-            embedding = np.array(word_embedding[1:], dtype=np.float64)
-            embeddings[word] = embedding
-    return embeddings
+# Rows of word vectors per HDF5 chunk: a blog post's matrix is read in a few chunks, each compressed on its own
+CHUNK_ROWS = 4096
+
+
+def load_embeddings(vectors_file, vocabulary_file):
+    # The pretrained vectors converted by convert_glove, memory mapped, and their vocabulary
+    return load_glove(vectors_file, vocabulary_file)
+
+
+class BlogEmbeddings(object):
+    """
+    The word vector matrices of the blog posts encoded by BlogEncoder, from its store: an HDF5 file with the vectors
+    of all words of all posts one after the other ("vectors", chunked and compressed), the post names ("names") and
+    where the rows of every post start ("offsets", one more than there are posts). A post's matrix is one slice.
+    """
+
+    def __init__(self, store_file):
+        self._store = h5py.File(store_file, "r")
+        self.vectors = self._store["vectors"]
+        self.offsets = self._store["offsets"][:]
+        self.names = [name.decode("utf-8") for name in self._store["names"][:]]
+        self._positions = {name: i for i, name in enumerate(self.names)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._positions
+
+    def __getitem__(self, name):
+        # The (words, vector size) float32 matrix of a blog post
+        i = self._positions[name]
+        return self.vectors[self.offsets[i]:self.offsets[i + 1]]
+
+    def close(self):
+        self._store.close()
 
 
 class BlogEncoder(object):
-    def __init__(self, blog_dir, target_dir, word_embeddings_file, stop_words):
+    """
+    Encodes every blog post as the matrix of the word vectors of its cleaned words (unknown words get the
+    out-of-vocabulary row), all of them into a single store (see BlogEmbeddings). The vectors of a post are looked up
+    with one take on its word ids and appended to the store as float32.
+    """
+
+    logging.basicConfig(level=logging.INFO)
+
+    def __init__(self, blog_dir, store_file, word_embeddings_file, vocabulary_file, manifest_dir=MANIFEST_DIR):
         dir_name = path.dirname(__file__)
-        self.blog_directory = path.join(dir_name, "../../../", blog_dir)
-        self.target_directory = path.join(dir_name, target_dir)
-        self.data_cleaner = DataCleaner(stop_words)
-        self.word_embeddings = load_embeddings(word_embeddings_file)
+        self.logger = logging.getLogger(__name__)
+        self.blog_directory = path.join(dir_name, "../../", blog_dir)
+        self.store_file = path.join(dir_name, "../../", store_file)
+        self.word_embeddings_file = word_embeddings_file
+        self.vocabulary_file = vocabulary_file
+        self.stop_words = load_stop_words()
+        self.manifest_dir = manifest_dir
+        self.word_embeddings, self.vocabulary = load_embeddings(word_embeddings_file, vocabulary_file)
+
+    def encode_blog(self, blog_file):
+        # The (words, vector size) float32 matrix of a blog post
+        cleaned_blog = clean_line(" ".join(parse_blog(blog_file)), self.stop_words)
+        return np.take(self.word_embeddings, self.vocabulary.lookup(cleaned_blog.split()), axis=0).astype(np.float32)
 
     def encode_blogs(self):
-        for filename in listdir(self.blog_directory):
-            blog_as_string = get_blog_as_string(self.blog_directory, filename)
-            cleaned_blog = self.data_cleaner.clean_line(blog_as_string)
-            words = cleaned_blog.split()
-            encoded_blog = np.array(
-                [self.word_embeddings[word] for word in words], dtype=np.float64
-            )
-            logging.info(
-                "Dimensions of encoded blog {}: {}", filename, encoded_blog.shape
+        filenames = sorted(listdir(self.blog_directory))
+        blog_files = [path.join(self.blog_directory, filename) for filename in filenames]
+        manifest = StageManifest("encode_blogs", self.manifest_dir)
+        inputs = blog_files + [self.word_embeddings_file, self.vocabulary_file]
+        if manifest.is_up_to_date("store", inputs, [self.store_file], {"blogs": filenames}):
+            self.logger.info(f"Encoded blogs are up to date: {self.store_file}")
+            return
+        start = time.perf_counter()
+        vector_size = self.word_embeddings.shape[1]
+        offsets = [0]
+        # Written to a temporary file first so that the serving side never opens a half written store
+        with h5py.File(self.store_file + ".tmp", "w") as store:
+            vectors = store.create_dataset(
+                "vectors", shape=(0, vector_size), maxshape=(None, vector_size), dtype=np.float32,
+                chunks=(CHUNK_ROWS, vector_size), compression="gzip", shuffle=True,
             )
-            encoded_blog_filename = path.splitext(filename) + ".h5"
-            with h5py.File(
-                path.join(self.target_directory, encoded_blog_filename), "w"
-            ) as h5writer:
-                h5writer.create_dataset("blog", data=encoded_blog)
+            for filename, blog_file in zip(filenames, blog_files):
+                encoded_blog = self.encode_blog(blog_file)
+                self.logger.debug(f"Dimensions of encoded blog {filename}: {encoded_blog.shape}")
+                vectors.resize(offsets[-1] + len(encoded_blog), axis=0)
+                vectors[offsets[-1]:] = encoded_blog
+                offsets.append(offsets[-1] + len(encoded_blog))
+            store.create_dataset("offsets", data=np.asarray(offsets, dtype=np.int64))
+            store.create_dataset("names", data=[filename.encode("utf-8") for filename in filenames],
+                                 dtype=h5py.string_dtype("utf-8"))
+        os.replace(self.store_file + ".tmp", self.store_file)
+        self.logger.info(
+            f"Encoded {len(filenames)} blogs ({offsets[-1]} words) in {time.perf_counter() - start:.2f} seconds to "
+            f"{self.store_file}"
+        )
+        manifest.record("store", inputs, [self.store_file], {"blogs": filenames})
+        manifest.save()
 
 
 def main():
-    blog_encoder = BlogEncoder
+    dir_name = path.dirname(__file__)
+    config_file = path.join(dir_name, "../../config.yaml")
+    config_dict = None
+    with open(config_file) as config:
+        config_dict = yaml.load(config, Loader=yaml.Loader)
+    blog_encoder = BlogEncoder(
+        config_dict["blog_directory"],
+        config_dict["blog_embeddings"],
+        path.join(dir_name, "../..", config_dict["word_vectors"]),
+        path.join(dir_name, "../..", config_dict["pretrained_dictionary"]),
+    )
     blog_encoder.encode_blogs()
 
 
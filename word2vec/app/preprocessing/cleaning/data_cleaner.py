@@ -1,90 +1,30 @@
-import sys
-import re
+import argparse
+import logging
+import os
+import shutil
+import time
+from multiprocessing import Pool, cpu_count
 from os import path, listdir
+from .rewrite_engine import RewriteEngine, CONTRACTIONS
+from ..manifest import StageManifest, MANIFEST_DIR
 
 
-def clean_line(dirty_line, stop_words):
-    a_line = dirty_line.lower()  # We are not interested in lower or upper case
-    a_line = re.sub("\t", " ", a_line)  # tabs to single space
-    a_line = re.sub(" +", " ", a_line)  # remove superfluous whitespaces
-    a_line = re.sub(r"-\[readmore\]-", "", a_line)
-    a_line = re.sub(" ' ", "'", a_line)
-    a_line = re.sub("'m", " am", a_line)
-    a_line = re.sub("`m", " am", a_line)
-    a_line = re.sub(" 'n ", " and ", a_line)
-    a_line = re.sub(" `n ", " and ", a_line)
-    a_line = re.sub(" n' ", " and ", a_line)
-    a_line = re.sub("'s", " is", a_line)
-    a_line = re.sub("`s", " is", a_line)
-    a_line = re.sub("´s", "", a_line)  # genitive-s: ignore
-    a_line = re.sub("isn't", "is not", a_line)
-    a_line = re.sub("isn`t", "is not", a_line)
-    a_line = re.sub("'ll", " will", a_line)
-    a_line = re.sub("`ll", " will", a_line)
-    a_line = re.sub("’ll", " will", a_line)
-    a_line = re.sub("'ve", " have", a_line)
-    a_line = re.sub("`ve", " have", a_line)
-    a_line = re.sub("’ve", " have", a_line)
-    a_line = re.sub("'re", " are", a_line)
-    a_line = re.sub("`re", " are", a_line)
-    a_line = re.sub("’re", " are", a_line)
-    a_line = re.sub("'d", " would", a_line)
-    a_line = re.sub("`d", " would", a_line)
-    a_line = re.sub("’d", " would", a_line)
-    a_line = re.sub("'em", "them", a_line)
-    a_line = re.sub("`em", "them", a_line)
-    a_line = re.sub("'bout", "about", a_line)
-    a_line = re.sub("`bout", "about", a_line)
-    a_line = re.sub("aren't", "are not", a_line)
-    a_line = re.sub("aren`t", "are not", a_line)
-    a_line = re.sub("ain't", "am not", a_line)
-    a_line = re.sub("ain`t", "am not", a_line)
-    a_line = re.sub("can't", "cannot", a_line)
-    a_line = re.sub("can`t", "cannot", a_line)
-    a_line = re.sub("didn't", "did not", a_line)
-    a_line = re.sub("didn`t", "did not", a_line)
-    a_line = re.sub("doesn't", "does not", a_line)
-    a_line = re.sub("doesn`t", "does not", a_line)
-    a_line = re.sub("doin'", "doing", a_line)
-    a_line = re.sub("don't", "do not", a_line)
-    a_line = re.sub("don`t", "do not", a_line)
-    a_line = re.sub("don’t", "do not", a_line)
-    a_line = re.sub("haven't", "have not", a_line)
-    a_line = re.sub("haven`t", "have not", a_line)
-    a_line = re.sub("hasn't", "has not", a_line)
-    a_line = re.sub("hasn`t", "has not", a_line)
-    a_line = re.sub("hasn’t", "has not", a_line)
-    a_line = re.sub("let's", "let us", a_line)
-    a_line = re.sub("let`s", "let us", a_line)
-    a_line = re.sub("let´s", "let us", a_line)
-    a_line = re.sub("n’t", " not", a_line)
-    a_line = re.sub("wasn't", "was not", a_line)
-    a_line = re.sub("wasn`t", "was not", a_line)
-    a_line = re.sub("wasn’t", "was not", a_line)
-    a_line = re.sub("weren't", "were not", a_line)
-    a_line = re.sub("weren`t", "were not", a_line)
-    a_line = re.sub("won't", "will not", a_line)
-    a_line = re.sub("won`t", "will not", a_line)
-    a_line = re.sub("wouldn't", "would not", a_line)
-    a_line = re.sub("wouldn`t", "would not", a_line)
-    a_line = re.sub(" - ", " ", a_line)
-    a_line = re.sub("’s", " is", a_line)  # should be last formatting line!
-    # we are not interested in numbers, only words
-    a_line = re.sub(r"[-+]?[0-9]+[,0-9]*(\.[0-9]+)?", "", a_line)
-    # we are not interested in urls
-    a_line = re.sub(r"http(s)?:\/\/([\.\-a-z]+)", "", a_line)
-    # we are not interested in hyphens, unless they are binding together words
-    a_line = re.sub(r"[\s][-]+[\s]+", " ", a_line)  # space, hyphen(s), space
-    a_line = re.sub(
-        r"[\s]+[-]+", " ", a_line
-    )  # space(s) followed by (one or more) hyphen then word
-    a_line = re.sub(r"[-]+[\s]+", " ", a_line)  # hyphen followed by space(s)
-    # remove special characters, punctuation etc.
-    a_line = re.sub(
-        r'[()<>‘"”…#@/&%;:`\*\'{}+_\u200B\u2013=~§\$|.!?,\[\]\\]', "", a_line
-    )
-    # let's remove superfluous whitespaces, again (cleaning can have resulted in additional spaces between words)
-    a_line = re.sub(" +", " ", a_line)
+STOP_WORDS_FILE = path.join(path.dirname(__file__), "stop_words.txt")
+
+_shared_rewrite_engine = None
+
+
+def _rewrite_engine():
+    # The rewrite engine is compiled on first use and then shared by all callers of clean_line
+    global _shared_rewrite_engine
+    if _shared_rewrite_engine is None:
+        _shared_rewrite_engine = RewriteEngine()
+    return _shared_rewrite_engine
+
+
+def clean_line(dirty_line, stop_words, rewrite_engine=None):
+    # Lower case, contractions expanded, numbers, urls, stray hyphens and punctuation removed
+    a_line = (rewrite_engine or _rewrite_engine()).rewrite(dirty_line)
     cleaned_line = []
     for word in a_line.split(" "):
         # ignore some nonsense words with varied spelling
@@ -93,46 +33,194 @@ def clean_line(dirty_line, stop_words):
     return " ".join(cleaned_line)
 
 
+def load_stop_words(stop_words_file=STOP_WORDS_FILE):
+    with open(stop_words_file, "r") as f:
+        return frozenset(word for line in f for word in line.split())
+
+
+def _universal_lines(raw_line):
+    # Decodes a "\n"-terminated byte line the way a text mode file would: universal newlines, bad bytes ignored
+    text = raw_line.decode("utf-8", errors="ignore").replace("\r\n", "\n").replace("\r", "\n")
+    lines = text.split("\n")
+    for line in lines[:-1]:
+        yield line + "\n"
+    if lines[-1]:
+        yield lines[-1]
+
+
+def read_line_range(file_name, start, end):
+    # Yields the lines of file_name starting within the byte range [start, end). A range boundary in the middle
+    # of a line belongs to the range the line starts in, so consecutive ranges yield every line exactly once.
+    with open(file_name, "rb") as f:
+        position = start
+        if start > 0:
+            f.seek(start - 1)
+            position = start - 1 + len(f.readline())
+        while position < end:
+            raw_line = f.readline()
+            if not raw_line:
+                break
+            position += len(raw_line)
+            yield from _universal_lines(raw_line)
+
+
+def file_chunks(file_name, chunk_size):
+    # Splits a file into byte ranges of roughly chunk_size bytes, see read_line_range
+    file_size = path.getsize(file_name)
+    return [(start, min(start + chunk_size, file_size)) for start in range(0, max(file_size, 1), chunk_size)]
+
+
+_worker_data_cleaner = None
+
+
+def _init_worker(data_cleaner):
+    global _worker_data_cleaner
+    _worker_data_cleaner = data_cleaner
+
+
+def _clean_chunk(chunk):
+    dirty_file, start, end, part_file = chunk
+    lines = _worker_data_cleaner.clean_lines(read_line_range(dirty_file, start, end), part_file)
+    return dirty_file, end - start, lines
+
+
 class DataCleaner(object):
-    def __init__(self, source_dir, target_dir, dry_run=False):
+    logging.basicConfig(level=logging.INFO)
+
+    def __init__(self, source_dir, target_dir, dry_run=False, manifest_dir=MANIFEST_DIR):
         self.dir_name = path.dirname(__file__)
+        self.logger = logging.getLogger(__name__)
         self.source_dir = path.join(self.dir_name, source_dir)
         self.target_dir = path.join(self.dir_name, target_dir)
         self.dry_run = dry_run
-        stop_words_file = path.join(self.dir_name, "stop_words.txt")
-        with open(stop_words_file, "r") as f:
-            self.stop_words = [word for line in f for word in line.split()]
+        self.stop_words = load_stop_words()
+        self.rewrite_engine = RewriteEngine()
+        self.manifest_dir = manifest_dir
+        # A change of the stop words or the rewrite rules makes every cleaned file stale
+        self.config = {"stop_words": sorted(self.stop_words), "contractions": CONTRACTIONS}
+
+    def __getstate__(self):
+        # Loggers cannot be pickled, the cleaner is sent to the worker processes when cleaning in parallel
+        state = self.__dict__.copy()
+        del state["logger"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.logger = logging.getLogger(__name__)
 
     def clean_line(self, dirty_line):
-        clean_line(dirty_line=dirty_line, stop_words=self.stop_words)
+        return clean_line(dirty_line=dirty_line, stop_words=self.stop_words, rewrite_engine=self.rewrite_engine)
+
+    def clean_lines(self, dirty_lines, cleaned_file):
+        # Streams the cleaned lines to cleaned_file, returns the number of lines read
+        line_count = 0
+        with open(cleaned_file, "w") as clean_data:
+            for dirty_line in dirty_lines:
+                line_count += 1
+                cleaned_line = self.clean_line(dirty_line)
+                # If line is shorter than 3 words we ignore it as it doesn't give much to train on
+                if len(cleaned_line.split(" ")) > 2:
+                    clean_data.write(cleaned_line)
+        return line_count
+
+    def _manifest(self):
+        return StageManifest(f"clean_{path.basename(path.normpath(self.source_dir))}", self.manifest_dir)
 
-    def clean_file(self, file_to_clean):
+    def _is_up_to_date(self, manifest, dirty_file):
+        cleaned_file = path.join(self.target_dir, path.basename(dirty_file))
+        return manifest.is_up_to_date(path.basename(dirty_file), [dirty_file], [cleaned_file], self.config)
+
+    def _record(self, manifest, dirty_file):
+        cleaned_file = path.join(self.target_dir, path.basename(dirty_file))
+        manifest.record(path.basename(dirty_file), [dirty_file], [cleaned_file], self.config)
+
+    def clean_file(self, file_to_clean, manifest=None):
         cleaned_file = path.join(self.target_dir, path.basename(file_to_clean))
-        if not path.exists(cleaned_file):
-            cleaned_lines = []
+        if self.dry_run:
+            with open(file_to_clean, encoding="utf-8", errors="ignore") as dirty_data:
+                return [self.clean_line(dirty_line) for dirty_line in dirty_data]
+        save_manifest = manifest is None
+        manifest = manifest or self._manifest()
+        if not self._is_up_to_date(manifest, file_to_clean):
             with open(file_to_clean, encoding="utf-8", errors="ignore") as dirty_data:
-                for dirty_line in dirty_data:
-                    cleaned_lines.append(self.clean_line(dirty_line))
+                # Written to a temporary file first so that an interrupted run doesn't leave a truncated file behind
+                self.clean_lines(dirty_data, cleaned_file + ".part")
+            os.replace(cleaned_file + ".part", cleaned_file)
+            self._record(manifest, file_to_clean)
+        if save_manifest:
+            manifest.save()
 
-            if self.dry_run:
-                return cleaned_lines
+    def clean_files(self, workers=1, chunk_size=64 * 1024 * 1024):
+        dirty_files = [path.join(self.source_dir, dirty_file) for dirty_file in listdir(self.source_dir)]
+        manifest = self._manifest()
+        # Cleaned files of sources that have been removed since the last run would otherwise still be trained on
+        for removed_file in set(manifest.keys()) - {path.basename(dirty_file) for dirty_file in dirty_files}:
+            manifest.forget(removed_file, remove_outputs=True)
+        if workers > 1:
+            self._clean_files_in_parallel(dirty_files, workers, chunk_size, manifest)
+        else:
+            for dirty_file in dirty_files:
+                self.clean_file(dirty_file, manifest)
+        manifest.save()
 
-            with open(cleaned_file, "w") as clean_data:
-                for cleaned_line in cleaned_lines:
-                    # If line is shorter than 3 words we ignore it as it doesn't give much to train on
-                    if len(cleaned_line.split(" ")) > 2:
-                        clean_data.write(cleaned_line)
+    def _clean_files_in_parallel(self, dirty_files, workers, chunk_size, manifest):
+        # Every file is split into chunks on line boundaries, each chunk is cleaned by a worker process into a
+        # part file of its own and the parts are concatenated, in order, once all chunks of the file are done
+        parts = {}
+        chunks = []
+        for dirty_file in dirty_files:
+            if self._is_up_to_date(manifest, dirty_file):
+                continue
+            cleaned_file = path.join(self.target_dir, path.basename(dirty_file))
+            parts[dirty_file] = []
+            for index, (start, end) in enumerate(file_chunks(dirty_file, chunk_size)):
+                part_file = f"{cleaned_file}.part{index}"
+                parts[dirty_file].append(part_file)
+                chunks.append((dirty_file, start, end, part_file))
+        # Largest chunks first keeps all workers busy until the end
+        chunks.sort(key=lambda chunk: chunk[2] - chunk[1], reverse=True)
+        total_bytes = sum(end - start for _, start, end, _ in chunks)
+        remaining_chunks = {dirty_file: len(file_parts) for dirty_file, file_parts in parts.items()}
+        self.logger.info(f"Cleaning {len(parts)} files ({total_bytes / 2**20:.1f} MB) in {len(chunks)} chunks "
+                         f"using {workers} workers")
+        done_bytes = 0
+        done_lines = 0
+        timer_start = time.perf_counter()
+        with Pool(processes=workers, initializer=_init_worker, initargs=(self,)) as pool:
+            for dirty_file, chunk_bytes, chunk_lines in pool.imap_unordered(_clean_chunk, chunks):
+                done_bytes += chunk_bytes
+                done_lines += chunk_lines
+                remaining_chunks[dirty_file] -= 1
+                if remaining_chunks[dirty_file] == 0:
+                    self._concatenate(parts[dirty_file], path.join(self.target_dir, path.basename(dirty_file)))
+                    self._record(manifest, dirty_file)
+                elapsed = max(time.perf_counter() - timer_start, 1e-9)
+                self.logger.info(f"Cleaned {done_bytes / 2**20:.1f}/{total_bytes / 2**20:.1f} MB, "
+                                 f"{done_lines / elapsed:,.0f} lines/sec, {done_bytes / 2**20 / elapsed:.1f} MB/sec")
 
-    def clean_files(self):
-        for dirty_file in listdir(self.source_dir):
-            self.clean_file(path.join(self.source_dir, dirty_file))
+    @staticmethod
+    def _concatenate(part_files, cleaned_file):
+        with open(cleaned_file + ".part", "wb") as cleaned_data:
+            for part_file in part_files:
+                with open(part_file, "rb") as part_data:
+                    shutil.copyfileobj(part_data, cleaned_data)
+                os.remove(part_file)
+        os.replace(cleaned_file + ".part", cleaned_file)
 
 
 def main():
-    clean_directory = sys.argv[1]
-    target_dir = path.join("../../../data/3_cleaned", path.basename(clean_directory))
-    data_cleaner = DataCleaner(source_dir=clean_directory, target_dir=target_dir)
-    data_cleaner.clean_files()
+    parser = argparse.ArgumentParser(description="Cleans all files of a directory of parsed data")
+    parser.add_argument("clean_directory")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes, 0 for one per cpu core (default: 1, no parallelism)")
+    parser.add_argument("--chunk-mb", type=int, default=64,
+                        help="files larger than this are split into chunks cleaned in parallel (default: 64)")
+    args = parser.parse_args()
+    target_dir = path.join("../../../data/3_cleaned", path.basename(args.clean_directory))
+    data_cleaner = DataCleaner(source_dir=args.clean_directory, target_dir=target_dir)
+    workers = args.workers or cpu_count()
+    data_cleaner.clean_files(workers=workers, chunk_size=args.chunk_mb * 1024 * 1024)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,194 @@
+import re
+
+# Literal rewrites applied, in this order, to every lower-cased line after whitespace has been collapsed.
+# The order matters: e.g. "'s" is expanded before "let's" is looked at, so "let's" ends up as "let is".
+CONTRACTIONS = (
+    ("-[readmore]-", ""),
+    (" ' ", "'"),
+    ("'m", " am"),
+    ("`m", " am"),
+    (" 'n ", " and "),
+    (" `n ", " and "),
+    (" n' ", " and "),
+    ("'s", " is"),
+    ("`s", " is"),
+    ("´s", ""),  # genitive-s: ignore
+    ("isn't", "is not"),
+    ("isn`t", "is not"),
+    ("'ll", " will"),
+    ("`ll", " will"),
+    ("’ll", " will"),
+    ("'ve", " have"),
+    ("`ve", " have"),
+    ("’ve", " have"),
+    ("'re", " are"),
+    ("`re", " are"),
+    ("’re", " are"),
+    ("'d", " would"),
+    ("`d", " would"),
+    ("’d", " would"),
+    ("'em", "them"),
+    ("`em", "them"),
+    ("'bout", "about"),
+    ("`bout", "about"),
+    ("aren't", "are not"),
+    ("aren`t", "are not"),
+    ("ain't", "am not"),
+    ("ain`t", "am not"),
+    ("can't", "cannot"),
+    ("can`t", "cannot"),
+    ("didn't", "did not"),
+    ("didn`t", "did not"),
+    ("doesn't", "does not"),
+    ("doesn`t", "does not"),
+    ("doin'", "doing"),
+    ("don't", "do not"),
+    ("don`t", "do not"),
+    ("don’t", "do not"),
+    ("haven't", "have not"),
+    ("haven`t", "have not"),
+    ("hasn't", "has not"),
+    ("hasn`t", "has not"),
+    ("hasn’t", "has not"),
+    ("let's", "let us"),
+    ("let`s", "let us"),
+    ("let´s", "let us"),
+    ("n’t", " not"),
+    ("wasn't", "was not"),
+    ("wasn`t", "was not"),
+    ("wasn’t", "was not"),
+    ("weren't", "were not"),
+    ("weren`t", "were not"),
+    ("won't", "will not"),
+    ("won`t", "will not"),
+    ("wouldn't", "would not"),
+    ("wouldn`t", "would not"),
+    (" - ", " "),
+    ("’s", " is"),  # should be last formatting line!
+)
+
+# we are not interested in numbers, only words
+NUMBER_PATTERN = r"[-+]?[0-9]+[,0-9]*(\.[0-9]+)?"
+# we are not interested in urls
+URL_PATTERN = r"http(s)?:\/\/([\.\-a-z]+)"
+# we are not interested in hyphens, unless they are binding together words
+HYPHEN_PATTERNS = (
+    r"[\s][-]+[\s]+",  # space, hyphen(s), space
+    r"[\s]+[-]+",  # space(s) followed by (one or more) hyphen then word
+    r"[-]+[\s]+",  # hyphen followed by space(s)
+)
+# special characters, punctuation etc.
+PUNCTUATION_PATTERN = r'[()<>‘"”…#@/&%;:`\*\'{}+_\u200B\u2013=~§\$|.!?,\[\]\\]'
+PUNCTUATION = "()<>‘\"”…#@/&%;:`*'{}+_\u200b\u2013=~§$|.!?,[]\\"
+
+
+def _overlaps(left, right):
+    # True if a non-empty, proper suffix of left is a prefix of right, i.e. the two can share characters
+    # when left is immediately followed by right.
+    return any(right.startswith(left[i:]) for i in range(1, len(left)))
+
+
+def _can_fuse(earlier, later):
+    """
+    Tells whether the literal rewrite `earlier` can be applied in the same left-to-right pass as `later`
+    without changing the result of applying them one after the other.
+    """
+    earlier_pattern, earlier_replacement = earlier
+    later_pattern, later_replacement = later
+    # The replacement of the earlier rule must not produce (part of) a match for the later rule...
+    if earlier_replacement == "":
+        if len(later_pattern) > 1:
+            return False
+    elif (
+        later_pattern in earlier_replacement
+        or earlier_replacement in later_pattern
+        or _overlaps(earlier_replacement, later_pattern)
+        or _overlaps(later_pattern, earlier_replacement)
+    ):
+        return False
+    # ...and the later rule must never be able to start before, and swallow, a match of the earlier rule
+    return later_pattern.find(earlier_pattern, 1) < 0 and not _overlaps(later_pattern, earlier_pattern)
+
+
+def _fuse(rewrites):
+    # Splits the ordered rewrites into consecutive groups where every pair within a group can be fused
+    groups = []
+    for rewrite in rewrites:
+        if groups and all(_can_fuse(previous, rewrite) for previous in groups[-1]):
+            groups[-1].append(rewrite)
+        else:
+            groups.append([rewrite])
+    return groups
+
+
+class _LiteralPass(object):
+    # One pass of the rewrite engine: all literals of a fused group are replaced in a single scan
+    def __init__(self, rewrites):
+        self.replacements = dict(rewrites)
+        self.pattern = re.compile("|".join(re.escape(pattern) for pattern, _ in rewrites))
+        # Cheap pre-check: every literal contains at least one of these (punctuation) characters, a line
+        # without any of them cannot match
+        self.markers = frozenset(char for pattern, _ in rewrites for char in pattern if not (char.isalnum() or char.isspace()))
+        if not all(any(char in self.markers for char in pattern) for pattern, _ in rewrites):
+            self.markers = None
+
+    def _replace(self, match):
+        return self.replacements[match.group()]
+
+    def apply(self, line):
+        if self.markers is not None and not any(marker in line for marker in self.markers):
+            return line
+        return self.pattern.sub(self._replace, line)
+
+
+class RewriteEngine(object):
+    """
+    Compiled version of the clean_line rewrites: contractions are expanded in a handful of fused single
+    passes (only rewrites that provably cannot interact share a pass), numbers, urls and hyphens are
+    removed by precompiled patterns that only run when the line can match them, and punctuation is
+    removed by a single str.translate. The output is identical to rewrite_sequential().
+    """
+
+    def __init__(self, contractions=CONTRACTIONS):
+        self.contractions = [(re.escape(pattern), replacement) for pattern, replacement in contractions]
+        self.literal_passes = [_LiteralPass(group) for group in _fuse(contractions)]
+        # "\t" -> " " followed by " +" -> " " is the same as collapsing any run of tabs and spaces
+        self.whitespace_pattern = re.compile("[ \t]+")
+        self.space_pattern = re.compile(" +")
+        self.number_pattern = re.compile(NUMBER_PATTERN)
+        self.url_pattern = re.compile(URL_PATTERN)
+        self.hyphen_patterns = [re.compile(pattern) for pattern in HYPHEN_PATTERNS]
+        self.punctuation_table = str.maketrans("", "", PUNCTUATION)
+
+    def rewrite(self, dirty_line):
+        a_line = dirty_line.lower()
+        if "\t" in a_line or "  " in a_line:
+            a_line = self.whitespace_pattern.sub(" ", a_line)
+        for literal_pass in self.literal_passes:
+            a_line = literal_pass.apply(a_line)
+        a_line = self.number_pattern.sub("", a_line)
+        if "http" in a_line:
+            a_line = self.url_pattern.sub("", a_line)
+        if "-" in a_line:
+            for hyphen_pattern in self.hyphen_patterns:
+                a_line = hyphen_pattern.sub(" ", a_line)
+        a_line = a_line.translate(self.punctuation_table)
+        # let's remove superfluous whitespaces, again (cleaning can have resulted in additional spaces)
+        if "  " in a_line:
+            a_line = self.space_pattern.sub(" ", a_line)
+        return a_line
+
+    def rewrite_sequential(self, dirty_line):
+        # One re.sub per rewrite, the way clean_line used to work. Kept as reference for tests and benchmarks.
+        a_line = dirty_line.lower()
+        a_line = re.sub("\t", " ", a_line)
+        a_line = re.sub(" +", " ", a_line)
+        for pattern, replacement in self.contractions:
+            a_line = re.sub(pattern, replacement, a_line)
+        a_line = re.sub(NUMBER_PATTERN, "", a_line)
+        a_line = re.sub(URL_PATTERN, "", a_line)
+        a_line = re.sub(HYPHEN_PATTERNS[0], " ", a_line)
+        a_line = re.sub(HYPHEN_PATTERNS[1], " ", a_line)
+        a_line = re.sub(HYPHEN_PATTERNS[2], " ", a_line)
+        a_line = re.sub(PUNCTUATION_PATTERN, "", a_line)
+        return re.sub(" +", " ", a_line)
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+from os import path
+import logging
+
+MANIFEST_DIR = path.join(path.dirname(__file__), "../../data/manifests")
+
+
+def file_digest(file_name):
+    sha = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def config_digest(config):
+    # Any json serializable value, e.g. a dict of the config.yaml values a stage depends on
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class StageManifest(object):
+    """
+    Remembers, per key (typically one source file), the content hashes of the inputs, the configuration and the
+    outputs a pipeline stage produced the last time it ran. A key is up to date when none of them has changed
+    since, so a stage only has to redo the work for new or modified sources instead of skipping on the mere
+    existence of an output file or rebuilding everything.
+    """
+
+    logging.basicConfig(level=logging.INFO)
+
+    def __init__(self, stage, manifest_dir=MANIFEST_DIR):
+        self.logger = logging.getLogger(__name__)
+        self.manifest_dir = manifest_dir
+        self.manifest_file = path.join(manifest_dir, f"{stage}.json")
+        self.stage = stage
+        self.entries = {}
+        # Digests of files not touched since they were hashed are reused: (size, mtime) -> digest
+        self.digests = {}
+        if path.exists(self.manifest_file):
+            with open(self.manifest_file, "r") as f:
+                manifest = json.load(f)
+            self.entries = manifest["entries"]
+            self.digests = manifest["digests"]
+
+    def _relative(self, file_name):
+        return path.relpath(file_name, self.manifest_dir)
+
+    def digest(self, file_name):
+        if not path.exists(file_name):
+            return None
+        stat = os.stat(file_name)
+        key = self._relative(file_name)
+        cached = self.digests.get(key)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = file_digest(file_name)
+        self.digests[key] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def _digests(self, file_names):
+        return {self._relative(file_name): self.digest(file_name) for file_name in file_names}
+
+    def is_up_to_date(self, key, inputs, outputs, config=None):
+        entry = self.entries.get(key)
+        if entry is None or entry["config"] != config_digest(config):
+            return False
+        if entry["inputs"] != self._digests(inputs):
+            return False
+        output_digests = self._digests(outputs)
+        return None not in output_digests.values() and entry["outputs"] == output_digests
+
+    def record(self, key, inputs, outputs, config=None):
+        self.entries[key] = {
+            "inputs": self._digests(inputs),
+            "outputs": self._digests(outputs),
+            "config": config_digest(config),
+        }
+
+    def keys(self):
+        return list(self.entries.keys())
+
+    def outputs(self, key):
+        return [path.normpath(path.join(self.manifest_dir, output)) for output in self.entries[key]["outputs"]]
+
+    def forget(self, key, remove_outputs=False):
+        # E.g. when the source of the key has been deleted; its outputs can be removed along with it
+        if remove_outputs:
+            for output in self.outputs(key):
+                if path.exists(output):
+                    self.logger.info(f"Removing stale output: {output}")
+                    os.remove(output)
+        del self.entries[key]
+
+    def save(self):
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        # Only keep digests of files still referenced by an entry
+        referenced = {
+            file_name
+            for entry in self.entries.values()
+            for file_name in list(entry["inputs"].keys()) + list(entry["outputs"].keys())
+        }
+        digests = {file_name: digest for file_name, digest in self.digests.items() if file_name in referenced}
+        with open(self.manifest_file + ".tmp", "w") as f:
+            json.dump({"stage": self.stage, "entries": self.entries, "digests": digests}, f, indent=1)
+        os.replace(self.manifest_file + ".tmp", self.manifest_file)
+
+    def cache_file(self, key, suffix=".pkl"):
+        # Location for a per-key intermediate result of the stage, e.g. the contribution of one source file
+        cache_dir = path.join(self.manifest_dir, self.stage)
+        os.makedirs(cache_dir, exist_ok=True)
+        return path.join(cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + suffix)
@@ -1,82 +1,157 @@
+import argparse
+import os
+import time
 import yaml
 import re
+from multiprocessing import Pool, cpu_count
 from os import path, listdir
 import logging
+from ..manifest import StageManifest, MANIFEST_DIR
+
+# A line starting with three of `, - or ~ opens or closes a code block (or the meta tags of a blog post)
+_CODE_BLOCK_SEPARATOR = re.compile("[`~-]{3}")
+
+
+def remove_links(line):
+    # Removes every "(...)" after the first "]" of a line with a "[" before it, i.e. the targets of markdown links,
+    # up to the first ")" without a "(" before it
+    opening_bracket = line.find("[")
+    closing_bracket = line.find("]")
+    if not 0 <= opening_bracket < closing_bracket:
+        return line
+    kept = [line[:closing_bracket]]
+    position = closing_bracket
+    while True:
+        opening_parenthesis = line.find("(", position)
+        closing_parenthesis = line.find(")", position)
+        if not 0 <= opening_parenthesis < closing_parenthesis:
+            break
+        kept.append(line[position:opening_parenthesis])
+        position = closing_parenthesis + 1
+    kept.append(line[position:])
+    return "".join(kept)
+
+
+def remove_tags(line):
+    """
+    Removes html tags, from the first "<" to the first ">" after it, together with the character before the tag
+    (typically a space), up to the first ">" without a "<" before it. The kept parts are (start, end) ranges of the
+    line, so that dropping the character before a tag that follows another one is just moving an end.
+    """
+    kept = []
+    position = 0
+    while True:
+        opening = line.find("<", position)
+        closing = line.find(">", position)
+        if not 0 <= opening < closing:
+            break
+        if opening > position:
+            kept.append([position, opening - 1])
+        else:
+            while kept and kept[-1][0] == kept[-1][1]:
+                kept.pop()
+            if kept:
+                kept[-1][1] -= 1
+        position = closing + 1
+    return "".join(line[start:end] for start, end in kept) + line[position:]
+
+
+def parse_blog_lines(blog_lines):
+    # The lines of a blog post outside of code blocks, with their whitespace normalized (NBSP to normal spaces) and
+    # without the targets of links and without html tags
+    include_line = True
+    for blog_line in blog_lines:
+        is_comment_code_block_sep = _CODE_BLOCK_SEPARATOR.match(blog_line)
+        if is_comment_code_block_sep and include_line:
+            include_line = False
+        elif is_comment_code_block_sep and not include_line:
+            include_line = True
+            continue
+        if include_line:
+            yield remove_tags(remove_links(" ".join(blog_line.split())))
+
+
+def parse_blog(blog_file, target_file=None):
+    # The parsed lines of a blog file, or, with a target file, their number after writing them to it
+    with open(blog_file, "r", encoding="utf-8", errors="ignore") as blog_data:
+        parsed_blog_lines = parse_blog_lines(line.rstrip() for line in blog_data if line)
+        if target_file is None:
+            return list(parsed_blog_lines)
+        line_count = 0
+        # Written to a temporary file first so that an interrupted run doesn't leave a truncated file behind
+        with open(target_file + ".part", "w") as prepared_data:
+            for parsed_blog_line in parsed_blog_lines:
+                prepared_data.write(parsed_blog_line.strip())
+                prepared_data.write("\n")
+                line_count += 1
+    os.replace(target_file + ".part", target_file)
+    return line_count
+
+
+def _parse_blog(files):
+    blog_file, target_file = files
+    return blog_file, target_file, parse_blog(blog_file, target_file)
 
 
 class BlogParser(object):
     logging.basicConfig(level=logging.INFO)
 
-    def __init__(self, blog_dir, dry_run=False):
+    def __init__(self, blog_dir, dry_run=False, target_dir="data/2_parsed/blogs", manifest_dir=MANIFEST_DIR):
         dir_name = path.dirname(__file__)
         self.logger = logging.getLogger(__name__)
         self.blog_directory = path.join(dir_name, "../../../", blog_dir)
+        self.target_directory = path.join(dir_name, "../../../", target_dir)
         self.dry_run = dry_run
+        self.manifest_dir = manifest_dir
 
     def _tag_remover(self, line):
-        opening_tag_index = line.find('<')
-        closing_tag_index = line.find('>')
-        if 0 <= opening_tag_index < closing_tag_index:
-            if opening_tag_index > 0:
-                return self._tag_remover(line[:opening_tag_index - 1] + line[closing_tag_index + 1:])
-            else:
-                return self._tag_remover(line[closing_tag_index + 1:])
-        return line
+        return remove_tags(line)
 
     def _link_remover(self, line):
-        open_bracket_index = line.find('[')
-        close_bracket_index = line.find(']')
-        if 0 <= open_bracket_index < close_bracket_index:
-            open_parenthesis_index = line[close_bracket_index:].find('(')
-            close_parenthesis_index = line[close_bracket_index:].find(')')
-            if 0 <= open_parenthesis_index < close_parenthesis_index:
-                return self._link_remover(line[:close_bracket_index + open_parenthesis_index] +
-                                          line[close_bracket_index + close_parenthesis_index + 1:])
-        return line
+        return remove_links(line)
 
-    def parse_blog_files(self):
-        dir_name = path.dirname(__file__)
-        for filename in listdir(self.blog_directory):
-            parsed_blog_file = path.join(
-                dir_name, "../../../data/2_parsed/blogs", filename
-            )
-            if not path.exists(parsed_blog_file):
-                self.parse_blog_file(filename, parsed_blog_file)
+    def parse_blog_files(self, workers=1):
+        # Blog files are parsed by workers processes when there are more than one
+        manifest = StageManifest("parse_blogs", self.manifest_dir)
+        filenames = listdir(self.blog_directory)
+        stale = []
+        for filename in filenames:
+            blog_file = path.join(self.blog_directory, filename)
+            parsed_blog_file = path.join(self.target_directory, filename)
+            # Only new or edited blogs (or blogs whose parsed file has been changed or removed) are parsed again
+            if not manifest.is_up_to_date(filename, [blog_file], [parsed_blog_file]):
+                stale.append((blog_file, parsed_blog_file))
+        self.logger.info(f"Parsing {len(stale)} of {len(filenames)} blog files using {workers} workers")
+        start = time.perf_counter()
+        line_count = 0
+        if workers > 1 and len(stale) > 1:
+            with Pool(processes=min(workers, len(stale))) as pool:
+                parsed = list(pool.imap_unordered(_parse_blog, stale, chunksize=16))
+        else:
+            parsed = [_parse_blog(files) for files in stale]
+        for blog_file, parsed_blog_file, lines in parsed:
+            manifest.record(path.basename(blog_file), [blog_file], [parsed_blog_file])
+            line_count += lines
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        self.logger.info(f"Parsed {line_count} lines in {elapsed:.2f} seconds, {line_count / elapsed:,.0f} lines/sec")
+        for filename in set(manifest.keys()) - set(filenames):
+            manifest.forget(filename, remove_outputs=True)
+        manifest.save()
 
     # Remove code blocks and blog meta tags
     def parse_blog_file(self, source_file, target_file):
-        include_line = True
         blog_file = path.join(self.blog_directory, source_file)
         self.logger.info(f"Parsing blog file: {blog_file}")
-        with open(blog_file, "r", encoding="utf-8", errors="ignore") as blog_data:
-            blog_lines = (line.rstrip() for line in blog_data if line)
-            parsed_blog_lines = []
-            for blog_line in blog_lines:
-                is_comment_code_block_sep = re.match("^(`|-|~){3}.*$", blog_line)
-                if is_comment_code_block_sep and include_line:
-                    include_line = False
-                elif is_comment_code_block_sep and not include_line:
-                    include_line = True
-                    continue
-                if include_line:
-                    # replace NBSP with normal space
-                    blog_line = " ".join(blog_line.split())
-                    # remove links:
-                    blog_line = self._link_remover(blog_line)
-                    # remove html tags
-                    blog_line = self._tag_remover(blog_line)
-                    # remove quotes and stars, parenthesis and brackets
-                    # blog_line = re.sub(r"`\"\'\*\[\]\(\)", "", blog_line)
-                    parsed_blog_lines.append(blog_line)
-            if self.dry_run:
-                return parsed_blog_lines
-            with open(target_file, "w") as prepared_data:
-                for parsed_blog_line in parsed_blog_lines:
-                    prepared_data.write(parsed_blog_line.strip())
-                    prepared_data.write("\n")
+        if self.dry_run:
+            return parse_blog(blog_file)
+        parse_blog(blog_file, target_file)
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Parses the blog posts of the blog directory of config.yaml")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes, 0 for one per cpu core (default: 1, no parallelism)")
+    args = parser.parse_args()
     dir_name = path.dirname(__file__)
     config_file = path.join(dir_name, "../../../config.yaml")
     config_dict = None
@@ -84,7 +159,7 @@ def main():
         config_dict = yaml.load(config, Loader=yaml.Loader)
     blog_directory = config_dict["blog_directory"]
     blog_preparer = BlogParser(blog_directory)
-    blog_preparer.parse_blog_files()
+    blog_preparer.parse_blog_files(workers=args.workers or cpu_count())
 
 
 if __name__ == "__main__":
@@ -1,27 +1,117 @@
+import mmap
+import os
+import re
 from os import path
+import numpy as np
 import yaml
+from ..manifest import StageManifest, MANIFEST_DIR
+
+# Lines indexed at a time when building the line index
+_INDEX_BATCH_LINES = 1000000
+# A list of quoted utterance ids, like ['L194', 'L195'], and the ids in it
+_ID_LIST = re.compile(r"""\[\s*(?:(?:'[^']*'|"[^"]*")\s*(?:,\s*(?:'[^']*'|"[^"]*")\s*)*,?\s*)?\]""")
+_QUOTED_ID = re.compile(r"""'([^']*)'|"([^"]*)\"""")
+
+
+def parse_id_list(text):
+    # The utterance ids of a conversation, from the Python list literal of the conversations file, without eval
+    text = text.strip()
+    if not _ID_LIST.fullmatch(text):
+        raise ValueError(f"Not a list of utterance ids: {text}")
+    return [single or double for single, double in _QUOTED_ID.findall(text)]
+
+
+def build_line_index(movie_lines, index_file):
+    """
+    Indexes the utterances of movie_lines ("id +++$+++ ... +++$+++ text" lines) by id: a .npy of (id, byte offset of
+    the line) records sorted by id, to look utterances up with a binary search in the memory mapped index and read
+    them from the memory mapped lines. Only lines with all 5 fields are indexed; of lines with the same id, the last
+    one is found (see LineIndex).
+    """
+    delimiter = MovieParser.DELIMITER.encode("utf-8")
+    batches = []
+    ids = []
+    offsets = []
+    offset = 0
+    with open(movie_lines, "rb") as lines:
+        for line in lines:
+            fields = line.rstrip(b"\r\n").split(delimiter)
+            if len(fields) == 5:
+                ids.append(fields[0].decode("utf-8", errors="ignore").encode("utf-8"))
+                offsets.append(offset)
+            offset += len(line)
+            if len(ids) == _INDEX_BATCH_LINES:
+                batches.append((np.array(ids, dtype=np.bytes_), np.array(offsets, dtype=np.int64)))
+                ids = []
+                offsets = []
+    batches.append((np.array(ids, dtype=np.bytes_), np.array(offsets, dtype=np.int64)))
+    width = max(batch_ids.dtype.itemsize for batch_ids, _ in batches)
+    rows = sum(len(batch_offsets) for _, batch_offsets in batches)
+    index = np.empty(rows, dtype=[("id", f"S{width}"), ("offset", "<i8")])
+    start = 0
+    for batch_ids, batch_offsets in batches:
+        index["id"][start:start + len(batch_ids)] = batch_ids
+        index["offset"][start:start + len(batch_ids)] = batch_offsets
+        start += len(batch_ids)
+    # Stable, so that lines with the same id stay in file order
+    index = index[np.argsort(index["id"], kind="stable")]
+    with open(index_file + ".tmp", "wb") as f:
+        np.save(f, index)
+    os.replace(index_file + ".tmp", index_file)
+
+
+class LineIndex(object):
+    # The utterances of a movie lines file by id, through the index of build_line_index. Both are memory mapped.
+
+    def __init__(self, movie_lines, index_file):
+        self.index = np.load(index_file, mmap_mode="r")
+        self.ids = self.index["id"]
+        self._file = open(movie_lines, "rb")
+        # An empty file cannot be memory mapped
+        self._lines = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if path.getsize(movie_lines) else b""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def utterances(self, ids):
+        # The texts of the utterances with the ids that are in the index, in the order of the ids
+        if not ids or len(self.ids) == 0:
+            return []
+        keys = np.array([line_id.encode("utf-8") for line_id in ids])
+        positions = np.searchsorted(self.ids, keys, side="right") - 1
+        found = (positions >= 0) & (self.ids[np.maximum(positions, 0)] == keys)
+        utterances = []
+        for offset in self.index["offset"][positions[found]]:
+            end = self._lines.find(b"\n", offset)
+            line = self._lines[offset:end if end >= 0 else len(self._lines)]
+            text = line.decode("utf-8", errors="ignore").rstrip(MovieParser.NEW_LINE)
+            utterances.append(text.split(MovieParser.DELIMITER)[4])
+        return utterances
+
+    def close(self):
+        if isinstance(self._lines, mmap.mmap):
+            self._lines.close()
+        self._file.close()
 
 
 class MovieParser(object):
     DELIMITER = " +++$+++ "
     NEW_LINE = "\r\n"
 
-    def __init__(self, movie_lines, movie_conversations):
-        # List of strings. Each string is in turn a list of utterance-IDs that make up a conversation
-        self.conversation_lines = []
-        # Dictionary: key is an ID of the utterance, value is a string with the utterance
-        self.lines = dict()
-        # List of strings. Each string is a conversation in a movie
-        self.conversations = []
+    def __init__(self, movie_lines, movie_conversations, parsed_dir="data/2_parsed/movies",
+                 manifest_dir=MANIFEST_DIR):
         dir_name = path.dirname(__file__)
         self.movie_scripts = path.join(dir_name, "../../..", movie_lines)
         self.conversation_file = path.join(dir_name, "../../..", movie_conversations)
+        self.parsed_dir = path.join(dir_name, "../../..", parsed_dir)
+        self.line_index_file = path.join(self.parsed_dir, "movie_line_index.npy")
+        self.manifest_dir = manifest_dir
 
     def parse_movie_lines(self):
-        dir_name = path.dirname(__file__)
-        prepared_data_file = path.join(
-            dir_name, "../../../data/2_parsed/movies/parsed_movie_lines.txt"
-        )
+        prepared_data_file = path.join(self.parsed_dir, "parsed_movie_lines.txt")
         if not path.exists(prepared_data_file):
             with open(
                 self.movie_scripts, "r", encoding="utf-8", errors="ignore"
@@ -34,40 +124,32 @@ class MovieParser(object):
                         fw.write("\n")
         return prepared_data_file
 
+    def line_index(self):
+        # The index of the utterances by id, built once (and again when the movie lines change)
+        manifest = StageManifest("parse_movies", self.manifest_dir)
+        if not manifest.is_up_to_date("line_index", [self.movie_scripts], [self.line_index_file]):
+            build_line_index(self.movie_scripts, self.line_index_file)
+            manifest.record("line_index", [self.movie_scripts], [self.line_index_file])
+            manifest.save()
+        return LineIndex(self.movie_scripts, self.line_index_file)
+
+    def conversations(self):
+        # The conversations, the utterances of each joined by spaces, one at a time: only the index is held
+        with self.line_index() as line_index, open(self.conversation_file) as mc:
+            for line in mc:
+                line = line.rstrip(MovieParser.NEW_LINE)
+                conversation_list = parse_id_list(line.split(MovieParser.DELIMITER)[3])
+                yield " ".join(line_index.utterances(conversation_list))
+
     def parse_movie_conversations(self):
-        dir_name = path.dirname(__file__)
-        prepared_data_file = path.join(
-            dir_name, "../../../data/2_parsed/movies/parsed_movie_conversations.txt"
-        )
+        prepared_data_file = path.join(self.parsed_dir, "parsed_movie_conversations.txt")
         if not path.exists(prepared_data_file):
-            with open(self.conversation_file) as mc:
-                for line in mc:
-                    line = line.rstrip(MovieParser.NEW_LINE)
-                    line = line.split(MovieParser.DELIMITER)[3]
-                    self.conversation_lines.append(line)
-
-            with open(self.movie_scripts, encoding="utf-8", errors="ignore") as ml:
-                for line in ml:
-                    line = line.rstrip(MovieParser.NEW_LINE)
-                    line = line.split(MovieParser.DELIMITER)
-                    if len(line) == 5:
-                        key = line[0]
-                        value = line[4]
-                        self.lines[key] = value
-
-            for conversation_line in self.conversation_lines:
-                conversation_list = eval(conversation_line)
-                conversation = []
-                for line_ref in conversation_list:
-                    if line_ref in self.lines:
-                        conversation.append(self.lines[line_ref])
-                self.conversations.append(" ".join(conversation))
-
-            with open(prepared_data_file, "w") as prepared_data:
-                for line in self.conversations:
-                    prepared_data.write(line)
+            # Streamed to a temporary file first so that an interrupted run doesn't leave a truncated file behind
+            with open(prepared_data_file + ".part", "w") as prepared_data:
+                for conversation in self.conversations():
+                    prepared_data.write(conversation)
                     prepared_data.write("\n")
-
+            os.replace(prepared_data_file + ".part", prepared_data_file)
         return prepared_data_file
 
 
@@ -1,7 +1,8 @@
-from .training_data_builder import TrainingDataBuilder, save_training_data
+from .training_data_builder import TrainingDataBuilder
+from .context_windows import context_windows
+from ..manifest import MANIFEST_DIR
 import sys
 import numpy as np
-from itertools import chain
 from os import path
 import yaml
 import logging
@@ -10,8 +11,9 @@ import logging
 class CbowTrainingBuilder(TrainingDataBuilder):
     logging.basicConfig(level=logging.INFO)
 
-    def __init__(self, source_dir, window_size, tokenizer_file, dry_run=False):
-        super().__init__(source_dir, tokenizer_file)
+    def __init__(self, source_dir, window_size, vocabulary_file, dry_run=False, manifest_dir=MANIFEST_DIR,
+                 workers=1):
+        super().__init__(source_dir, vocabulary_file, manifest_dir, workers=workers)
         dir_name = path.dirname(__file__)
         self.logger = logging.getLogger(__name__)
         self.window_size = window_size
@@ -20,59 +22,34 @@ class CbowTrainingBuilder(TrainingDataBuilder):
             dir_name, "../../../data/4_training_data/cbow/training_data.dat"
         )
 
-    # Let's define a function for generating training samples from our training sentences
-    # This will return a list of training samples based on a particular conversation from our training data
-    # Yields a tuple with an array of length window_size*2 of word ids for context words and the id of the focus word
-    def _generate_training_samples(self, sample_text):
-        buffer = np.zeros(self.window_size, dtype=np.intc).tolist()
-        buffered_sampled_text = list(chain(buffer, sample_text, buffer))
-        # logging.debug("buffered_sampled_text: {}", buffered_sampled_text)
-        # We yield one training sample for each word in sample_text
-        for sample_text_pos, focus_word_id in enumerate(sample_text):
-            # We zero-initialize context word-ID array
-            context_word_ids = np.zeros(self.window_size * 2, dtype=np.intc).tolist()
-            # The words (in the "window sized"-list of words) *before* our focus word
-            start = sample_text_pos - self.window_size
-            # The words (in the "window sized"-list of words) *after* our focus word
-            end = sample_text_pos + self.window_size + 1
-            context_word_index = 0
-            buffered_sampled_text_index = sample_text_pos
-            for i in range(start, end):
-                if i == sample_text_pos:
-                    buffered_sampled_text_index += 1
-                    continue
-                context_word_ids[context_word_index] = buffered_sampled_text[
-                    buffered_sampled_text_index
-                ]
-                context_word_index += 1
-                buffered_sampled_text_index += 1
-            self.logger.debug("X: {} y: {}", context_word_ids, focus_word_id)
-            yield context_word_ids, focus_word_id
+    # Training samples of a file, per batch of lines: for every word the window_size*2 word ids of the context words
+    # around it, and the id of the (focus) word itself
+    def _file_training_samples(self, clean_file):
+        for ids, offsets in super().encode_lines(super().file_line_generator(clean_file)):
+            yield context_windows(ids, offsets, self.window_size)
 
-    def build_cbow_training_data(self):
-        if self.dry_run or not path.exists(self.training_data_file):
-            X_y = dict()
-            X = []
-            y = []
-
-            for line in super().training_line_generator():
-                self.logger.debug(f"Training data line: {line}")
-                word_ids = super().line_to_word_ids(line)
-                self.logger.debug(f"Training data word ids: {word_ids}")
-                for (
-                    context_word_ids,
-                    focus_word_id,
-                ) in self._generate_training_samples(word_ids):
-                    X.append(context_word_ids)
-                    y.append(focus_word_id)
+    def cbow_training_stream(self, batch_size, prefetch=64, seed=0):
+        return super().training_stream(
+            lambda clean_file, epoch: self._file_training_samples(clean_file), batch_size, prefetch, seed
+        )
 
-            X_y["X"] = X
-            X_y["y"] = y
+    def build_cbow_training_data(self):
+        config = {"window_size": self.window_size}
+        if self.dry_run or not super().is_training_data_up_to_date("cbow", [self.training_data_file], config):
             vocabulary_size = super().vocabulary_size()
             if self.dry_run:
+                X_y = dict()
+                X, y = super().build_training_samples(
+                    "cbow", config, self._file_training_samples, dry_run=True
+                )
+                X_y["X"] = X
+                X_y["y"] = y
                 return vocabulary_size, X_y
             else:
-                save_training_data(self.training_data_file, X_y)
+                columns = {"X": (np.int32, (self.window_size * 2,)), "y": (np.int32, ())}
+                with super().training_data_writer(self.training_data_file, columns) as writer:
+                    super().build_training_samples("cbow", config, self._file_training_samples, writer=writer)
+                super().record_training_data("cbow", [self.training_data_file], config)
                 self.logger.info(f"Vocabulary size: {vocabulary_size}")
 
 
@@ -84,8 +61,10 @@ def main():
     with open(config_file) as config:
         config_dict = yaml.load(config, Loader=yaml.Loader)
     window_size = config_dict["window_size"]
-    tokenizer_file = path.join(dir_name, "../../../", config_dict["dictionary"])
-    cbow_training_builder = CbowTrainingBuilder(source_dir, window_size, tokenizer_file)
+    vocabulary_file = path.join(dir_name, "../../../", config_dict["vocabulary"])
+    cbow_training_builder = CbowTrainingBuilder(
+        source_dir, window_size, vocabulary_file, workers=config_dict["encoder_workers"]
+    )
     cbow_training_builder.build_cbow_training_data()
 
 
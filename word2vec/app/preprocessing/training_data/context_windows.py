@@ -0,0 +1,27 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def context_windows(ids, offsets, window_size, out=None):
+    """
+    The CBOW samples of a batch of lines, given as flat word ids plus line offsets (see Vocabulary.encode): returns
+    an (n, 2 * window_size) int32 array with, for every word, the ids of the window_size words before and after it
+    (0 where the window reaches past the start or end of its line), and the n ids of the words themselves.
+
+    The lines are padded once, all together, and the windows are read from a sliding window view of the padded ids;
+    with out (e.g. columns of a preallocated training buffer) they're written straight into it.
+    """
+    ids = np.asarray(ids, dtype=np.int32)
+    lengths = np.diff(np.asarray(offsets, dtype=np.int64))
+    lines = np.repeat(np.arange(len(lengths)), lengths)
+    # The lines one after the other with window_size zeros before, between and after them: position of every word
+    positions = np.arange(len(ids)) + (lines + 1) * window_size
+    padded = np.zeros(len(ids) + (len(lengths) + 1) * window_size, dtype=np.int32)
+    padded[positions] = ids
+    # Rows of the view are the 2 * window_size + 1 ids around every padded position, the word itself in the middle
+    windows = sliding_window_view(padded, 2 * window_size + 1)[positions - window_size]
+    if out is None:
+        out = np.empty((len(ids), 2 * window_size), dtype=np.int32)
+    out[:, :window_size] = windows[:, :window_size]
+    out[:, window_size:] = windows[:, window_size + 1:]
+    return out, ids
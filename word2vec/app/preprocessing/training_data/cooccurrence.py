@@ -0,0 +1,156 @@
+import shutil
+import tempfile
+import logging
+from os import path
+import numpy as np
+
+# Bytes per counted pair: an int64 key (word i * vocabulary size + word j) and a float64 count
+_ENTRY_BYTES = 16
+
+
+def _sum_by_key(keys, values):
+    # Sorted unique keys with the sum of the values of each key
+    keys, inverse = np.unique(keys, return_inverse=True)
+    return keys, np.bincount(inverse.ravel(), weights=values, minlength=len(keys))
+
+
+class CooccurrenceCounter(object):
+    """
+    Counts how often words co-occur within window_size words of each other, in a single pass over the corpus.
+
+    Lines come in as batches of word ids in the CSR layout of Vocabulary.encode: for every distance 1..window_size
+    the pairs are the ids shifted against themselves, masked where the shift crosses a line boundary. Both (i, j)
+    and (j, i) are counted, with weight 1 (or 1/distance, as in the GloVe paper, with distance_weighting).
+
+    Pairs are kept as sparse (key, count) shards sorted by key. When the shards grow over memory_budget bytes they
+    are merged and spilled to disk; pairs() merges all shards, in memory and on disk, streaming in key order.
+    """
+
+    def __init__(self, vocabulary_size, window_size, distance_weighting=False, memory_budget=512 * 1024 * 1024,
+                 spill_dir=None):
+        self.logger = logging.getLogger(__name__)
+        self.vocabulary_size = vocabulary_size
+        self.window_size = window_size
+        self.distance_weighting = distance_weighting
+        self.max_entries = max(1, memory_budget // _ENTRY_BYTES)
+        self.spill_dir = spill_dir
+        # Pairs of the latest batches, not yet summed: [(keys, weight)]
+        self._pending = []
+        self._pending_entries = 0
+        # Sorted (keys, counts) in memory and the (keys file, counts file) of the shards spilled to disk
+        self._shards = []
+        self._shard_entries = 0
+        self._spilled = []
+        self._tmp_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def update(self, ids, offsets):
+        ids = np.asarray(ids, dtype=np.int64)
+        lines = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        for distance in range(1, min(self.window_size, len(ids) - 1) + 1):
+            same_line = lines[:-distance] == lines[distance:]
+            left = ids[:-distance][same_line]
+            right = ids[distance:][same_line]
+            keys = np.concatenate((left * self.vocabulary_size + right, right * self.vocabulary_size + left))
+            self._pending.append((keys, 1.0 / distance if self.distance_weighting else 1.0))
+            self._pending_entries += len(keys)
+        # Unsummed pairs take half the size of summed ones, they get a quarter of the budget
+        if self._pending_entries * 2 > self.max_entries // 4:
+            self._reduce()
+
+    def _reduce(self):
+        if not self._pending:
+            return
+        keys = np.concatenate([keys for keys, _ in self._pending])
+        weights = np.concatenate([np.full(len(keys), weight) for keys, weight in self._pending])
+        self._pending = []
+        self._pending_entries = 0
+        shard = _sum_by_key(keys, weights)
+        self._shards.append(shard)
+        self._shard_entries += len(shard[0])
+        if self._shard_entries > self.max_entries:
+            # Merging the shards can make room (pairs seen in several batches), if it doesn't they're spilled
+            shard = _sum_by_key(np.concatenate([keys for keys, _ in self._shards]),
+                                np.concatenate([counts for _, counts in self._shards]))
+            self._shards = [shard]
+            self._shard_entries = len(shard[0])
+            if self._shard_entries > self.max_entries // 2:
+                self._spill(shard)
+
+    def _spill(self, shard):
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix="cooccurrence", dir=self.spill_dir)
+        keys_file = path.join(self._tmp_dir, f"keys_{len(self._spilled)}.npy")
+        counts_file = path.join(self._tmp_dir, f"counts_{len(self._spilled)}.npy")
+        np.save(keys_file, shard[0])
+        np.save(counts_file, shard[1])
+        self._spilled.append((keys_file, counts_file))
+        self.logger.info(f"Spilled {len(shard[0])} co-occurrences to disk, shard #{len(self._spilled)}")
+        self._shards = []
+        self._shard_entries = 0
+
+    def _all_shards(self):
+        self._reduce()
+        return self._shards + [
+            (np.load(keys_file, mmap_mode="r"), np.load(counts_file, mmap_mode="r"))
+            for keys_file, counts_file in self._spilled
+        ]
+
+    def key_ranges(self, number_of_ranges):
+        """
+        Splits the co-occurrences into about number_of_ranges (lower, upper) key ranges of about the same number of
+        word pairs, to be passed on to pairs(). The split points are quantiles of a sample of the keys of every shard.
+        """
+        samples = [keys[::max(1, len(keys) // (16 * number_of_ranges))] for keys, _ in self._all_shards()]
+        keys = np.unique(np.concatenate(samples)) if samples else np.empty(0, dtype=np.int64)
+        bounds = [0]
+        if len(keys):
+            quantiles = keys[(np.arange(1, number_of_ranges) * len(keys)) // number_of_ranges]
+            bounds.extend(int(key) for key in np.unique(quantiles))
+        bounds.append(self.vocabulary_size * self.vocabulary_size)
+        return [(lower, upper) for lower, upper in zip(bounds[:-1], bounds[1:]) if lower < upper]
+
+    def pairs(self, chunk_entries=1024 * 1024, lower=None, upper=None):
+        """
+        Yields all co-occurrences as (word pairs, counts) chunks in (word i, word j) order: word pairs is an
+        (n, 2) int64 array, counts the (weighted) count of each pair. Each chunk merges at most chunk_entries
+        entries of every shard. With lower and upper only the pairs with keys in [lower, upper) are yielded.
+        """
+        shards = self._all_shards()
+        if lower is not None or upper is not None:
+            lower = 0 if lower is None else lower
+            upper = self.vocabulary_size * self.vocabulary_size if upper is None else upper
+            in_range = [(np.searchsorted(keys, lower), np.searchsorted(keys, upper)) for keys, _ in shards]
+            shards = [(keys[start:end], counts[start:end]) for (keys, counts), (start, end) in zip(shards, in_range)]
+        positions = [0] * len(shards)
+        while True:
+            remaining = [(shard, position) for shard, position in zip(shards, positions) if position < len(shard[0])]
+            if not remaining:
+                return
+            # Upper bound (exclusive) of the keys merged in this chunk: no shard contributes more than chunk_entries
+            chunk_upper = min(
+                keys[position + chunk_entries] if position + chunk_entries < len(keys) else keys[-1] + 1
+                for (keys, _), position in remaining
+            )
+            chunk_keys = []
+            chunk_counts = []
+            for i, ((keys, counts), position) in enumerate(zip(shards, positions)):
+                end = position + int(np.searchsorted(keys[position:position + chunk_entries + 1], chunk_upper))
+                chunk_keys.append(keys[position:end])
+                chunk_counts.append(counts[position:end])
+                positions[i] = end
+            keys, counts = _sum_by_key(np.concatenate(chunk_keys), np.concatenate(chunk_counts))
+            yield np.stack((keys // self.vocabulary_size, keys % self.vocabulary_size), axis=1), counts
+
+    def close(self):
+        if self._tmp_dir is not None and path.exists(self._tmp_dir):
+            shutil.rmtree(self._tmp_dir)
+        self._tmp_dir = None
+        self._spilled = []
+        self._shards = []
+        self._pending = []
@@ -1,4 +1,7 @@
-from .training_data_builder import TrainingDataBuilder, save_training_data
+from .training_data_builder import TrainingDataBuilder
+from .cooccurrence import CooccurrenceCounter
+from .training_stream import TrainingStream
+from ..manifest import MANIFEST_DIR
 from os import path
 import sys
 import math
@@ -7,96 +10,104 @@ import numpy as np
 import logging
 
 
+def co_occurrence_counts(training_data):
+    # The co-occurrence counts of glove training data. Training data built before the count column existed only holds
+    # their log, capped at 70% of the largest word count
+    return training_data["count"] if "count" in training_data else np.exp(training_data["y"])
+
+
 class GloveTrainingBuilder(TrainingDataBuilder):
     logging.basicConfig(level=logging.INFO)
 
-    def __init__(self, source_dir, window_size, tokenizer_file, tokenizer_json, dry_run=False):
-        super().__init__(source_dir, tokenizer_file, tokenizer_json)
+    def __init__(self, source_dir, window_size, vocabulary_file, dry_run=False, manifest_dir=MANIFEST_DIR,
+                 workers=1, distance_weighting=False, memory_budget=512 * 1024 * 1024):
+        super().__init__(source_dir, vocabulary_file, manifest_dir, workers=workers)
         dir_name = path.dirname(__file__)
         self.dry_run = dry_run
         self.window_size = window_size
+        # Count co-occurrences with weight 1/distance (as in the GloVe paper) instead of 1
+        self.distance_weighting = distance_weighting
+        # Bytes of co-occurrence counts kept in memory before they're spilled to disk
+        self.memory_budget = memory_budget
         self.training_data_file = path.join(
             dir_name, "../../../data/4_training_data/glove/training_data.dat"
         )
         self.logger = logging.getLogger(__name__)
 
-    def _generate_word_pairs(self, word_ids, min_i, max_i):
-        for posI, wordI in enumerate(word_ids):
-            # We check word i against the min-max boundary (we are building a _partial_ co-occurrence matrix)
-            if wordI < min_i or wordI >= max_i:
-                continue
-            for posJ, wordJ in enumerate(word_ids):
-                # We check if word j is within context window of word i
-                if (
-                    posI == posJ
-                    or posI - self.window_size > posJ
-                    or posI + self.window_size < posJ
-                ):
-                    continue
-                yield wordI, wordJ
+    def _word_count_cap(self):
+        word_count_cap = max(1, math.floor(super().max_word_count() * 0.7))
+        self.logger.debug(f"Max word count: {super().max_word_count()}, word count cap:{word_count_cap}")
+        return word_count_cap
 
-    def build_glove_training_data(self, batch_size=1000):
-        if self.dry_run or not path.exists(self.training_data_file):
-            # Step 1: Co-occurrence matrix
-            vocabulary_size = super().vocabulary_size()
-            X_y = dict()
-            training_samples_x = []
-            training_samples_y = []
-            start_word_id = 1
-            batch_size = min(batch_size, vocabulary_size)
-            end_word_id = min(vocabulary_size, start_word_id + batch_size)
-            batch_counter = 1
-            word_count_cap = max(1, math.floor(super().max_word_count() * 0.7))
-            self.logger.debug(
-                f"Max word count: {super().max_word_count()}, word count cap:{word_count_cap}"
-            )
-            while end_word_id > start_word_id:
-                self.logger.debug(
-                    f"Batch#: {batch_counter}, start word id: {start_word_id}, end word id: {end_word_id}"
-                )
-                partial_co_occurrence_matrix = np.zeros(
-                    shape=(batch_size, vocabulary_size), dtype=np.intc
-                )
-                for line in super().training_line_generator():
-                    word_ids = super().line_to_word_ids(line)
-                    for word_i_id, word_j_id in self._generate_word_pairs(
-                        word_ids, start_word_id, end_word_id
-                    ):
-                        word_i_index = (word_i_id - 1) % batch_size
-                        word_j_index = word_j_id - 1
-                        partial_co_occurrence_matrix[word_i_index][word_j_index] += 1
-                self.logger.debug(
-                    f"prepared partial co-occurrence:\n{partial_co_occurrence_matrix}"
-                )
-                training_indices = np.nonzero(partial_co_occurrence_matrix)
-                training_data = [None] * len(training_indices[0])
-                expected_values = [None] * len(training_indices[0])
-                self.logger.debug(f"Not null indices: {training_indices}")
-                for sample in range(len(training_indices[0])):
-                    word_i_index = training_indices[0][sample]
-                    word_j_index = training_indices[1][sample]
-                    training_data[sample] = [(word_i_index + 1) * batch_counter, word_j_index + 1]
-                    co_occurrence = min(
-                        word_count_cap,
-                        partial_co_occurrence_matrix[word_i_index][word_j_index],
-                    )
-                    expected_values[sample] = math.log(co_occurrence)
-                    self.logger.debug(
-                        f"training data: {training_data[sample]} exp: {expected_values[sample]}"
-                    )
-                training_samples_x.extend(training_data)
-                training_samples_y.extend(expected_values)
-                batch_counter += 1
-                start_word_id = end_word_id
-                end_word_id = min(vocabulary_size, end_word_id + batch_size)
+    def _count_cooccurrences(self, counter):
+        # Co-occurrence counts, in a single pass over the corpus: the encoder processes aren't needed after it
+        try:
+            for ids, offsets in super().encode_lines(super().training_line_generator()):
+                counter.update(ids, offsets)
+        finally:
+            super().close()
+        return counter
+
+    def glove_training_stream(self, batch_size, prefetch=64, seed=0, shards=64, counts=False):
+        """
+        Training batches straight from the co-occurrence counts, without writing the training data: the corpus is
+        counted once, up front, and every epoch the counts are read in shards (key ranges, see
+        CooccurrenceCounter.key_ranges) in another order. The targets are the capped log counts, like the y column
+        of the training data, or with counts the co-occurrence counts themselves.
+        """
+        counter = CooccurrenceCounter(
+            super().vocabulary_size(), self.window_size, self.distance_weighting, self.memory_budget
+        )
+        try:
+            self._count_cooccurrences(counter)
+        except BaseException:
+            counter.close()
+            raise
+        word_count_cap = self._word_count_cap()
+
+        def shard_samples(key_range, epoch):
+            for word_pairs, co_occurrences in counter.pairs(lower=key_range[0], upper=key_range[1]):
+                if counts:
+                    yield word_pairs.astype(np.int32), co_occurrences.astype(np.float32)
+                else:
+                    expected_values = np.log(np.minimum(word_count_cap, co_occurrences)).astype(np.float32)
+                    yield word_pairs.astype(np.int32), expected_values
 
-            X_y["X"] = training_samples_x
-            X_y["y"] = training_samples_y
-            if self.dry_run:
-                return vocabulary_size, X_y
-            else:
-                save_training_data(self.training_data_file, X_y)
-                self.logger.info(f"Vocabulary size: {vocabulary_size}")
+        return TrainingStream(counter.key_ranges(shards), shard_samples, batch_size, prefetch, seed, counter.close)
+
+    def build_glove_training_data(self):
+        # The co-occurrence counts span the whole corpus, so any changed file means building it all again
+        config = {
+            "window_size": self.window_size,
+            "distance_weighting": self.distance_weighting,
+            "columns": ["X", "y", "count"],
+        }
+        if self.dry_run or not super().is_training_data_up_to_date("glove", [self.training_data_file], config):
+            vocabulary_size = super().vocabulary_size()
+            word_count_cap = self._word_count_cap()
+            with CooccurrenceCounter(
+                vocabulary_size, self.window_size, self.distance_weighting, self.memory_budget
+            ) as counter:
+                # Step 1: Co-occurrence counts
+                self._count_cooccurrences(counter)
+                # Step 2: one training sample per co-occurring word pair, written as they come out of the
+                # co-occurrence counter, only a dry run keeps all of them in memory
+                if self.dry_run:
+                    X_y = {"X": [], "y": [], "count": []}
+                    for word_pairs, co_occurrences in counter.pairs():
+                        X_y["X"].extend(word_pairs.tolist())
+                        X_y["y"].extend(np.log(np.minimum(word_count_cap, co_occurrences)).tolist())
+                        X_y["count"].extend(co_occurrences.tolist())
+                    return vocabulary_size, X_y
+                # y is the log of the count capped at 70% of the largest word count, count the (weighted)
+                # co-occurrence count itself for the GloVe weighted least squares
+                columns = {"X": (np.int32, (2,)), "y": (np.float32, ()), "count": (np.float32, ())}
+                with super().training_data_writer(self.training_data_file, columns) as writer:
+                    for word_pairs, co_occurrences in counter.pairs():
+                        expected_values = np.log(np.minimum(word_count_cap, co_occurrences))
+                        writer.append(X=word_pairs, y=expected_values, count=co_occurrences)
+            super().record_training_data("glove", [self.training_data_file], config)
+            self.logger.info(f"Vocabulary size: {vocabulary_size}, training samples: {writer.rows}")
 
 
 def main():
@@ -107,10 +118,14 @@ def main():
     with open(config_file) as config:
         config_dict = yaml.load(config, Loader=yaml.Loader)
     window_size = config_dict["window_size"]
-    tokenizer_file = path.join(dir_name, "../../../", config_dict["dictionary"])
-    tokenizer_json_file = path.join(dir_name, "../../../", config_dict["dictionary_json"])
+    vocabulary_file = path.join(dir_name, "../../../", config_dict["vocabulary"])
     glove_training_builder = GloveTrainingBuilder(
-        source_dir, window_size, tokenizer_file, tokenizer_json_file
+        source_dir,
+        window_size,
+        vocabulary_file,
+        workers=config_dict["encoder_workers"],
+        distance_weighting=config_dict["glove_distance_weighting"],
+        memory_budget=config_dict["glove_memory_mb"] * 1024 * 1024,
     )
     glove_training_builder.build_glove_training_data()
 
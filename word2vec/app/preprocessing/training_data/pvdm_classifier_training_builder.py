@@ -1,5 +1,7 @@
-from .training_data_builder import TrainingDataBuilder, load_tokenizer, save_training_data
+from .training_data_builder import TrainingDataBuilder
+from .context_windows import context_windows
 from app.preprocessing.cleaning.data_cleaner import clean_line
+from app.preprocessing.manifest import MANIFEST_DIR
 import sys
 import numpy as np
 from os import path
@@ -14,6 +16,8 @@ logging.basicConfig(filename="training.log",
                     format="%(asctime)s [%(levelname)s] %(message)s",
                     level=logging.INFO)
 
+PARAGRAPH_STOP_WORDS = ['a', 'an', 'are', 'as', 'if', 'is', 'for', 'the', 'to']
+
 
 # Check for too short paragraphs (arbitrary "min length": 10 words) and (in order of precedence)
 # 1. merge with previous paragraph (if exists) or
@@ -44,17 +48,15 @@ def _restructure_paragraphs(paragraphs):
 
 class PVDMClassifierTrainingBuilder(TrainingDataBuilder):
 
-    def __init__(self, source_dir, vector_size, window_size, tokenizer_file):
-        super().__init__(source_dir, tokenizer_file)
+    def __init__(self, source_dir, vector_size, window_size, vocabulary_file, manifest_dir=MANIFEST_DIR, workers=1):
+        super().__init__(source_dir, vocabulary_file, manifest_dir, workers=workers)
         dir_name = path.dirname(__file__)
         #self.logger = logging.getLogger(__name__)
         self.vector_size = vector_size
         self.window_size = window_size
         self.doc_to_paragraph_ids = {}
         self._paragraph_id = 0
-        if path.exists(tokenizer_file):
-            self.tokenizer = load_tokenizer(tokenizer_file)
-        else:
+        if not path.exists(vocabulary_file):
             raise RuntimeError("There must be a dictionary file created before we can categorize the docs")
         self.training_data_file = path.join(
             dir_name, "../../../data/4_training_data/doc_classifier/training_data.dat"
@@ -67,10 +69,10 @@ class PVDMClassifierTrainingBuilder(TrainingDataBuilder):
         paragraphs = []
         with open(doc, "r", encoding="utf-8", errors="ignore") as doc_data:
             # A line in any of the files in data/2_parsed/blogs correspond to a paragraph in the original blog post
-            for line in doc_data:
-                cleaned_line = clean_line(dirty_line=line, stop_words=['a', 'an', 'are', 'as', 'if', 'is', 'for', 'the',
-                                                                       'to'])
-                word_ids = super().line_to_word_ids(cleaned_line.strip().split())
+            cleaned_lines = (
+                clean_line(dirty_line=line, stop_words=PARAGRAPH_STOP_WORDS).strip().split() for line in doc_data
+            )
+            for word_ids in super().lines_to_word_ids(cleaned_lines):
                 if len(word_ids) > 0:
                     paragraphs.append(word_ids)
         logging.info(f"Before restructuring, {doc} contains paragraphs: {len(paragraphs)}")
@@ -85,55 +87,42 @@ class PVDMClassifierTrainingBuilder(TrainingDataBuilder):
         self.doc_to_paragraph_ids[doc_filename] = paragraph_ids
         return paragraph_ids
 
-    def _build_samples_for_paragraph(self, paragraph, paragraph_id):
-        # self.logger.info(f"Paragraph: {paragraph}")
-        buffer = np.zeros(self.window_size, dtype=np.intc).tolist()
-        buffered_paragraph = list(chain(buffer, paragraph, buffer))
-        for focus_word_pos, focus_word_id in enumerate(paragraph):
-            if focus_word_id == 0:
-                continue
-            # We zero-initialize paragraph ID + context word IDs array
-            context_word_ids = np.zeros((self.window_size * 2) + 1, dtype=np.int32).tolist()
-            context_word_ids[0] = paragraph_id
-            # The words (in the "window sized"-list of words) *before* our focus word
-            start = focus_word_pos - self.window_size
-            # The words (in the "window sized"-list of words) *after* our focus word
-            end = focus_word_pos + self.window_size + 1
-            context_word_index = 1
-            buffered_paragraph_index = focus_word_pos
-            for i in range(start, end):
-                if i == focus_word_pos:
-                    buffered_paragraph_index += 1
-                    continue
-                context_word_ids[context_word_index] = buffered_paragraph[
-                    buffered_paragraph_index
-                ]
-                context_word_index += 1
-                buffered_paragraph_index += 1
-            logging.debug("X: {} y: {}", context_word_ids, focus_word_id)
-            yield context_word_ids, focus_word_id
+    def _build_samples_for_paragraphs(self, paragraphs, paragraph_ids):
+        # One sample per word of every paragraph: the paragraph id followed by the ids of the window_size words before
+        # and after the (focus) word, and the focus word id
+        lengths = [len(paragraph) for paragraph in paragraphs]
+        offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        ids = np.fromiter(chain.from_iterable(paragraphs), dtype=np.int32, count=int(offsets[-1]))
+        X = np.empty((len(ids), self.window_size * 2 + 1), dtype=np.int32)
+        X[:, 0] = np.repeat(np.asarray(paragraph_ids, dtype=np.int32), lengths)
+        _, focus_word_ids = context_windows(ids, offsets, self.window_size, out=X[:, 1:])
+        # Padding is no focus word
+        samples = focus_word_ids != 0
+        return X[samples], focus_word_ids[samples]
 
     def _save_doc_to_paragraphs(self):
         with open(self.doc_to_paragraph_ids_file, 'w') as fw:
             json.dump(self.doc_to_paragraph_ids, fw)
 
     def build_training_data(self):
-        X_y = dict()
-        X = []
-        Y = []
-        for doc in self.cleaned_files:
-            _, doc_filename = path.split(doc)
-            doc_paragraphs = self._document_to_paragraphs(doc)
-            paragraph_ids = self._doc_to_paragraph_ids(doc_filename, doc_paragraphs)
-            for (paragraph_id, paragraph) in zip(paragraph_ids, doc_paragraphs):
-                for (x, y) in self._build_samples_for_paragraph(paragraph, paragraph_id):
-                    X.append(x)
-                    Y.append(y)
-        X_y["X"] = X
-        X_y["y"] = Y
-        logging.info(f"Size X: {len(X)}, size y: {len(Y)}")
-        save_training_data(self.training_data_file, X_y)
+        # Paragraph ids are numbered across all docs, so any changed doc means building it all again
+        config = {"window_size": self.window_size, "vector_size": self.vector_size, "stop_words": PARAGRAPH_STOP_WORDS}
+        outputs = [self.training_data_file, self.doc_to_paragraph_ids_file]
+        if super().is_training_data_up_to_date("doc_classifier", outputs, config):
+            logging.info("Doc classifier training data is up to date")
+            return
+        columns = {"X": (np.int32, (self.window_size * 2 + 1,)), "y": (np.int32, ())}
+        with super().training_data_writer(self.training_data_file, columns) as writer:
+            # Written doc by doc, the samples of all docs are never held in memory at once
+            for doc in self.cleaned_files:
+                _, doc_filename = path.split(doc)
+                doc_paragraphs = self._document_to_paragraphs(doc)
+                paragraph_ids = self._doc_to_paragraph_ids(doc_filename, doc_paragraphs)
+                X, Y = self._build_samples_for_paragraphs(doc_paragraphs, paragraph_ids)
+                writer.append(X=X, y=Y)
+        logging.info(f"Size X: {writer.rows}, size y: {writer.rows}")
         self._save_doc_to_paragraphs()
+        super().record_training_data("doc_classifier", outputs, config)
 
 
 def main():
@@ -145,9 +134,10 @@ def main():
         config_dict = yaml.load(config, Loader=yaml.Loader)
     vector_size = config_dict["vector_size"]
     window_size = config_dict["window_size"]
-    tokenizer_file = path.join(dir_name, "../../../", config_dict["dictionary"])
+    vocabulary_file = path.join(dir_name, "../../../", config_dict["vocabulary"])
     classifier_training_builder = PVDMClassifierTrainingBuilder(source_dir=source_dir, vector_size=vector_size,
-                                                                window_size=window_size, tokenizer_file=tokenizer_file)
+                                                                window_size=window_size, vocabulary_file=vocabulary_file,
+                                                                workers=config_dict["encoder_workers"])
     classifier_training_builder.build_training_data()
 
 
@@ -1,10 +1,16 @@
-from .training_data_builder import load_tokenizer, save_training_data
+from .training_data_builder import load_tokenizer
+from .training_data_file import TrainingDataWriter
+from ..manifest import StageManifest, MANIFEST_DIR
 from os import path
 import yaml
 import logging
+import numpy as np
 from itertools import chain
 from nltk import ngrams
 
+# Lines tokenized at a time
+BATCH_LINES = 10000
+
 
 def _generate_training_samples(word_ids):
     bigrams = []
@@ -21,18 +27,85 @@ def _generate_training_samples(word_ids):
     return bigrams, trigrams
 
 
+def sentence_ngrams(ids, offsets):
+    """
+    The bigram/trigram pairs of _generate_training_samples for many sentences at once, from their flat word ids and
+    offsets: (pairs, 2) bigrams, (pairs, 3) trigrams, and the sentence of every pair. A sentence of n > 1 words has
+    n - 1 pairs, its last trigram padded with 0, a sentence of one word has one padded pair and one without words none.
+    """
+    ids = np.concatenate((np.asarray(ids, dtype=np.int32), np.zeros(2, dtype=np.int32)))
+    lengths = np.diff(offsets)
+    pairs = np.where(lengths > 1, lengths - 1, lengths)
+    sentences = np.repeat(np.arange(len(lengths)), pairs)
+    # Position of every pair in its sentence, and of its first word in ids
+    positions = np.arange(len(sentences)) - np.repeat(np.cumsum(pairs) - pairs, pairs)
+    starts = np.asarray(offsets[:-1])[sentences] + positions
+    lengths = lengths[sentences]
+    bigrams = np.stack((ids[starts], np.where(lengths > 1, ids[starts + 1], 0)), axis=1)
+    trigrams = np.stack(
+        (
+            np.where(lengths > 1, ids[starts], 0),
+            np.where(lengths > 1, ids[starts + 1], ids[starts]),
+            np.where(positions + 2 < lengths, ids[starts + 2], 0),
+        ),
+        axis=1,
+    )
+    return bigrams, trigrams, sentences
+
+
+def sentence_batches(ids, offsets, labels, batch_size, seed=0, messages=None, bucket_messages=0, chunk_batches=64):
+    """
+    Batches of batch_size bigram/trigram pairs (the last one may be smaller) of the messages (all by default) of flat
+    word ids with offsets and a label per message, as dicts of "bigrams", "trigrams" and "y" arrays. The messages are
+    shuffled (only depending on the seed) and taken chunk_batches * batch_size messages at a time: their word ids are
+    gathered with one fancy index, split into pairs by sentence_ngrams, and every pair gets the label of its message.
+
+    With bucket_messages, the messages of every window of bucket_messages shuffled messages are sorted by length, so
+    that a batch has the pairs of messages of about the same length, and the batches of a chunk are shuffled.
+    """
+    random = np.random.default_rng(seed)
+    offsets = np.asarray(offsets)
+    messages = random.permutation(np.arange(len(labels)) if messages is None else np.asarray(messages))
+    lengths = offsets[messages + 1] - offsets[messages]
+    if bucket_messages:
+        order = np.lexsort((lengths, np.arange(len(messages)) // bucket_messages))
+        messages, lengths = messages[order], lengths[order]
+    chunk_messages = chunk_batches * batch_size
+    rest = None
+    for start in range(0, len(messages), chunk_messages):
+        chunk = messages[start:start + chunk_messages]
+        chunk_lengths = lengths[start:start + chunk_messages]
+        chunk_offsets = np.concatenate(([0], np.cumsum(chunk_lengths)))
+        positions = np.arange(chunk_offsets[-1]) - np.repeat(chunk_offsets[:-1], chunk_lengths)
+        bigrams, trigrams, sentences = sentence_ngrams(
+            ids[np.repeat(offsets[chunk], chunk_lengths) + positions], chunk_offsets
+        )
+        pairs = {"bigrams": bigrams, "trigrams": trigrams, "y": np.asarray(labels[chunk], dtype=np.int32)[sentences]}
+        if rest is not None:
+            pairs = {name: np.concatenate((rest[name], column)) for name, column in pairs.items()}
+        batches = len(pairs["y"]) // batch_size
+        starts = np.arange(batches) * batch_size
+        for batch_start in random.permutation(starts) if bucket_messages else starts:
+            yield {name: column[batch_start:batch_start + batch_size] for name, column in pairs.items()}
+        rest = {name: column[batches * batch_size:] for name, column in pairs.items()}
+    if rest is not None and len(rest["y"]):
+        yield rest
+
+
 class SentenceClassifierTrainingBuilder(object):
     logging.basicConfig(level=logging.INFO)
 
-    def __init__(self, source_file, tokenizer_file, dry_run=False):
+    def __init__(self, source_file, tokenizer_file, dry_run=False, manifest_dir=MANIFEST_DIR):
         dir_name = path.dirname(__file__)
         self.logger = logging.getLogger(__name__)
         self.training_data_file = path.join(
             dir_name, "../../../data/4_training_data/sentence_classifier/training_data.dat"
         )
         self.source_file = source_file
+        self.tokenizer_file = tokenizer_file
         self.tokenizer = load_tokenizer(tokenizer_file)
         self.dry_run = dry_run
+        self.manifest_dir = manifest_dir
 
     def _training_line_generator(self):
         with open(
@@ -41,27 +114,61 @@ class SentenceClassifierTrainingBuilder(object):
             for line in training_data:
                 yield line.split(",")
 
+    def _training_line_batches(self, batch_lines=BATCH_LINES):
+        lines = []
+        for line in self._training_line_generator():
+            lines.append(line)
+            if len(lines) == batch_lines:
+                yield lines
+                lines = []
+        if lines:
+            yield lines
+
     def _line_to_word_ids(self, line):
         return self.tokenizer.texts_to_sequences([line])[0]
 
+    def _dry_run_samples(self):
+        # The samples as the training data file used to have them: [bigrams, trigrams] and their labels per sentence
+        X = []
+        y = []
+        for line, label in self._training_line_generator():
+            self.logger.debug(f"Training data line: {line}")
+            word_ids = self._line_to_word_ids(line)
+            self.logger.debug(f"Training data word ids: {word_ids}")
+            bigrams, trigrams = _generate_training_samples(word_ids)
+            X.append([bigrams, trigrams])
+            y.append([int(label.rstrip())] * len(bigrams))
+        return {"X": X, "y": y}
+
     def build_sentence_training_data(self):
-        if self.dry_run or not path.exists(self.training_data_file):
-            X_y = dict()
-            X = []
-            y = []
-            for line, label in self._training_line_generator():
-                self.logger.debug(f"Training data line: {line}")
-                word_ids = self._line_to_word_ids(line)
-                self.logger.debug(f"Training data word ids: {word_ids}")
-                bigrams, trigrams = _generate_training_samples(word_ids)
-                X.append([bigrams, trigrams])
-                y.append([int(label.rstrip())] * len(bigrams))
-            X_y["X"] = X
-            X_y["y"] = y
+        manifest = StageManifest("sentence_classifier", self.manifest_dir)
+        inputs = [self.source_file, self.tokenizer_file]
+        if self.dry_run or not manifest.is_up_to_date("training_data", inputs, [self.training_data_file]):
             if self.dry_run:
-                return X_y
-            else:
-                save_training_data(self.training_data_file, X_y)
+                return self._dry_run_samples()
+            # The training data file has the word ids of every sentence and one label per sentence, the bigram/trigram
+            # pairs are made per batch while training (see sentence_batches)
+            columns = {"ids": (np.int32, ()), "lengths": (np.int32, ()), "y": (np.int32, ())}
+            with TrainingDataWriter(
+                self.training_data_file, columns=columns, sequences={"ids": "lengths"}
+            ) as writer:
+                for lines in self._training_line_batches():
+                    texts, labels = zip(*lines)
+                    # A line without known words has no pairs
+                    kept = [
+                        (sequence, int(label.rstrip()))
+                        for sequence, label in zip(self.tokenizer.texts_to_sequences(list(texts)), labels) if sequence
+                    ]
+                    lengths = np.array([len(sequence) for sequence, _ in kept], dtype=np.int32)
+                    writer.append(
+                        ids=np.fromiter(
+                            (word_id for sequence, _ in kept for word_id in sequence), np.int32, int(lengths.sum())
+                        ),
+                        lengths=lengths,
+                        y=np.array([label for _, label in kept], dtype=np.int32),
+                    )
+            manifest.record("training_data", inputs, [self.training_data_file])
+            manifest.save()
 
 
 def main():
@@ -0,0 +1,131 @@
+import copy
+import numpy as np
+
+
+class AliasTable(object):
+    """
+    Walker's alias method: after building the table in O(n), every sample from the (unnormalized) discrete
+    distribution weights takes one uniform integer and one uniform float, no matter the number of outcomes.
+    """
+
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        scaled = (weights * len(weights) / weights.sum()).tolist()
+        probabilities = [1.0] * len(weights)
+        aliases = list(range(len(weights)))
+        small = [i for i, weight in enumerate(scaled) if weight < 1.0]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1.0]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            probabilities[less] = scaled[less]
+            aliases[less] = more
+            scaled[more] += scaled[less] - 1.0
+            (small if scaled[more] < 1.0 else large).append(more)
+        # What's left over has a probability of 1 (up to rounding errors)
+        self.probabilities = np.array(probabilities)
+        self.aliases = np.array(aliases, dtype=np.int32)
+
+    def sample(self, size, random):
+        outcomes = random.integers(0, len(self.probabilities), size, dtype=np.int32)
+        aliased = random.random(size) >= self.probabilities[outcomes]
+        outcomes[aliased] = self.aliases[outcomes[aliased]]
+        return outcomes
+
+
+class SkipGramPairs(object):
+    """
+    Skip-gram training pairs with negative sampling, for batches of lines in the CSR layout of Vocabulary.encode
+    (replacing keras.preprocessing.sequence.skipgrams, a line at a time):
+
+    - frequent words are subsampled first: a word making up a fraction f of the corpus is kept with probability
+      (sqrt(f / threshold) + 1) * threshold / f, as in word2vec,
+    - every word is paired with the words up to window_size words before and after it (label 1),
+    - and, for every such pair, with negative_samples words drawn from the unigram distribution raised to the power
+      0.75 (label 0).
+
+    The pairs of a batch are shuffled. With the same seed (and the same batches) the pairs are always the same. The
+    tables are built once for the counts, with_seed gives pairs with other random draws from the same tables.
+    """
+
+    def __init__(self, counts, window_size, negative_samples=1, subsampling_threshold=1e-3, seed=None):
+        counts = np.asarray(counts, dtype=np.float64)
+        self.window_size = window_size
+        self.negative_samples = negative_samples
+        self.random = np.random.default_rng(seed)
+        self.keep_probabilities = None
+        if subsampling_threshold:
+            frequencies = counts / max(counts.sum(), 1.0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                keep = (np.sqrt(frequencies / subsampling_threshold) + 1) * subsampling_threshold / frequencies
+            # Words without count (padding, out-of-vocabulary) are always kept
+            self.keep_probabilities = np.where(frequencies > 0, np.minimum(keep, 1.0), 1.0)
+        weights = counts ** 0.75
+        if weights.sum() == 0:
+            weights = np.ones_like(weights)
+        # Padding is never a negative sample
+        weights[0] = 0
+        self.negative_table = AliasTable(weights)
+
+    def with_seed(self, seed):
+        # The same pairs with a random generator of their own: the keep probabilities and the alias table are shared
+        skip_gram_pairs = copy.copy(self)
+        skip_gram_pairs.random = np.random.default_rng(seed)
+        return skip_gram_pairs
+
+    def pairs(self, ids, offsets):
+        """
+        The pairs of a batch of lines: an (n, 2) int32 array of (target, context) word ids and the n int32 labels.
+        """
+        ids = np.asarray(ids, dtype=np.int32)
+        lines = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        if self.keep_probabilities is not None:
+            kept = self.random.random(len(ids)) < self.keep_probabilities[ids]
+            ids = ids[kept]
+            lines = lines[kept]
+        targets = []
+        contexts = []
+        for distance in range(1, min(self.window_size, len(ids) - 1) + 1):
+            same_line = lines[:-distance] == lines[distance:]
+            left = ids[:-distance][same_line]
+            right = ids[distance:][same_line]
+            targets.extend((left, right))
+            contexts.extend((right, left))
+        targets = np.concatenate(targets) if targets else np.empty(0, dtype=np.int32)
+        contexts = np.concatenate(contexts) if contexts else np.empty(0, dtype=np.int32)
+        positives = len(targets)
+        negatives = positives * self.negative_samples
+        pairs = np.empty((positives + negatives, 2), dtype=np.int32)
+        pairs[:positives, 0] = targets
+        pairs[:positives, 1] = contexts
+        pairs[positives:, 0] = np.repeat(targets, self.negative_samples)
+        pairs[positives:, 1] = self.negative_table.sample(negatives, self.random)
+        labels = np.zeros(positives + negatives, dtype=np.int32)
+        labels[:positives] = 1
+        shuffled = self.random.permutation(len(labels))
+        return pairs[shuffled], labels[shuffled]
+
+    def batches(self, encoded_lines, batch_size):
+        """
+        Streams the pairs of (ids, offsets) batches of lines as batches of exactly batch_size pairs (except for the
+        last one): only the pairs of one batch of lines are held in memory at a time.
+        """
+        pending_pairs = []
+        pending_labels = []
+        pending = 0
+        for ids, offsets in encoded_lines:
+            pairs, labels = self.pairs(ids, offsets)
+            pending_pairs.append(pairs)
+            pending_labels.append(labels)
+            pending += len(labels)
+            if pending >= batch_size:
+                pairs = np.concatenate(pending_pairs)
+                labels = np.concatenate(pending_labels)
+                full = pending - pending % batch_size
+                for start in range(0, full, batch_size):
+                    yield pairs[start:start + batch_size], labels[start:start + batch_size]
+                pending_pairs = [pairs[full:]]
+                pending_labels = [labels[full:]]
+                pending -= full
+        if pending:
+            yield np.concatenate(pending_pairs), np.concatenate(pending_labels)
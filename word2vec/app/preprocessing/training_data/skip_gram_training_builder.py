@@ -1,7 +1,10 @@
-from .training_data_builder import TrainingDataBuilder, save_training_data
+from .training_data_builder import TrainingDataBuilder
+from .skip_gram_pairs import SkipGramPairs
+from ..manifest import MANIFEST_DIR
 import sys
+import zlib
+import numpy as np
 from os import path
-from keras.preprocessing import sequence
 import yaml
 import logging
 
@@ -9,43 +12,76 @@ import logging
 class SkipGramTrainingBuilder(TrainingDataBuilder):
     logging.basicConfig(level=logging.INFO)
 
-    def __init__(self, source_dir, window_size, tokenizer_file, dry_run=False):
-        super().__init__(source_dir, tokenizer_file)
+    def __init__(self, source_dir, window_size, vocabulary_file, dry_run=False, manifest_dir=MANIFEST_DIR,
+                 workers=1, negative_samples=1, subsampling_threshold=1e-3, seed=0, batch_size=1024 * 1024):
+        super().__init__(source_dir, vocabulary_file, manifest_dir, workers=workers)
         dir_name = path.dirname(__file__)
         self.dry_run = dry_run
         self.window_size = window_size
+        # Negative pairs per positive pair, and the word frequency above which words are subsampled
+        self.negative_samples = negative_samples
+        self.subsampling_threshold = subsampling_threshold
+        self.seed = seed
+        # Pairs per batch written to the training data
+        self.batch_size = batch_size
         self.training_data_file = path.join(
             dir_name, "../../../data/4_training_data/skip_gram/training_data.dat"
         )
         self.logger = logging.getLogger(__name__)
+        # The tokenizer and the SkipGramPairs of its counts: the sampling tables are built once, not per file
+        self._pairs_tables = None
+
+    def _skip_gram_pairs(self, clean_file, *seed):
+        # Every file gets its own random generator, so the pairs of a file don't depend on which other files had to
+        # be built again
+        if self._pairs_tables is None or self._pairs_tables[0] is not self.tokenizer:
+            skip_gram_pairs = SkipGramPairs(
+                self.tokenizer.counts, self.window_size, self.negative_samples, self.subsampling_threshold
+            )
+            self._pairs_tables = (self.tokenizer, skip_gram_pairs)
+        seed = [self.seed, zlib.crc32(super()._file_key(clean_file).encode("utf-8"))] + list(seed)
+        return self._pairs_tables[1].with_seed(seed)
+
+    def _file_training_samples(self, clean_file):
+        skip_gram_pairs = self._skip_gram_pairs(clean_file)
+        encoded_lines = super().encode_lines(super().file_line_generator(clean_file))
+        yield from skip_gram_pairs.batches(encoded_lines, self.batch_size)
+
+    def _file_training_stream(self, clean_file, epoch):
+        # Other subsampled words and negative samples every epoch, yielded per batch of encoded lines
+        skip_gram_pairs = self._skip_gram_pairs(clean_file, epoch)
+        for ids, offsets in super().encode_lines(super().file_line_generator(clean_file)):
+            yield skip_gram_pairs.pairs(ids, offsets)
+
+    def sg_training_stream(self, batch_size, prefetch=64):
+        return super().training_stream(self._file_training_stream, batch_size, prefetch, self.seed)
 
     def build_sg_training_data(self):
-        if self.dry_run or not path.exists(self.training_data_file):
+        config = {
+            "window_size": self.window_size,
+            "negative_samples": self.negative_samples,
+            "subsampling_threshold": self.subsampling_threshold,
+            "seed": self.seed,
+        }
+        if self.dry_run or not super().is_training_data_up_to_date("skip_gram", [self.training_data_file], config):
             vocabulary_size = super().vocabulary_size()
-            X_y = dict()
-            training_samples_x = []
-            training_samples_y = []
-            sampling_table = sequence.make_sampling_table(vocabulary_size + 1)
-
-            for line in super().training_line_generator():
-                word_ids = super().line_to_word_ids(line)
-                word_pairs, labels = sequence.skipgrams(
-                    sequence=word_ids,
-                    vocabulary_size=vocabulary_size,
-                    window_size=self.window_size,
-                    sampling_table=sampling_table,
-                )
-                training_samples_x.extend(word_pairs)
-                training_samples_y.extend(labels)
-            self.logger.debug(
-                f"Skip-gram training samples: {len(training_samples_x)}, labels: {len(training_samples_y)}"
-            )
-            X_y["X"] = training_samples_x
-            X_y["y"] = training_samples_y
             if self.dry_run:
+                X_y = dict()
+                training_samples_x, training_samples_y = super().build_training_samples(
+                    "skip_gram", config, self._file_training_samples, dry_run=True
+                )
+                self.logger.debug(
+                    f"Skip-gram training samples: {len(training_samples_x)}, labels: {len(training_samples_y)}"
+                )
+                X_y["X"] = training_samples_x
+                X_y["y"] = training_samples_y
                 return vocabulary_size, X_y
             else:
-                save_training_data(self.training_data_file, X_y)
+                columns = {"X": (np.int32, (2,)), "y": (np.int32, ())}
+                with super().training_data_writer(self.training_data_file, columns) as writer:
+                    super().build_training_samples("skip_gram", config, self._file_training_samples, writer=writer)
+                self.logger.debug(f"Skip-gram training samples: {writer.rows}")
+                super().record_training_data("skip_gram", [self.training_data_file], config)
                 self.logger.info(f"Vocabulary size: {vocabulary_size}")
 
 
@@ -57,9 +93,15 @@ def main():
     with open(config_file) as config:
         config_dict = yaml.load(config, Loader=yaml.Loader)
     window_size = config_dict["window_size"]
-    tokenizer_file = path.join(dir_name, "../../../", config_dict["dictionary"])
+    vocabulary_file = path.join(dir_name, "../../../", config_dict["vocabulary"])
     skip_gram_training_builder = SkipGramTrainingBuilder(
-        source_dir, window_size, tokenizer_file
+        source_dir,
+        window_size,
+        vocabulary_file,
+        workers=config_dict["encoder_workers"],
+        negative_samples=config_dict["negative_samples"],
+        subsampling_threshold=config_dict["subsampling_threshold"],
+        seed=config_dict["seed"],
     )
     skip_gram_training_builder.build_sg_training_data()
 
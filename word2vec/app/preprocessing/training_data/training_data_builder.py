@@ -1,20 +1,18 @@
 import pickle
 import sys
 import os
+import threading
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool, cpu_count
 from os import path
 import yaml
 import logging
-from keras.preprocessing.text import Tokenizer
-
-
-def save_training_data(training_data_file, X_y):
-    with open(training_data_file, "wb") as f:
-        pickle.dump(X_y, f)
-
-
-def load_training_data(training_data_file):
-    with open(training_data_file, "rb") as f:
-        return pickle.load(f)
+import numpy as np
+from .vocabulary import Vocabulary, VocabularyBuilder
+from .training_data_file import TrainingDataWriter, load_training_data
+from .training_stream import TrainingStream
+from ..manifest import StageManifest, MANIFEST_DIR
 
 
 def cleaned_files(source_dir):
@@ -26,55 +24,245 @@ def cleaned_files(source_dir):
 
 
 def load_tokenizer(tokenizer_file):
-    with open(tokenizer_file, "rb") as f:
-        return pickle.load(f)
+    # A Vocabulary file (e.g. the pretrained GloVe vocabulary), or a pickled Keras Tokenizer
+    try:
+        return Vocabulary.load(tokenizer_file)
+    except ValueError:
+        with open(tokenizer_file, "rb") as f:
+            return pickle.load(f)
+
+
+# Lines encoded per call of Vocabulary.encode, large enough for the per-call overhead not to matter
+ENCODE_BATCH_LINES = 10000
+
+# The vocabulary of a worker process: every worker memory maps the same vocabulary file
+_worker_vocabulary = None
+
+
+def _init_encoder(vocabulary_file):
+    global _worker_vocabulary
+    _worker_vocabulary = Vocabulary.load(vocabulary_file)
+
+
+def _encode_batch(lines):
+    return _worker_vocabulary.encode(lines)
+
+
+def line_batches(lines, batch_lines=ENCODE_BATCH_LINES):
+    lines = iter(lines)
+    batch = list(islice(lines, batch_lines))
+    while batch:
+        yield batch
+        batch = list(islice(lines, batch_lines))
 
 
 class TrainingDataBuilder(object):
     logging.basicConfig(level=logging.INFO)
 
-    def __init__(self, source_dir, tokenizer_file):
+    def __init__(self, source_dir, vocabulary_file, manifest_dir=MANIFEST_DIR, min_count=1, max_size=None, workers=1):
         self.logger = logging.getLogger(__name__)
+        self.source_dir = source_dir
         self.cleaned_files = cleaned_files(source_dir)
         self.logger.debug(f"source files for training: {self.cleaned_files}")
-        if path.exists(tokenizer_file):
-            self.tokenizer = load_tokenizer(tokenizer_file)
+        if path.exists(vocabulary_file):
+            self.tokenizer = Vocabulary.load(vocabulary_file)
         else:
-            self.tokenizer = Tokenizer(oov_token="UNK")
-        self.tokenizer_file = tokenizer_file
+            self.tokenizer = VocabularyBuilder().build()
+        self.vocabulary_file = vocabulary_file
+        self.manifest_dir = manifest_dir
+        self.min_count = min_count
+        self.max_size = max_size
+        # Processes encoding lines to word ids, 0 means one per cpu
+        self.workers = workers or cpu_count()
+        # The pool of encoder processes, started on first use and shared by all encode_lines calls until close
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _encoder_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = Pool(processes=self.workers, initializer=_init_encoder, initargs=(self.vocabulary_file,))
+            return self._pool
+
+    def close(self):
+        # Stops the encoder processes, e.g. once the training data is built or the vocabulary they loaded changed
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def file_line_generator(self, clean_file):
+        with open(
+            clean_file, "r", encoding="utf-8", errors="ignore"
+        ) as training_data:
+            for line in training_data:
+                yield line
 
     def training_line_generator(self):
         for clean_file in self.cleaned_files:
-            with open(
-                clean_file, "r", encoding="utf-8", errors="ignore"
-            ) as training_data:
-                for line in training_data:
-                    yield line
+            yield from self.file_line_generator(clean_file)
 
     def line_to_word_ids(self, line):
         return self.tokenizer.texts_to_sequences([line])[0]
 
+    def encode_lines(self, lines, batch_lines=ENCODE_BATCH_LINES):
+        """
+        Encodes lines batch_lines at a time, yielding per batch the word ids of all its lines as one flat int32
+        array plus the offsets of the lines into it (see Vocabulary.encode). With more than one worker the
+        batches are encoded by the builder's pool of processes (started once, see close), a few batches ahead of the
+        consumer and yielded in order.
+        """
+        batches = line_batches(lines, batch_lines)
+        if self.workers <= 1 or not path.exists(self.vocabulary_file):
+            for batch in batches:
+                yield self.tokenizer.encode(batch)
+            return
+        pool = self._encoder_pool()
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.apply_async(_encode_batch, (batch,)))
+            if len(pending) > 2 * self.workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    def lines_to_word_ids(self, lines):
+        # Same as line_to_word_ids for every line, but encoded in batches
+        for ids, offsets in self.encode_lines(lines):
+            ids = ids.tolist()
+            offsets = offsets.tolist()
+            for start, end in zip(offsets[:-1], offsets[1:]):
+                yield ids[start:end]
+
+    def file_word_ids(self, clean_file):
+        return self.lines_to_word_ids(self.file_line_generator(clean_file))
+
+    def training_word_ids(self):
+        return self.lines_to_word_ids(self.training_line_generator())
+
     def vocabulary_size(self):
-        return len(self.tokenizer.word_index) + 1
+        return self.tokenizer.vocabulary_size()
 
     def vocabulary(self):
         return self.tokenizer.word_index
 
     def max_word_count(self):
-        return max(self.tokenizer.word_counts.values())
+        return self.tokenizer.max_word_count()
 
-    def _save_tokenizer(self):
-        with open(self.tokenizer_file, "wb") as f:
-            pickle.dump(self.tokenizer, f)
-        # with open(self.tokenizer_json_file, "w", encoding="utf-8") as f2:
-        #    f2.write(json.dumps(self.tokenizer.to_json(), ensure_ascii=False))
+    def _file_key(self, clean_file):
+        return path.relpath(clean_file, self.source_dir)
+
+    def _forget_removed_files(self, manifest, keep=()):
+        file_keys = {self._file_key(clean_file) for clean_file in self.cleaned_files}
+        for key in set(manifest.keys()) - file_keys - set(keep):
+            manifest.forget(key, remove_outputs=True)
+
+    def _file_word_counts(self, manifest, clean_file):
+        # Word counts of a single file, only counted again when the file has changed
+        key = self._file_key(clean_file)
+        counts_file = manifest.cache_file(key)
+        if manifest.is_up_to_date(key, [clean_file], [counts_file]):
+            with open(counts_file, "rb") as f:
+                return pickle.load(f)
+        counts = VocabularyBuilder().update(self.file_line_generator(clean_file))
+        with open(counts_file, "wb") as f:
+            pickle.dump(counts, f)
+        manifest.record(key, [clean_file], [counts_file])
+        return counts
 
     def tokenize(self):
-        # creates word-2-id dictionary
-        if not path.exists(self.tokenizer_file):
-            self.tokenizer.fit_on_texts(self.training_line_generator())
-            self.logger.info(f"Dictionary size: {len(self.tokenizer.word_index) + 1}")
-            self._save_tokenizer()
+        # creates word-2-id dictionary from the word counts of every cleaned file, only files that have changed
+        # since the dictionary was last built are counted again
+        manifest = StageManifest("tokenize", self.manifest_dir)
+        config = {"min_count": self.min_count, "max_size": self.max_size}
+        if manifest.is_up_to_date("dictionary", self.cleaned_files, [self.vocabulary_file], config):
+            return
+        vocabulary_builder = VocabularyBuilder()
+        # Merged in file order, which gives the same word order (and so the same word ids) as counting all files
+        for clean_file in self.cleaned_files:
+            vocabulary_builder.merge(self._file_word_counts(manifest, clean_file))
+        self._forget_removed_files(manifest, keep=["dictionary"])
+        self.tokenizer = vocabulary_builder.build(min_count=self.min_count, max_size=self.max_size)
+        self.logger.info(f"Dictionary size: {self.tokenizer.vocabulary_size()}")
+        os.makedirs(path.dirname(path.abspath(self.vocabulary_file)), exist_ok=True)
+        self.tokenizer.save(self.vocabulary_file)
+        # Encoder processes started before have the previous vocabulary
+        self.close()
+        manifest.record("dictionary", self.cleaned_files, [self.vocabulary_file], config)
+        manifest.save()
+
+    def build_training_samples(self, stage, config, file_samples, writer=None, dry_run=False):
+        """
+        Builds the training samples of every cleaned file with file_samples(clean_file), which yields them in
+        (X, y) chunks. Unless it's a dry run the samples are cached per file and only built again for files that have
+        changed, or when the dictionary or the config of the stage has changed. The samples are appended to the writer
+        chunk by chunk, without a writer (X, y) of all files is returned. The encoder processes are stopped once all
+        files are done.
+        """
+        try:
+            return self._build_training_samples(stage, config, file_samples, writer, dry_run)
+        finally:
+            self.close()
+
+    def _build_training_samples(self, stage, config, file_samples, writer, dry_run):
+        manifest = None if dry_run else StageManifest(stage, self.manifest_dir)
+        columns = writer.declared if writer is not None else None
+        X = []
+        y = []
+        for clean_file in self.cleaned_files:
+            if manifest is None:
+                chunks = file_samples(clean_file)
+            else:
+                key = self._file_key(clean_file)
+                samples_file = manifest.cache_file(key, suffix=".dat")
+                inputs = [clean_file, self.vocabulary_file]
+                if not manifest.is_up_to_date(key, inputs, [samples_file], config):
+                    with TrainingDataWriter(samples_file, self.tokenizer.fingerprint(), columns) as file_writer:
+                        for file_X, file_y in file_samples(clean_file):
+                            file_writer.append(X=file_X, y=file_y)
+                    manifest.record(key, inputs, [samples_file], config)
+                X_y = load_training_data(samples_file)
+                chunks = [(X_y["X"], X_y["y"])] if "X" in X_y else []
+            for file_X, file_y in chunks:
+                if writer is None:
+                    X.extend(np.asarray(file_X).tolist())
+                    y.extend(np.asarray(file_y).tolist())
+                else:
+                    writer.append(X=file_X, y=file_y)
+        if manifest is not None:
+            self._forget_removed_files(manifest, keep=["training_data"])
+            manifest.save()
+        return X, y
+
+    def training_stream(self, file_samples, batch_size, prefetch=64, seed=0):
+        # Training batches of the samples file_samples(clean_file, epoch) yields for every cleaned file, produced in
+        # the background while training instead of built beforehand (see TrainingStream). The encoder processes
+        # are kept for all epochs, until the stream is closed
+        return TrainingStream(self.cleaned_files, file_samples, batch_size, prefetch, seed, self.close)
+
+    def training_data_writer(self, training_data_file, columns=None):
+        # Writer of a training data file with word ids of this builder's vocabulary
+        return TrainingDataWriter(training_data_file, self.tokenizer.fingerprint(), columns)
+
+    # The training data files of a stage are up to date when neither the cleaned files, the dictionary nor the config
+    # of the stage have changed since they were built
+    def is_training_data_up_to_date(self, stage, training_data_files, config):
+        manifest = StageManifest(stage, self.manifest_dir)
+        inputs = self.cleaned_files + [self.vocabulary_file]
+        return manifest.is_up_to_date("training_data", inputs, training_data_files, config)
+
+    def record_training_data(self, stage, training_data_files, config):
+        manifest = StageManifest(stage, self.manifest_dir)
+        inputs = self.cleaned_files + [self.vocabulary_file]
+        manifest.record("training_data", inputs, training_data_files, config)
+        manifest.save()
 
 
 def main():
@@ -84,9 +272,19 @@ def main():
     config_dict = None
     with open(config_file) as config:
         config_dict = yaml.load(config, Loader=yaml.Loader)
-    tokenizer_file = path.join(dir_name, "../../../", config_dict["dictionary"])
-    training_data_builder = TrainingDataBuilder(source_dir, tokenizer_file)
+    vocabulary_file = path.join(dir_name, "../../../", config_dict["vocabulary"])
+    training_data_builder = TrainingDataBuilder(
+        source_dir,
+        vocabulary_file,
+        min_count=config_dict["min_word_count"],
+        max_size=config_dict["max_vocabulary_size"],
+        workers=config_dict["encoder_workers"],
+    )
     training_data_builder.tokenize()
+    # The pickled Keras Tokenizer (and its json) is still exported for the chat bot's KerasTokenizer
+    tokenizer_file = path.join(dir_name, "../../../", config_dict["dictionary"])
+    tokenizer_json_file = path.join(dir_name, "../../../", config_dict["dictionary_json"])
+    training_data_builder.tokenizer.export_keras_tokenizer(tokenizer_file, tokenizer_json_file)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,242 @@
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import logging
+from os import path
+import numpy as np
+
+_MAGIC = b"W2VTRAIN"
+_ALIGNMENT = 64
+_VERSION = 2
+
+
+def _column_dtype(array):
+    # Word ids (and labels) are stored as int32, GloVe's log co-occurrences as float32. An empty list is taken as
+    # word ids, even though numpy makes it float.
+    return np.dtype(np.float32) if array.dtype.kind == "f" and array.size > 0 else np.dtype(np.int32)
+
+
+class TrainingData(object):
+    """
+    Training samples as named columns, e.g. "X" (context word ids, one row per sample) and "y" (target word ids).
+    Columns loaded from a training data file are read-only memory maps: nothing is read before it's used.
+
+    A sequence column holds a variable number of rows per sample, all samples' rows one after the other: its lengths
+    column has the number of rows of every sample, e.g. the word ids of the sentences of the sentence classifier and
+    their lengths, see offsets.
+    """
+
+    def __init__(self, columns, vocabulary=None, sequences=None):
+        self.columns = columns
+        # Fingerprint of the vocabulary the word ids belong to, see Vocabulary.fingerprint
+        self.vocabulary = vocabulary
+        # Sequence column -> its lengths column
+        self.sequences = dict(sequences or {})
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __len__(self):
+        return min((len(column) for name, column in self.columns.items() if name not in self.sequences), default=0)
+
+    def offsets(self, name):
+        # The rows of sequence column name of sample i are self[name][offsets[i]:offsets[i + 1]]
+        return np.concatenate(([0], np.cumsum(self.columns[self.sequences[name]], dtype=np.int64)))
+
+
+class TrainingDataWriter(object):
+    """
+    Writes training samples to a training data file, a batch at a time, so that the whole training set never has to
+    be held in memory. Every column is written to a temporary file of its own while appending, on close they're
+    copied into the training data file:
+
+        magic | data start | header length | json header | column | column | ...
+
+    where the header holds the number of rows, the vocabulary fingerprint, the sequence columns (see TrainingData)
+    and, per column, the dtype, shape and offset (64 byte aligned) from the data start.
+    """
+
+    def __init__(self, training_data_file, vocabulary=None, columns=None, sequences=None):
+        self.training_data_file = training_data_file
+        self.vocabulary = vocabulary
+        # name -> (dtype, shape of a row), columns not declared get their dtype and shape from their first batch
+        self.declared = dict(columns or {})
+        # Sequence column -> its lengths column, a batch of a sequence column has as many rows as its lengths sum to
+        self.sequences = dict(sequences or {})
+        self.columns = {}
+        # Columns only ever appended empty batches, kept to still have them (without rows) in the file
+        self.empty_columns = {}
+        self.rows = 0
+        self.sequence_rows = {name: 0 for name in self.sequences}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._discard()
+
+    def _column(self, name, array):
+        if name not in self.columns:
+            dtype, row_shape = self.declared.get(name, (_column_dtype(array), array.shape[1:]))
+            directory = path.dirname(path.abspath(self.training_data_file))
+            os.makedirs(directory, exist_ok=True)
+            self.columns[name] = {
+                "file": tempfile.TemporaryFile(dir=directory),
+                "dtype": np.dtype(dtype),
+                "row_shape": tuple(row_shape),
+            }
+        return self.columns[name]
+
+    def append(self, **arrays):
+        arrays = {name: np.asarray(array) for name, array in arrays.items()}
+        lengths = {len(array) for name, array in arrays.items() if name not in self.sequences}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns of different lengths: { {name: len(a) for name, a in arrays.items()} }")
+        rows = lengths.pop() if lengths else 0
+        for name, lengths_name in self.sequences.items():
+            if name in arrays and len(arrays[name]) != int(np.sum(arrays.get(lengths_name, 0))):
+                raise ValueError(f"Column {name} has {len(arrays[name])} rows, its lengths sum to another number")
+        if rows == 0:
+            for name, array in arrays.items():
+                self.empty_columns.setdefault(name, array)
+            return
+        if self.columns and set(arrays) != set(self.columns):
+            raise ValueError(f"Expected columns {sorted(self.columns)}, got {sorted(arrays)}")
+        for name, array in arrays.items():
+            column = self._column(name, array)
+            if array.shape[1:] != column["row_shape"]:
+                raise ValueError(
+                    f"Column {name}: expected rows of shape {column['row_shape']}, got {array.shape[1:]}"
+                )
+            np.ascontiguousarray(array, dtype=column["dtype"]).tofile(column["file"])
+        for name in self.sequences:
+            self.sequence_rows[name] += len(arrays.get(name, ()))
+        self.rows += rows
+
+    def close(self):
+        for name, (dtype, row_shape) in self.declared.items():
+            if name not in self.columns:
+                self._column(name, np.empty((0,) + tuple(row_shape), dtype=dtype))
+        for name, array in self.empty_columns.items():
+            if name not in self.columns:
+                self._column(name, array)
+        header = {
+            "version": _VERSION, "rows": self.rows, "vocabulary": self.vocabulary, "sequences": self.sequences,
+            "columns": {},
+        }
+        offset = 0
+        for name, column in self.columns.items():
+            nbytes = column["file"].tell()
+            header["columns"][name] = {
+                "offset": offset,
+                "dtype": column["dtype"].str,
+                "shape": [self.sequence_rows.get(name, self.rows)] + list(column["row_shape"]),
+            }
+            offset += -(-nbytes // _ALIGNMENT) * _ALIGNMENT
+        header_bytes = json.dumps(header).encode("utf-8")
+        data_start = -(-(len(_MAGIC) + 8 + len(header_bytes)) // _ALIGNMENT) * _ALIGNMENT
+        with open(self.training_data_file + ".tmp", "wb") as f:
+            f.write(_MAGIC)
+            f.write(np.array([data_start, len(header_bytes)], dtype="<u4").tobytes())
+            f.write(header_bytes)
+            for name, column in self.columns.items():
+                f.seek(data_start + header["columns"][name]["offset"])
+                column["file"].seek(0)
+                shutil.copyfileobj(column["file"], f, 16 * 1024 * 1024)
+            f.truncate(data_start + offset)
+        os.replace(self.training_data_file + ".tmp", self.training_data_file)
+        self._discard()
+
+    def _discard(self):
+        for column in self.columns.values():
+            column["file"].close()
+        self.columns = {}
+        self.empty_columns = {}
+
+
+def is_training_data_file(training_data_file):
+    with open(training_data_file, "rb") as f:
+        return f.read(len(_MAGIC)) == _MAGIC
+
+
+def save_training_data(training_data_file, X_y, vocabulary=None):
+    with TrainingDataWriter(training_data_file, vocabulary) as writer:
+        writer.append(**{name: column for name, column in X_y.items()})
+
+
+def load_training_data(training_data_file):
+    with open(training_data_file, "rb") as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            # Training data used to be pickled lists, it's converted in memory (convert_training_data converts the
+            # file itself)
+            f.seek(0)
+            return _from_pickle(pickle.load(f))
+        data_start, header_length = (int(value) for value in np.frombuffer(f.read(8), dtype="<u4"))
+        header = json.loads(f.read(header_length).decode("utf-8"))
+    columns = {}
+    for name, column in header["columns"].items():
+        dtype = np.dtype(column["dtype"])
+        shape = tuple(column["shape"])
+        if shape[0] == 0:
+            columns[name] = np.empty(shape, dtype=dtype)
+        else:
+            columns[name] = np.memmap(
+                training_data_file, dtype=dtype, mode="r", offset=data_start + column["offset"], shape=shape
+            )
+    return TrainingData(columns, header["vocabulary"], header.get("sequences"))
+
+
+def _is_sentence_samples(X):
+    # Sentence classifier samples are [bigrams, trigrams] per sentence, i.e. lists of lists of word ids
+    return isinstance(X[0], (list, tuple)) and len(X[0]) == 2 and all(
+        isinstance(ngrams, (list, tuple)) and (len(ngrams) == 0 or isinstance(ngrams[0], (list, tuple)))
+        for ngrams in X[0]
+    )
+
+
+def _from_pickle(X_y):
+    X, y = X_y["X"], X_y["y"]
+    if len(X) > 0 and _is_sentence_samples(X):
+        columns = {
+            "bigrams": np.array([bigram for sample in X for bigram in sample[0]], dtype=np.int32).reshape(-1, 2),
+            "trigrams": np.array([trigram for sample in X for trigram in sample[1]], dtype=np.int32).reshape(-1, 3),
+            "y": np.array([label for labels in y for label in labels], dtype=np.int32),
+        }
+    else:
+        X = np.asarray(X)
+        y = np.asarray(y)
+        columns = {"X": X.astype(_column_dtype(X)), "y": y.astype(_column_dtype(y))}
+    return TrainingData(columns)
+
+
+def convert_training_data(training_data_file, vocabulary=None):
+    # Rewrites a pickled training data file in the binary format, in place
+    if is_training_data_file(training_data_file):
+        return False
+    training_data = load_training_data(training_data_file)
+    with TrainingDataWriter(training_data_file, vocabulary) as writer:
+        writer.append(**training_data.columns)
+    return True
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+    for training_data_file in sys.argv[1:]:
+        if convert_training_data(training_data_file):
+            logger.info(f"Converted {training_data_file}")
+        else:
+            logger.info(f"{training_data_file} is already converted")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import queue
+import threading
+import logging
+import numpy as np
+
+# Put on the queue by the producer when an epoch is done (or failed)
+_END = object()
+
+
+class TrainingStream(object):
+    """
+    Training batches produced while training, instead of read from training data built beforehand: a background
+    thread runs the pipeline (read the cleaned files, encode, build the windows or pairs, batch) and keeps up to
+    prefetch batches ahead of the training loop in a bounded queue. The thread encodes the lines through the
+    training data builder, by its encoder processes when it has more than one worker: they are started on the first
+    shard and kept for every shard of every epoch, until the stream is closed.
+
+    The samples come in shards (e.g. the cleaned files): shard_samples(shard, epoch) yields the (X, y) chunks of a
+    shard. Every epoch the shards are read in another (seeded) order and the samples of every chunk are shuffled,
+    so that training never sees the corpus in file order without ever holding more than a chunk in memory.
+    """
+
+    def __init__(self, shards, shard_samples, batch_size, prefetch=64, seed=0, on_close=None):
+        self.logger = logging.getLogger(__name__)
+        self.shards = list(shards)
+        self.shard_samples = shard_samples
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        self.seed = seed
+        # Called once on close, e.g. to release what the shards are read from
+        self.on_close = on_close
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _produce(self, epoch, batches, stop):
+        def put(item):
+            # Gives up when the consumer has stopped taking batches
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        random = np.random.default_rng([self.seed, epoch])
+        try:
+            pending_X = []
+            pending_y = []
+            pending = 0
+            for shard in random.permutation(len(self.shards)):
+                for X, y in self.shard_samples(self.shards[shard], epoch):
+                    shuffled = random.permutation(len(y))
+                    pending_X.append(np.asarray(X)[shuffled])
+                    pending_y.append(np.asarray(y)[shuffled])
+                    pending += len(y)
+                    if pending < self.batch_size:
+                        continue
+                    X = np.concatenate(pending_X)
+                    y = np.concatenate(pending_y)
+                    full = pending - pending % self.batch_size
+                    for start in range(0, full, self.batch_size):
+                        if not put((X[start:start + self.batch_size], y[start:start + self.batch_size])):
+                            return
+                    pending_X = [X[full:]]
+                    pending_y = [y[full:]]
+                    pending -= full
+            if pending:
+                put((np.concatenate(pending_X), np.concatenate(pending_y)))
+        except BaseException as e:
+            put((_END, e))
+            return
+        put((_END, None))
+
+    def epoch(self, epoch):
+        """
+        Yields the (X, y) batches of an epoch, all of batch_size samples but the last one.
+        """
+        batches = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        producer = threading.Thread(
+            target=self._produce, args=(epoch, batches, stop), name=f"training-stream-{epoch}", daemon=True
+        )
+        producer.start()
+        try:
+            while True:
+                X, y = batches.get()
+                if X is _END:
+                    if y is not None:
+                        raise y
+                    return
+                yield X, y
+        finally:
+            stop.set()
+            producer.join()
+
+    def close(self):
+        if self.on_close is not None:
+            self.on_close()
+            self.on_close = None
@@ -0,0 +1,234 @@
+import hashlib
+import json
+import mmap
+import os
+import pickle
+from collections import OrderedDict
+from itertools import repeat
+import numpy as np
+
+OOV_TOKEN = "UNK"
+# Same as the Keras Tokenizer defaults, so that words are split and looked up exactly the way they used to be
+FILTERS = '!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n'
+_FILTER_TABLE = str.maketrans({char: " " for char in FILTERS})
+
+_MAGIC = b"W2VVOCAB"
+_ALIGNMENT = 64
+
+
+def text_to_words(text):
+    # Keras' text_to_word_sequence: lower case, filter characters replaced by spaces, split on spaces
+    if isinstance(text, list):
+        # A list is taken as already split into words, like Tokenizer.texts_to_sequences does
+        return [word.lower() for word in text]
+    return [word for word in text.lower().translate(_FILTER_TABLE).split(" ") if word]
+
+
+class VocabularyBuilder(object):
+    """
+    Counts words while streaming through texts, only the counts are kept in memory. Words are remembered in the
+    order they were first seen, which decides the order (and so the id) of words with the same count.
+    """
+
+    def __init__(self):
+        self.word_counts = {}
+        self.word_docs = {}
+        self.document_count = 0
+
+    def update(self, texts):
+        word_counts = self.word_counts
+        word_docs = self.word_docs
+        for text in texts:
+            self.document_count += 1
+            words = text_to_words(text)
+            for word in words:
+                word_counts[word] = word_counts.get(word, 0) + 1
+            for word in set(words):
+                word_docs[word] = word_docs.get(word, 0) + 1
+        return self
+
+    def merge(self, other):
+        # Merging builders in order gives the same result as counting their texts in that order
+        for word, count in other.word_counts.items():
+            self.word_counts[word] = self.word_counts.get(word, 0) + count
+        for word, count in other.word_docs.items():
+            self.word_docs[word] = self.word_docs.get(word, 0) + count
+        self.document_count += other.document_count
+        return self
+
+    def build(self, min_count=1, max_size=None):
+        """
+        Word ids are assigned by descending count: 0 is reserved for padding, 1 for the out-of-vocabulary token.
+        Words seen less than min_count times and all but the max_size most frequent words are left out and
+        become out-of-vocabulary.
+        """
+        words = [word for word, count in self.word_counts.items() if count >= min_count]
+        # sorted() is stable, so words with the same count keep the order they were first seen in
+        words = sorted(words, key=lambda word: self.word_counts[word], reverse=True)
+        if max_size is not None:
+            words = words[:max_size]
+        words_by_id = ["", OOV_TOKEN] + words
+        counts = np.array([0, 0] + [self.word_counts[word] for word in words], dtype=np.int64)
+        docs = np.array([0, 0] + [self.word_docs.get(word, 0) for word in words], dtype=np.int64)
+        return Vocabulary.from_words(words_by_id, counts, docs, self.document_count)
+
+
+class Vocabulary(object):
+    """
+    Word <-> id mapping with word counts, replacing the pickled Keras Tokenizer. It's stored in a single file as a
+    table of the utf-8 encoded words in id order (i.e. sorted by descending count) next to the count arrays. The
+    file is memory mapped when loaded, the word lookup index is only built from the table when words are encoded.
+    """
+
+    def __init__(self, words_table, counts, docs, document_count=0):
+        # "\n" separated words of id 1 (the out-of-vocabulary token) and up
+        self.words_table = words_table
+        # Counts and number of documents (lines) containing the word, indexed by word id
+        self.counts = counts
+        self.docs = docs
+        self.document_count = document_count
+        self.oov_id = 1
+        self._words_by_id = None
+        self._word_index = None
+        self._encode_index = None
+
+    @staticmethod
+    def from_words(words_by_id, counts, docs=None, document_count=0):
+        # words_by_id[0] is the padding entry and not part of the table
+        words_table = "\n".join(words_by_id[1:]).encode("utf-8")
+        docs = docs if docs is not None else np.zeros_like(counts)
+        return Vocabulary(words_table, counts, docs, document_count)
+
+    def __len__(self):
+        # Number of words including the out-of-vocabulary token, i.e. len(word_index) of a Keras Tokenizer
+        return len(self.counts) - 1
+
+    def vocabulary_size(self):
+        # Number of ids including the padding id 0, i.e. the input dimension of an embedding layer
+        return len(self.counts)
+
+    def words_by_id(self):
+        if self._words_by_id is None:
+            self._words_by_id = [""] + bytes(self.words_table).decode("utf-8").split("\n")
+        return self._words_by_id
+
+    @property
+    def word_index(self):
+        if self._word_index is None:
+            words_by_id = self.words_by_id()
+            self._word_index = dict(zip(words_by_id[1:], range(1, len(words_by_id))))
+        return self._word_index
+
+    @property
+    def index_word(self):
+        return dict(enumerate(self.words_by_id()[1:], start=1))
+
+    def max_word_count(self):
+        return int(self.counts.max()) if len(self.counts) else 0
+
+    def fingerprint(self):
+        # Changes whenever any word gets another id
+        return hashlib.sha256(bytes(self.words_table)).hexdigest()
+
+    def lookup(self, words):
+        # Ids of a list of words as an int32 array, unknown words get the out-of-vocabulary id
+        word_index = self.word_index
+        return np.fromiter(map(word_index.get, words, repeat(self.oov_id)), dtype=np.int32, count=len(words))
+
+    def encode(self, texts):
+        """
+        Encodes many texts at once: returns the ids of all words of all texts as one flat int32 array, plus the
+        offsets of the texts into it (the ids of text i are ids[offsets[i]:offsets[i + 1]]).
+        """
+        if self._encode_index is None:
+            # Splitting on " " leaves empty strings wherever there were several spaces, they get id -1 and are
+            # dropped below instead of being filtered one text at a time
+            self._encode_index = dict(self.word_index)
+            self._encode_index[""] = -1
+        words = []
+        ends = [0]
+        for text in texts:
+            if isinstance(text, list):
+                # Already split into words: only lower cased, and an empty word is out-of-vocabulary
+                words.extend(word.lower() or OOV_TOKEN for word in text)
+            else:
+                words.extend(text.lower().translate(_FILTER_TABLE).split(" "))
+            ends.append(len(words))
+        ids = np.fromiter(
+            map(self._encode_index.get, words, repeat(self.oov_id)), dtype=np.int32, count=len(words)
+        )
+        kept = ids >= 0
+        offsets = np.concatenate(([0], np.cumsum(kept, dtype=np.int64)))[ends]
+        return ids[kept], offsets
+
+    def texts_to_sequences(self, texts):
+        ids, offsets = self.encode(texts)
+        ids = ids.tolist()
+        return [ids[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def save(self, vocabulary_file):
+        arrays = {
+            "words": np.frombuffer(bytes(self.words_table), dtype=np.uint8),
+            "counts": np.asarray(self.counts, dtype=np.int64),
+            "docs": np.asarray(self.docs, dtype=np.int64),
+        }
+        header = {"document_count": self.document_count, "oov_token": OOV_TOKEN, "arrays": {}}
+        offset = 0
+        for name, array in arrays.items():
+            header["arrays"][name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+            offset += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+        header_bytes = json.dumps(header).encode("utf-8")
+        data_start = -(-(len(_MAGIC) + 8 + len(header_bytes)) // _ALIGNMENT) * _ALIGNMENT
+        with open(vocabulary_file + ".tmp", "wb") as f:
+            f.write(_MAGIC)
+            f.write(np.array([data_start, len(header_bytes)], dtype="<u4").tobytes())
+            f.write(header_bytes)
+            for name, array in arrays.items():
+                f.seek(data_start + header["arrays"][name]["offset"])
+                f.write(array.tobytes())
+            f.truncate(data_start + offset)
+        os.replace(vocabulary_file + ".tmp", vocabulary_file)
+
+    @staticmethod
+    def load(vocabulary_file):
+        # The arrays are views into a read-only memory map: loading takes no time and the pages are shared
+        # between all processes using the same vocabulary
+        with open(vocabulary_file, "rb") as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f"{vocabulary_file} is not a vocabulary file")
+            data_start, header_length = (int(value) for value in np.frombuffer(f.read(8), dtype="<u4"))
+            header = json.loads(f.read(header_length).decode("utf-8"))
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        arrays = {}
+        for name, array in header["arrays"].items():
+            arrays[name] = np.frombuffer(
+                buffer, dtype=np.dtype(array["dtype"]), count=int(np.prod(array["shape"])),
+                offset=data_start + array["offset"]
+            )
+        return Vocabulary(arrays["words"], arrays["counts"], arrays["docs"], header["document_count"])
+
+    def to_keras_tokenizer(self):
+        # Keras is only needed for this export, e.g. for the KerasTokenizer of the chat bot
+        from keras.preprocessing.text import Tokenizer
+
+        tokenizer = Tokenizer(oov_token=OOV_TOKEN)
+        words_by_id = self.words_by_id()
+        tokenizer.word_counts = OrderedDict(
+            (words_by_id[word_id], int(self.counts[word_id])) for word_id in range(2, len(words_by_id))
+        )
+        tokenizer.word_docs.update(
+            (words_by_id[word_id], int(self.docs[word_id])) for word_id in range(2, len(words_by_id))
+        )
+        tokenizer.document_count = self.document_count
+        # Fitting on nothing builds word_index, index_word and index_docs from the counts; words with the same
+        # count keep their order, which is id order here
+        tokenizer.fit_on_texts([])
+        return tokenizer
+
+    def export_keras_tokenizer(self, tokenizer_file, tokenizer_json_file=None):
+        tokenizer = self.to_keras_tokenizer()
+        with open(tokenizer_file, "wb") as f:
+            pickle.dump(tokenizer, f)
+        if tokenizer_json_file:
+            with open(tokenizer_json_file, "w", encoding="utf-8") as f:
+                f.write(tokenizer.to_json())
@@ -1,47 +1,213 @@
-from .preprocessing.training_data.training_data_builder import load_tokenizer
+import io
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool, cpu_count
 from os import path
 import numpy as np
 import logging
 import yaml
-import pickle
-# from sklearn.metrics.pairwise import euclidean_distances
-# from sklearn.manifold import TSNE
-# import matplotlib.pyplot as plt
+from .preprocessing.manifest import StageManifest, MANIFEST_DIR
+from .preprocessing.training_data.vocabulary import Vocabulary, OOV_TOKEN
+
+# Bytes of the text file a worker parses at a time
+CHUNK_BYTES = 32 * 1024 * 1024
+# Most frequent out-of-vocabulary corpus words listed in the alignment report
+REPORTED_OOV_WORDS = 100
+
+
+def _chunks(glove_file, chunk_bytes):
+    # (start, end, lines) of chunks of about chunk_bytes, ending at a line end
+    size = path.getsize(glove_file)
+    chunks = []
+    with open(glove_file, "rb") as glove:
+        start = 0
+        while start < size:
+            glove.seek(min(start + chunk_bytes, size))
+            glove.readline()
+            end = min(glove.tell(), size)
+            glove.seek(start)
+            data = glove.read(end - start)
+            chunks.append((start, end, data.count(b"\n") + (not data.endswith(b"\n"))))
+            start = end
+    return chunks
+
+
+def _vector_size(glove_file):
+    with open(glove_file, "rb") as glove:
+        return len(glove.readline().split()) - 1
+
+
+def _parse_chunk(glove_file, vectors_file, start, end, row):
+    # Parses the lines between start and end straight into the rows from row of the memory mapped vectors file, and
+    # returns their words
+    with open(glove_file, "rb") as glove:
+        glove.seek(start)
+        lines = glove.read(end - start).splitlines()
+    words = []
+    values = []
+    for line in lines:
+        word, _, vector = line.rstrip().partition(b" ")
+        words.append(word.decode("utf-8"))
+        values.append(vector)
+    vectors = np.load(vectors_file, mmap_mode="r+")
+    vectors[row:row + len(lines)] = np.loadtxt(
+        io.BytesIO(b"\n".join(values)), dtype=np.float32, delimiter=" ", comments=None, ndmin=2
+    )
+    vectors.flush()
+    return words
+
+
+def _parse_chunk_args(args):
+    return _parse_chunk(*args)
+
+
+def convert_glove(glove_file, vectors_file, vocabulary_file, workers=1, chunk_bytes=CHUNK_BYTES):
+    """
+    Converts GloVe vectors from text ("word value value ..." lines) to a float32 .npy of (vocabulary size, vector
+    size) and a Vocabulary of the words, in file order (the GloVe files are sorted by frequency). The row of a word
+    is its id: row 0 (padding) and row 1 (out-of-vocabulary) are zeros. The text is parsed in chunks, by workers
+    processes with workers > 1, straight into the preallocated .npy, the rows of a chunk being known from a first
+    pass counting lines. Returns the vocabulary.
+    """
+    workers = workers or cpu_count()
+    chunks = _chunks(glove_file, chunk_bytes)
+    rows = np.concatenate(([2], 2 + np.cumsum([lines for _, _, lines in chunks])))
+    vectors = np.lib.format.open_memmap(
+        vectors_file + ".tmp", mode="w+", dtype=np.float32, shape=(int(rows[-1]), _vector_size(glove_file))
+    )
+    vectors[:2] = 0
+    del vectors
+    tasks = [(glove_file, vectors_file + ".tmp", start, end, row) for (start, end, _), row in zip(chunks, rows)]
+    if workers > 1 and len(tasks) > 1:
+        with Pool(processes=min(workers, len(tasks))) as pool:
+            chunk_words = pool.map(_parse_chunk_args, tasks)
+    else:
+        chunk_words = [_parse_chunk(*task) for task in tasks]
+    words_by_id = ["", OOV_TOKEN] + [word for words in chunk_words for word in words]
+    vocabulary = Vocabulary.from_words(words_by_id, np.zeros(len(words_by_id), dtype=np.int64))
+    vocabulary.save(vocabulary_file)
+    os.replace(vectors_file + ".tmp", vectors_file)
+    return vocabulary
+
+
+def load_glove(vectors_file, vocabulary_file):
+    # The vectors (read-only memory mapped, so loading takes no time and the pages are shared between processes) and
+    # the vocabulary of convert_glove
+    return np.load(vectors_file, mmap_mode="r"), Vocabulary.load(vocabulary_file)
+
+
+def align_vectors(vectors, pretrained_vocabulary, corpus_vocabulary, tail=0, min_count=1):
+    """
+    Prunes pretrained vectors to the words a model can actually see: the words of the corpus vocabulary seen at least
+    min_count times that have a pretrained vector, in corpus order (by descending count), then the tail most frequent
+    pretrained words not in the corpus vocabulary, for words of e.g. chat messages that aren't in the corpus.
+    Returns the vectors with a row per id of the new vocabulary (padding and out-of-vocabulary rows are zeros), the
+    new vocabulary (with the corpus counts), and a report of the corpus words without a pretrained vector.
+    """
+    corpus_words = corpus_vocabulary.words_by_id()[2:]
+    counts = np.asarray(corpus_vocabulary.counts[2:])
+    pretrained_ids = pretrained_vocabulary.lookup(corpus_words)
+    found = pretrained_ids > pretrained_vocabulary.oov_id
+    kept = found & (counts >= min_count)
+    # The tail words, in pretrained order, which is by frequency
+    tail_ids = np.setdiff1d(np.arange(2, pretrained_vocabulary.vocabulary_size()), pretrained_ids[found])[:tail]
+    ids = np.concatenate(([0, 1], pretrained_ids[kept], tail_ids))
+    pretrained_words = pretrained_vocabulary.words_by_id()
+    words_by_id = ["", OOV_TOKEN] + [corpus_words[i] for i in np.flatnonzero(kept)]
+    words_by_id += [pretrained_words[i] for i in tail_ids]
+    aligned_counts = np.concatenate(([0, 0], counts[kept], np.zeros(len(tail_ids), dtype=np.int64)))
+    aligned_vectors = np.asarray(vectors[ids], dtype=np.float32)
+    aligned_vectors[:2] = 0
+    missing = np.flatnonzero(~found)
+    most_frequent = missing[np.argsort(-counts[missing], kind="stable")][:REPORTED_OOV_WORDS]
+    report = {
+        "corpus_words": len(corpus_words),
+        "pretrained_words": pretrained_vocabulary.vocabulary_size() - 2,
+        "aligned_words": len(words_by_id) - 2,
+        "tail_words": len(tail_ids),
+        "oov_words": len(missing),
+        "oov_word_rate": len(missing) / max(1, len(corpus_words)),
+        "oov_tokens": int(counts[missing].sum()),
+        "oov_token_rate": float(counts[missing].sum() / max(1, counts.sum())),
+        "most_frequent_oov": [[corpus_words[i], int(counts[i])] for i in most_frequent],
+    }
+    return aligned_vectors, Vocabulary.from_words(words_by_id, aligned_counts), report
+
+
+def corpus_vectors(vectors, pretrained_vocabulary, corpus_vocabulary):
+    # The pretrained vectors with a row per id of the corpus vocabulary, for the models trained on data encoded with
+    # it (PV-DM): corpus words without a pretrained vector, padding and out-of-vocabulary get zeros
+    pretrained_ids = pretrained_vocabulary.lookup(corpus_vocabulary.words_by_id()[2:])
+    aligned_vectors = np.zeros((corpus_vocabulary.vocabulary_size(), vectors.shape[1]), dtype=np.float32)
+    found = np.flatnonzero(pretrained_ids > pretrained_vocabulary.oov_id)
+    aligned_vectors[2 + found] = vectors[pretrained_ids[found]]
+    return aligned_vectors
 
 
 class PretrainedGlove:
     logging.basicConfig(level=logging.INFO)
 
-    def __init__(self, pretrained_vectors_source, tokenizer_file):
+    def __init__(self, pretrained_vectors_source, workers=0):
         dir_name = path.dirname(__file__)
         self.logger = logging.getLogger(__name__)
         self.source_file = path.join(
             dir_name, "../..", pretrained_vectors_source
         )
         self.glove_tokenizer_file = path.join(dir_name, "../data/4_training_data/glove_dictionary.dat")
-        self.glove_pretrained_vector_file = path.join(dir_name, "../data/4_training_data/glove_vectors")
-        tokenizer_file = path.join(dir_name, "..", tokenizer_file)
-        self.tokenizer = load_tokenizer(tokenizer_file)
+        self.glove_vocabulary_file = path.join(dir_name, "../data/4_training_data/glove_dictionary.vocab")
+        self.glove_pretrained_vector_file = path.join(dir_name, "../data/4_training_data/glove_vectors.npy")
+        self.workers = workers
 
     def load_pretrained_glove(self):
-        glove_model = []
-        word_index = {"UNK": 1}
-        index = 2
-        with open(self.source_file, "r") as glove_file:
-            for line in glove_file:
-                word, word_vec = line.split(maxsplit=1)
-                glove_model.append(np.fromstring(word_vec, dtype=np.float64, sep=" "))
-                word_index[word] = index
-                index += 1
-        self.logger.info(f"Parsed {len(glove_model)} pretrained word vectors")
-        self.tokenizer.word_index = word_index
-        self.tokenizer.index_word = {value: key for key, value in word_index.items()}
-        with open(self.glove_tokenizer_file, "wb") as f:
-            self.logger.info(f"Saving Glove tokenizer with {len(self.tokenizer.word_index)} tokens")
-            pickle.dump(self.tokenizer, f)
-        if not path.exists(self.glove_pretrained_vector_file):
-            self.logger.info(f"Saving parsed Glove vectors to: {self.glove_pretrained_vector_file}")
-            np.save(self.glove_pretrained_vector_file, glove_model)
+        start = time.perf_counter()
+        vocabulary = convert_glove(
+            self.source_file, self.glove_pretrained_vector_file, self.glove_vocabulary_file, self.workers
+        )
+        self.logger.info(
+            f"Converted {len(vocabulary) - 1} pretrained word vectors in {time.perf_counter() - start:.2f} seconds to "
+            f"{self.glove_pretrained_vector_file}"
+        )
+        # The pickled Keras Tokenizer is still exported for the chat bot's KerasTokenizer
+        self.logger.info(f"Saving Glove tokenizer with {len(vocabulary)} tokens")
+        vocabulary.export_keras_tokenizer(self.glove_tokenizer_file)
+
+    def align(self, corpus_vocabulary_file, aligned_vectors_file, aligned_vocabulary_file, report_file,
+              corpus_vectors_file, tail=0, min_count=1, manifest_dir=MANIFEST_DIR):
+        # Aligns the converted vectors to the corpus vocabulary, see align_vectors, and writes them with the ids of
+        # the corpus vocabulary as well, see corpus_vectors, unless nothing changed since
+        manifest = StageManifest("pretrained_glove", manifest_dir)
+        inputs = [self.glove_pretrained_vector_file, self.glove_vocabulary_file, corpus_vocabulary_file]
+        outputs = [aligned_vectors_file, aligned_vocabulary_file, report_file, corpus_vectors_file]
+        config = {"tail": tail, "min_count": min_count}
+        if manifest.is_up_to_date("aligned", inputs, outputs, config):
+            self.logger.info(f"Aligned vectors are up to date: {aligned_vectors_file}")
+            return
+        vectors, vocabulary = load_glove(self.glove_pretrained_vector_file, self.glove_vocabulary_file)
+        corpus_vocabulary = Vocabulary.load(corpus_vocabulary_file)
+        aligned_vectors, aligned_vocabulary, report = align_vectors(
+            vectors, vocabulary, corpus_vocabulary, tail, min_count
+        )
+        for vectors_file, vectors_by_id in (
+            (aligned_vectors_file, aligned_vectors),
+            (corpus_vectors_file, corpus_vectors(vectors, vocabulary, corpus_vocabulary)),
+        ):
+            with open(vectors_file + ".tmp", "wb") as f:
+                np.save(f, vectors_by_id)
+            os.replace(vectors_file + ".tmp", vectors_file)
+        aligned_vocabulary.save(aligned_vocabulary_file)
+        with open(report_file + ".tmp", "w") as f:
+            json.dump(report, f, indent=1)
+        os.replace(report_file + ".tmp", report_file)
+        self.logger.info(
+            f"Aligned {report['aligned_words']} of {report['pretrained_words']} pretrained words "
+            f"({report['tail_words']} of them tail words) to {report['corpus_words']} corpus words: "
+            f"{report['oov_word_rate']:.2%} of the corpus words and {report['oov_token_rate']:.2%} of the tokens have "
+            f"no pretrained vector, see {report_file}"
+        )
+        manifest.record("aligned", inputs, outputs, config)
+        manifest.save()
 
 
 def main():
@@ -51,9 +217,20 @@ def main():
     with open(config_file) as config:
         config_dict = yaml.load(config, Loader=yaml.Loader)
     pretrained_glove_file = config_dict["pretrained_embeddings"]
-    tokenizer_file = config_dict["dictionary"]
-    pretrained_glove = PretrainedGlove(pretrained_glove_file, tokenizer_file)
-    pretrained_glove.load_pretrained_glove()
+    pretrained_glove = PretrainedGlove(pretrained_glove_file, config_dict["pretrained_workers"])
+    # convert (the default), or align the converted vectors to the corpus vocabulary
+    if len(sys.argv) > 1 and sys.argv[1] == "align":
+        pretrained_glove.align(
+            path.join(dir_name, "..", config_dict["vocabulary"]),
+            path.join(dir_name, "..", config_dict["word_vectors"]),
+            path.join(dir_name, "..", config_dict["pretrained_dictionary"]),
+            path.join(dir_name, "../data/4_training_data/glove_alignment.json"),
+            path.join(dir_name, "..", config_dict["corpus_word_vectors"]),
+            config_dict["pretrained_tail_words"],
+            config_dict["pretrained_min_count"],
+        )
+    else:
+        pretrained_glove.load_pretrained_glove()
 
 
 if __name__ == "__main__":
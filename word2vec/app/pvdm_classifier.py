@@ -1,4 +1,8 @@
 from .preprocessing.training_data.training_data_builder import load_training_data
+from .preprocessing.training_data.vocabulary import Vocabulary
+from .sampled_output import SampledOutput, sampled_loss
+from .input_pipeline import array_dataset, epoch_callback, fit, held_out_split, scaled_learning_rate
+from .checkpoint import training_settings
 import numpy as np
 from keras import Input, Model
 from keras.backend import mean
@@ -6,7 +10,8 @@ from keras.layers import Lambda
 from keras.layers.core import Dense
 from keras.layers.merging import Concatenate
 from keras.layers.core.embedding import Embedding
-from keras.utils import np_utils
+from keras.optimizers import RMSprop
+import tensorflow as tf
 from os import path
 from codetiming import Timer
 import yaml
@@ -14,20 +19,31 @@ import logging
 
 
 def batch(a_list, b_list, batch_size):
+    # Lists of samples as well as arrays
+    a_list = np.asarray(a_list)
+    b_list = np.asarray(b_list)
     for i in range(0, min(len(a_list), len(b_list)), batch_size):
-        paragraph_ids = [i[0] for i in a_list[i: i + batch_size]]
-        context_word_ids = [i[1:] for i in a_list[i: i + batch_size]]
+        # The first column of a sample is the paragraph id, the others are the context word ids
+        paragraph_ids = a_list[i: i + batch_size, 0]
+        context_word_ids = a_list[i: i + batch_size, 1:]
         yield paragraph_ids, context_word_ids, b_list[i: i + batch_size]
 
 
 class BlogClassifier(object):
     logging.basicConfig(level=logging.INFO)
 
-    def __init__(self, vector_size, vocabulary_size, window_size, word_vectors, num_paragraphs):
+    def __init__(self, vector_size, vocabulary_size, window_size, word_vectors, num_paragraphs, output_head="softmax",
+                 num_sampled=64, word_counts=None, learning_rate=0.001):
         dir_name = path.dirname(__file__)
         self.input_size = window_size * 2
         self.vocab_size = vocabulary_size
-        self.model_file = path.join(dir_name, "../data/5_models/pv-dm.h5")
+        # "softmax", or "sampled_softmax"/"negative_sampling" (see SampledOutput), which have weights of their own.
+        # The sampled heads sample by word_counts (the counts of the corpus vocabulary) when given, log-uniform if not
+        self.output_head = output_head
+        model_name = "pv-dm" if output_head == "softmax" else f"pv-dm_{output_head}"
+        self.model_file = path.join(dir_name, f"../data/5_models/{model_name}.h5")
+        self.inference_file = path.join(dir_name, f"../data/5_models/{model_name}_inference.npz")
+        self.word_vectors = word_vectors
         self.logger = logging.getLogger(__name__)
 
         # Build the PV-DM model:
@@ -49,45 +65,69 @@ class BlogClassifier(object):
         )(context_words_input)
         all_embeddings = Concatenate(axis=1)([paragraph_embedding, context_words_embedding])
         avg = Lambda(lambda x: mean(x, axis=1))(all_embeddings)
-        output = Dense(vocabulary_size, activation="softmax")(avg)
-        self.model = Model(inputs=[paragraph_id_input, context_words_input], outputs=output)
-        # Loss function: categorical cross entropy as we select across many different choices
-        self.model.compile(loss="categorical_crossentropy")
+        if output_head == "softmax":
+            output = Dense(vocabulary_size, activation="softmax")(avg)
+            self.model = Model(inputs=[paragraph_id_input, context_words_input], outputs=output)
+            # Loss function: categorical cross entropy as we select across many different choices, on the integer
+            # focus word ids rather than batch size x vocabulary size one-hot targets
+            self.model.compile(loss="sparse_categorical_crossentropy", optimizer=RMSprop(learning_rate=learning_rate))
+        else:
+            # The focus word id is an input of the sampled output layer, which outputs the loss itself
+            focus_word_input = Input((1,), dtype='int32')
+            output = SampledOutput(vocabulary_size, num_sampled, output_head, word_counts)([avg, focus_word_input])
+            self.model = Model(inputs=[paragraph_id_input, context_words_input, focus_word_input], outputs=output)
+            self.model.compile(loss=sampled_loss, optimizer=RMSprop(learning_rate=learning_rate))
         self.model.summary(print_fn=self.logger.info)
         if path.exists(self.model_file):
             self.weights = self.model.load_weights(self.model_file)
 
-    def train_model(self, training_data, epochs):
-        all_X = training_data["X"]
-        all_y = training_data["y"]
-        batch_size = min(100, len(all_y))
+    def train_model(self, training_data, epochs, batch_size=100, checkpoints=None, early_stopping=None,
+                    held_out_fraction=0.0):
+        # The held out rows at the end aren't trained on, see fit for the checkpoints and the early stopping
+        columns, held_out = held_out_split(
+            {"X": training_data["X"], "y": training_data["y"]}, int(len(training_data["y"]) * held_out_fraction)
+        )
+        validation = array_dataset(held_out, batch_size, self._to_model) if held_out else None
         timer = Timer(
             name="PV-DM training timer",
             text="Epoch training time: {minutes:.2f} minutes",
             logger=self.logger.info,
         )
-        for epoch in range(epochs):
-            loss = 0.0
-            timer.start()
-            for paragraph_ids, context_word_ids, focus_word_ids in batch(all_X, all_y, batch_size):
-                if len(context_word_ids[0]) != self.input_size or len(context_word_ids) != len(focus_word_ids):
-                    logging.error(f"Error! shape paragraph_ids: {np.shape(paragraph_ids)} " +
-                                  f"shape context_word_ids: {np.shape(context_word_ids)} " +
-                                  f"shape focus_word_ids: {np.shape(focus_word_ids)}")
-                    break
-                loss += self.model.train_on_batch(
-                    x=[np.array(list(paragraph_ids)), np.array(list(context_word_ids))],
-                    y=np.array(
-                        list(
-                            np_utils.to_categorical(focus_word_id, self.vocab_size)
-                            for focus_word_id in focus_word_ids
-                        )
-                    ))
-            timer.stop()
-            self.logger.info("Epoch #{}, loss: {}".format(epoch + 1, loss))
-            paragraph_vectors_file = path.join(path.dirname(__file__), f"../data/5_models/paragraph_embeddings_{epoch}")
-            np.save(paragraph_vectors_file, self.model.layers[2].get_weights())
+        callback = epoch_callback(lambda epoch: timer.start(), lambda epoch: self._end_epoch(epoch, timer))
+        fit(
+            self.model, lambda epoch: array_dataset(columns, batch_size, self._to_model, seed=epoch), epochs,
+            [callback], checkpoints, early_stopping, validation,
+        )
         self.model.save_weights(self.model_file)
+        self.save_inference_weights()
+
+    def save_inference_weights(self):
+        # What BlogFinder needs to infer the vectors of messages without Keras: the paragraph vectors, the (frozen)
+        # word vectors and the softmax weights as (vector size, vocabulary size) plus biases
+        output_weights, output_biases = self.model.layers[-1].get_weights()
+        if self.output_head != "softmax":
+            # SampledOutput keeps a row per word
+            output_weights = output_weights.T
+        np.savez(
+            self.inference_file,
+            paragraph_vectors=self.model.layers[2].get_weights()[0],
+            word_vectors=self.word_vectors,
+            output_weights=output_weights,
+            output_biases=output_biases,
+        )
+
+    def _to_model(self, batch):
+        # The first column of a sample is the paragraph id, the others are the context word ids
+        paragraph_ids = batch["X"][:, 0]
+        context_word_ids = batch["X"][:, 1:]
+        if self.output_head == "softmax":
+            return (paragraph_ids, context_word_ids), batch["y"]
+        return (paragraph_ids, context_word_ids, batch["y"]), tf.zeros(tf.shape(batch["y"]), dtype=tf.float32)
+
+    def _end_epoch(self, epoch, timer):
+        timer.stop()
+        paragraph_vectors_file = path.join(path.dirname(__file__), f"../data/5_models/paragraph_embeddings_{epoch}")
+        np.save(paragraph_vectors_file, self.model.layers[2].get_weights())
 
 
 def main():
@@ -101,13 +141,24 @@ def main():
         config_dict = yaml.load(config, Loader=yaml.Loader)
     window_size = config_dict["window_size"]
     vector_size = config_dict["vector_size"]
-    word_vectors_file = config_dict["word_vectors"]
+    # Rows by corpus vocabulary id, like the word ids of the training data
+    word_vectors_file = config_dict["corpus_word_vectors"]
     epochs = config_dict["epochs"]
+    batch_size = config_dict["batch_size"]
     word_vectors = np.array(np.load(path.join(dir_name, "../", word_vectors_file), allow_pickle=True))
+    vocabulary = Vocabulary.load(path.join(dir_name, "..", config_dict["vocabulary"]))
+    word_counts = vocabulary.counts if config_dict["sampled_unigrams"] else None
     X_y = load_training_data(training_data_file)
     blog_classifier = BlogClassifier(vector_size=vector_size, vocabulary_size=len(word_vectors),
-                                     window_size=window_size, word_vectors=word_vectors, num_paragraphs=5186)
-    blog_classifier.train_model(X_y, epochs)
+                                     window_size=window_size, word_vectors=word_vectors, num_paragraphs=5186,
+                                     output_head=config_dict["pvdm_output_head"],
+                                     num_sampled=config_dict["sampled_words"], word_counts=word_counts,
+                                     learning_rate=scaled_learning_rate(config_dict["learning_rate"], batch_size,
+                                                                        config_dict["learning_rate_scaling"]))
+    checkpoints, early_stopping, _ = training_settings(config_dict, f"pv-dm_{config_dict['pvdm_output_head']}")
+    blog_classifier.train_model(
+        X_y, epochs, batch_size, checkpoints, early_stopping, config_dict["held_out_fraction"]
+    )
 
 
 if __name__ == "__main__":
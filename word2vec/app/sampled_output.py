@@ -0,0 +1,87 @@
+import tensorflow as tf
+from keras.layers import Layer
+
+# Output heads of the models predicting a word out of the whole vocabulary: the full softmax (a Dense layer trained
+# on one-hot targets), or a SampledOutput layer trained on integer targets
+OUTPUT_HEADS = ("softmax", "sampled_softmax", "negative_sampling")
+
+
+def sampled_loss(y_true, y_pred):
+    # A model ending in a SampledOutput layer outputs the loss of every sample, y_true is ignored
+    return y_pred
+
+
+class SampledOutput(Layer):
+    """
+    Softmax output over the whole vocabulary that, while training, only computes the logits of the target word and
+    of num_sampled sampled words instead of all of them: sampled softmax (tf.nn.sampled_softmax_loss) or negative
+    sampling (tf.nn.nce_loss). It takes the hidden layer and the integer target word ids as inputs, so no one-hot
+    targets are ever built, and outputs the loss of every sample (to be compiled with sampled_loss). When not
+    training, e.g. in evaluate, the loss is the exact cross entropy of the target word over the whole vocabulary, so
+    that the held out loss of the early stopping is comparable between epochs.
+
+    Words are sampled from a log-uniform (Zipfian) distribution, which fits word ids assigned by descending count;
+    with word_counts they're sampled from the unigram distribution raised to the power 0.75, as in word2vec.
+    """
+
+    def __init__(self, vocabulary_size, num_sampled=64, loss="sampled_softmax", word_counts=None, **kwargs):
+        super().__init__(**kwargs)
+        if loss not in OUTPUT_HEADS[1:]:
+            raise ValueError(f"Unknown sampled loss {loss}, expected one of {OUTPUT_HEADS[1:]}")
+        self.vocabulary_size = vocabulary_size
+        self.num_sampled = num_sampled
+        self.loss = loss
+        self.word_counts = None if word_counts is None else [float(count) for count in word_counts]
+
+    def build(self, input_shape):
+        hidden_shape, _ = input_shape
+        # Same layout as the weights of tf.nn.sampled_softmax_loss: one row per word
+        self.kernel = self.add_weight(
+            name="kernel", shape=(self.vocabulary_size, hidden_shape[-1]), initializer="glorot_uniform"
+        )
+        self.bias = self.add_weight(name="bias", shape=(self.vocabulary_size,), initializer="zeros")
+        super().build(input_shape)
+
+    def _sampled_values(self, labels):
+        if self.word_counts is None:
+            return None
+        return tf.random.fixed_unigram_candidate_sampler(
+            true_classes=labels,
+            num_true=1,
+            num_sampled=self.num_sampled,
+            unique=True,
+            range_max=self.vocabulary_size,
+            distortion=0.75,
+            unigrams=self.word_counts,
+        )
+
+    def call(self, inputs, training=None):
+        hidden, targets = inputs
+        if not training:
+            return tf.nn.sparse_softmax_cross_entropy_with_logits(
+                labels=tf.reshape(tf.cast(targets, tf.int64), (-1,)),
+                logits=tf.matmul(hidden, self.kernel, transpose_b=True) + self.bias,
+            )
+        labels = tf.reshape(tf.cast(targets, tf.int64), (-1, 1))
+        loss = tf.nn.sampled_softmax_loss if self.loss == "sampled_softmax" else tf.nn.nce_loss
+        return loss(
+            weights=self.kernel,
+            biases=self.bias,
+            labels=labels,
+            inputs=hidden,
+            num_sampled=self.num_sampled,
+            num_classes=self.vocabulary_size,
+            sampled_values=self._sampled_values(labels),
+        )
+
+    def get_config(self):
+        config = super().get_config()
+        config.update(
+            {
+                "vocabulary_size": self.vocabulary_size,
+                "num_sampled": self.num_sampled,
+                "loss": self.loss,
+                "word_counts": self.word_counts,
+            }
+        )
+        return config
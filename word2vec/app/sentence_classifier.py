@@ -1,88 +1,65 @@
 from .preprocessing.training_data.training_data_builder import load_training_data, load_tokenizer
+from .input_pipeline import array_dataset, epoch_callback, fit, held_out_split, scaled_learning_rate, sentence_dataset
+from .checkpoint import training_settings
+from .sentence_classifier_weights import load_layer_weights
 from os import path
 from keras import Input, Model
 from keras.layers import Conv1D, MaxPool1D
 from keras.layers.core import Dense, Flatten
 from keras.layers.core.embedding import Embedding
-from keras.layers.merge import Concatenate
+from keras.layers.merging import Concatenate
+from keras.optimizers import RMSprop
 from codetiming import Timer
 import numpy as np
+import tensorflow as tf
 import yaml
 import logging
 
 
-def batch(i_list, j_list, out_list, batch_size):
-    for i in range(0, min(len(i_list), len(j_list), len(out_list)), batch_size):
-        yield i_list[i: i + batch_size], j_list[i: i + batch_size], out_list[i: i + batch_size]
-
-
 class SentenceClassifier(object):
     logging.basicConfig(level=logging.INFO)
 
-    def __init__(self, vector_size, vocabulary_size, word_vectors, num_classes):
+    def __init__(self, vector_size, vocabulary_size, word_vectors, num_classes, learning_rate=0.001):
         dir_name = path.dirname(__file__)
         self.logger = logging.getLogger(__name__)
         self.model_file = path.join(dir_name, "../data/5_models/sentiment_classifier.h5")
         self.vocabulary_size = vocabulary_size
+        self.num_classes = num_classes
         self.logger = logging.getLogger(__name__)
 
         bigram_input = Input((2,), dtype='int32')
         trigram_input = Input((3,), dtype='int32')
         self.logger.info(f"Vocabulary size: {vocabulary_size} vector size: {vector_size}")
 
-        trainable_bigram_embedding = Embedding(
-            input_dim=vocabulary_size,
-            output_dim=vector_size,
-            weights=[word_vectors],
-            input_length=2
-        )(bigram_input)
-
-        untrainable_bigram_embedding = Embedding(
-            input_dim=vocabulary_size,
-            output_dim=vector_size,
-            weights=[word_vectors],
-            input_length=2,
-            trainable=False
-        )(bigram_input)
-
-        combined_bigram = Concatenate(axis=1)([trainable_bigram_embedding, untrainable_bigram_embedding])
-        self.logger.info(f"Shape of combined bigram: {combined_bigram.shape}")
-        # combined_bigram_flat = Flatten()(combined_bigram)
-        # self.logger.info(f"Shape of combined bigram, flat: {combined_bigram_flat.shape}")
-        # Reshape layer to concatenate word vectors to 1D
-        # trainable_bigram_flat = Flatten()(trainable_bigram_embedding)
-        # untrainable_bigram_flat = Flatten()(untrainable_bigram_embedding)
-
-        trainable_trigram_embedding = Embedding(
+        # One trainable and one frozen embedding table, shared by the bigram and the trigram branch: the vectors are
+        # held twice rather than four times, and RMSprop keeps slots for one table. The gradient of the trainable
+        # table stays sparse (the rows of the words of the batch) through the gathers and the concatenations, so
+        # only those rows are updated. The RMSprop of Keras 2.11 and later still decays its whole velocity slot every
+        # step, which is why a step takes longer the larger the vocabulary.
+        embedding = Embedding(
             input_dim=vocabulary_size,
             output_dim=vector_size,
             weights=[word_vectors],
-            input_length=3
-        )(trigram_input)
-
-        untrainable_trigram_embedding = Embedding(
+            name="word_embedding",
+        )
+        frozen_embedding = Embedding(
             input_dim=vocabulary_size,
             output_dim=vector_size,
             weights=[word_vectors],
-            input_length=3,
             trainable=False,
-        )(trigram_input)
-
-        # Reshape layer to concatenate word vectors to 1D
-        # trainable_trigram_flat = Flatten()(trainable_trigram_embedding)
-        # untrainable_trigram_flat = Flatten()(untrainable_trigram_embedding)
+            name="frozen_word_embedding",
+        )
 
-        combined_trigram = Concatenate(axis=1)([trainable_trigram_embedding, untrainable_trigram_embedding])
+        combined_bigram = Concatenate(axis=1)([embedding(bigram_input), frozen_embedding(bigram_input)])
+        self.logger.info(f"Shape of combined bigram: {combined_bigram.shape}")
+        combined_trigram = Concatenate(axis=1)([embedding(trigram_input), frozen_embedding(trigram_input)])
         self.logger.info(f"Shape of combined trigram: {combined_trigram.shape}")
-        # combined_trigram_flat = Flatten()(combined_trigram)
-        # self.logger.info(f"Shape of combined trigram, flat: {combined_trigram_flat.shape}")
-        # bigram_conv = Conv1D(filters=20,  kernel_size=4, activation="relu")(combined_bigram_flat)
-        bigram_conv = Conv1D(filters=20, kernel_size=4, activation="relu")(combined_bigram)
+
+        bigram_conv = Conv1D(filters=20, kernel_size=4, activation="relu", name="bigram_conv")(combined_bigram)
         self.logger.info(f"Shape of bigram conv: {bigram_conv.shape}")
         bigram_maxpool = MaxPool1D(pool_size=2, padding='same')(bigram_conv)
 
-        # trigram_conv = Conv1D(filters=20, kernel_size=4, activation="relu")(combined_trigram_flat)
-        trigram_conv = Conv1D(filters=20, kernel_size=4, activation="relu")(combined_trigram)
+        trigram_conv = Conv1D(filters=20, kernel_size=4, activation="relu", name="trigram_conv")(combined_trigram)
         self.logger.info(f"Shape of trigram conv: {trigram_conv.shape}")
         trigram_maxpool = MaxPool1D(pool_size=2, padding='same')(trigram_conv)
 
@@ -91,46 +68,57 @@ class SentenceClassifier(object):
 
         concatenate = Concatenate(axis=1)([bigram_flatten, trigram_flatten])
 
-        output = Dense(num_classes, activation="softmax")(concatenate)
+        # The layers with weights are named, SentimentAnalyser reads them from the weights file by name
+        output = Dense(num_classes, activation="softmax", name="sentence_classes")(concatenate)
         self.model = Model(inputs=[bigram_input, trigram_input], outputs=output)
         # Loss function: categorical cross entropy as we select across many different choices
-        self.model.compile(loss="categorical_crossentropy")
+        self.model.compile(loss="categorical_crossentropy", optimizer=RMSprop(learning_rate=learning_rate))
         self.model.summary(print_fn=self.logger.info)
         # plot_model(model=self.model, to_file="CBOW model.png", show_shapes=True)
-        # Preload word vectors if some training has already been done
+        # Preload word vectors if some training has already been done, migrating the weights of a classifier with
+        # an embedding table per branch. Weights trained with another vocabulary can't be continued from.
         if path.exists(self.model_file):
-            self.weights = self.model.load_weights(self.model_file)
-
-    def train_model(self, training_data_file, epochs=3):
+            for layer, weights in load_layer_weights(self.model_file, vocabulary_size).items():
+                self.model.get_layer(layer).set_weights(weights)
+
+    def train_model(self, training_data_file, epochs=3, batch_size=100, checkpoints=None, early_stopping=None,
+                    held_out_fraction=0.0, bucket_messages=0):
+        # The word ids of every sentence and its label, memory mapped, made into batches of bigram/trigram pairs by
+        # sentence_dataset (or, in training data files from before, one row per pair). The held out sentences (rows)
+        # at the end aren't trained on, see fit for the checkpoints and the early stopping
         X_y = load_training_data(training_data_file)
-        all_bigrams = []
-        all_trigrams = []
-        all_labels = []
-        training_samples = X_y["X"]
-        labels = X_y["y"]
-        for training_sample, label in zip(training_samples, labels):
-            all_bigrams.extend(training_sample[0])
-            all_trigrams.extend(training_sample[1])
-            all_labels.extend(label)
-        batch_size = min(100, len(all_labels))
+        held_out = int(len(X_y) * held_out_fraction)
+        if "ids" in X_y:
+            messages = np.arange(len(X_y) - held_out)
+            validation = sentence_dataset(
+                X_y, batch_size, self._to_model, messages=np.arange(len(X_y) - held_out, len(X_y))
+            ) if held_out else None
+
+            def datasets(epoch):
+                return sentence_dataset(X_y, batch_size, self._to_model, epoch, messages, bucket_messages)
+        else:
+            columns, held_out = held_out_split(
+                {"bigrams": X_y["bigrams"], "trigrams": X_y["trigrams"], "y": X_y["y"]}, held_out
+            )
+            validation = array_dataset(held_out, batch_size, self._to_model) if held_out else None
+
+            def datasets(epoch):
+                return array_dataset(columns, batch_size, self._to_model, seed=epoch)
         timer = Timer(
             name="Sentence classifier training timer",
             text="Epoch training time: {minutes:.2f} minutes",
             logger=self.logger.info,
         )
-        for epoch in range(epochs):
-            loss = 0.0
-            timer.start()
-            for bigr_batch, trigr_batch, label_batch in batch(
-                    all_bigrams, all_trigrams, all_labels, batch_size
-            ):
-                loss += self.model.train_on_batch(
-                    x=[np.array(bigr_batch, dtype="int32"), np.array(trigr_batch, dtype="int32")], y=np.array(label_batch, dtype="int32")
-                )
-            timer.stop()
-            logging.info("Epoch #{}, loss: {}".format(epoch + 1, loss))
+        callback = epoch_callback(lambda epoch: timer.start(), lambda epoch: timer.stop())
+        fit(
+            self.model, datasets, epochs, [callback], checkpoints, early_stopping, validation,
+        )
         self.model.save_weights(self.model_file)
 
+    def _to_model(self, batch):
+        # The softmax over the sentence classes is trained on one-hot labels
+        return (batch["bigrams"], batch["trigrams"]), tf.one_hot(batch["y"], self.num_classes)
+
 
 def main():
     dir_name = path.dirname(__file__)
@@ -144,11 +132,20 @@ def main():
     training_data_file = path.join(
         dir_name, "../data/4_training_data/sentence_classifier/training_data.dat"
     )
-    word_vectors = np.array(np.load(path.join(dir_name, "../", word_vectors_file), allow_pickle=True))
+    # The row of a word is its id in the aligned vocabulary (pretrained_dictionary), see align_vectors
+    word_vectors = np.load(path.join(dir_name, "../", word_vectors_file), mmap_mode="r")
     epochs = config_dict["epochs"]
     num_classes = config_dict["sentence_classes"]
-    sentence_class_model = SentenceClassifier(vector_size, len(word_vectors), word_vectors, num_classes)
-    sentence_class_model.train_model(training_data_file, epochs)
+    batch_size = config_dict["batch_size"]
+    learning_rate = scaled_learning_rate(
+        config_dict["learning_rate"], batch_size, config_dict["learning_rate_scaling"]
+    )
+    sentence_class_model = SentenceClassifier(vector_size, len(word_vectors), word_vectors, num_classes, learning_rate)
+    checkpoints, early_stopping, _ = training_settings(config_dict, "sentence_classifier")
+    sentence_class_model.train_model(
+        training_data_file, epochs, batch_size, checkpoints, early_stopping, config_dict["held_out_fraction"],
+        config_dict["sentence_bucket_messages"],
+    )
 
 
 if __name__ == "__main__":
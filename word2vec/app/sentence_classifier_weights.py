@@ -0,0 +1,57 @@
+import logging
+import h5py
+import numpy as np
+
+# The layers of SentenceClassifier with weights: one trainable and one frozen embedding table, shared by the bigram
+# and the trigram branch
+LAYERS = ("word_embedding", "frozen_word_embedding", "bigram_conv", "trigram_conv", "sentence_classes")
+# The layers of the classifier before the tables were shared: a trainable and a frozen table per branch (trainable
+# bigram, frozen bigram, trainable trigram, frozen trigram), the convolutions and the softmax. Named, or before that
+# with the names Keras gave them in a fresh process.
+_SEPARATE_TABLES = (
+    ("bigram_embedding", "frozen_bigram_embedding", "trigram_embedding", "frozen_trigram_embedding", "bigram_conv",
+     "trigram_conv", "sentence_classes"),
+    ("embedding", "embedding_1", "embedding_2", "embedding_3", "conv1d", "conv1d_1", "dense"),
+)
+
+
+def _read_layers(weights, layers):
+    return [[np.asarray(weights[layer][name]) for name in weights[layer].attrs["weight_names"]] for layer in layers]
+
+
+def _shared_tables(bigram_embedding, frozen_embedding, trigram_embedding, _, bigram_conv, trigram_conv, dense):
+    # The trainable tables of both branches started from the same vectors and were trained on the same sentences:
+    # the shared one starts from their mean. The frozen tables are both still the pretrained vectors.
+    return dict(zip(LAYERS, (
+        [(bigram_embedding[0] + trigram_embedding[0]) / 2], frozen_embedding, bigram_conv, trigram_conv, dense
+    )))
+
+
+def _checked(weights_file, layer_weights, vocabulary_size):
+    # The tables have a row per word id of the vocabulary they were trained with: those of another vocabulary (e.g.
+    # the whole pretrained GloVe vocabulary, from before it was aligned to the corpus) would look up the wrong words
+    rows = len(layer_weights["word_embedding"][0])
+    if vocabulary_size is not None and rows != vocabulary_size:
+        raise ValueError(
+            f"{weights_file} has embedding tables of {rows} word ids, the vocabulary has {vocabulary_size}: it was "
+            f"trained with another vocabulary, remove it and retrain the classifier (make train_sentence_class)"
+        )
+    return layer_weights
+
+
+def load_layer_weights(weights_file, vocabulary_size=None):
+    """
+    The weights of the layers of SentenceClassifier, by layer name, from a Keras HDF5 weights file (save_weights, or
+    save) without Keras. The weights of the classifier with a trainable and a frozen table per branch are migrated
+    to the shared tables. With a vocabulary_size, the tables must have a row per id of that vocabulary.
+    """
+    with h5py.File(weights_file, "r") as weights:
+        if "model_weights" in weights:
+            weights = weights["model_weights"]
+        if all(layer in weights for layer in LAYERS):
+            return _checked(weights_file, dict(zip(LAYERS, _read_layers(weights, LAYERS))), vocabulary_size)
+        for layers in _SEPARATE_TABLES:
+            if all(layer in weights for layer in layers):
+                logging.getLogger(__name__).info(f"Migrating {weights_file} to shared embedding tables")
+                return _checked(weights_file, _shared_tables(*_read_layers(weights, layers)), vocabulary_size)
+    raise ValueError(f"{weights_file} has no weights of the layers {LAYERS}, is it a SentenceClassifier?")
@@ -0,0 +1,145 @@
+import sys
+import threading
+import logging
+from os import path
+import numpy as np
+import yaml
+from .micro_batcher import MicroBatcher
+from .sentence_classifier_weights import load_layer_weights
+from .preprocessing.training_data.sentence_classifier_training_builder import sentence_ngrams
+from .preprocessing.training_data.training_data_builder import load_tokenizer
+from .preprocessing.training_data.vocabulary import Vocabulary
+
+
+def _conv_max_pool(x, kernel, bias):
+    # Conv1D (valid, relu) over the positions of x (pairs, positions, vector size), then MaxPool1D(2, padding="same"),
+    # flattened like Flatten does
+    kernel_size, _, filters = kernel.shape
+    kernel = kernel.reshape(-1, filters)
+    outputs = [
+        x[:, position:position + kernel_size].reshape(len(x), -1) @ kernel
+        for position in range(x.shape[1] - kernel_size + 1)
+    ]
+    if len(outputs) % 2:
+        outputs.append(np.full_like(outputs[0], -np.inf))
+    conv = np.maximum(np.stack(outputs, axis=1) + bias, 0)
+    return conv.reshape(len(x), -1, 2, filters).max(axis=2).reshape(len(x), -1)
+
+
+class SentimentAnalyser(object):
+    """
+    The class probabilities of chat messages by the trained SentenceClassifier, with the forward pass in NumPy on
+    its weights so that serving doesn't need TensorFlow or pay its per call overhead.
+
+    The messages are tokenized like the training data was, and split into the bigram/trigram pairs of
+    _generate_training_samples for all of them at once (see sentence_ngrams). Every pair gets class probabilities in one
+    forward pass over all the pairs, and the probabilities of a message are the mean of those of its pairs, as every
+    pair of a sentence was trained on the label of the sentence.
+
+    analyse answers one message at a time from many threads: the MicroBatcher collects the messages waiting, and those
+    arriving within max_wait seconds of the first (up to max_batch_size), into a single predict.
+    """
+
+    def __init__(self, tokenizer, weights, max_batch_size=256, max_wait=0.0, chunk_pairs=8192):
+        self.logger = logging.getLogger(__name__)
+        self.tokenizer = tokenizer
+        # The trainable and the frozen table, both branches look their words up in both
+        self.embeddings = [
+            np.asarray(weights[layer][0], dtype=np.float32) for layer in ("word_embedding", "frozen_word_embedding")
+        ]
+        self.bigram_conv = [np.asarray(weight, dtype=np.float32) for weight in weights["bigram_conv"]]
+        self.trigram_conv = [np.asarray(weight, dtype=np.float32) for weight in weights["trigram_conv"]]
+        self.dense = [np.asarray(weight, dtype=np.float32) for weight in weights["sentence_classes"]]
+        self.num_classes = self.dense[1].shape[0]
+        # Pairs per forward pass, bounding the memory of the embedded pairs
+        self.chunk_pairs = chunk_pairs
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._batcher = None
+        self._batcher_lock = threading.Lock()
+
+    @staticmethod
+    def load(model_file, tokenizer, **kwargs):
+        # The tables of the classifier must have a row per id of the vocabulary (a pickled Keras Tokenizer isn't
+        # checked)
+        vocabulary_size = tokenizer.vocabulary_size() if isinstance(tokenizer, Vocabulary) else None
+        return SentimentAnalyser(tokenizer, load_layer_weights(model_file, vocabulary_size), **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def encode(self, messages):
+        # Flat word ids and offsets of the messages
+        sequences = self.tokenizer.texts_to_sequences(messages)
+        offsets = np.concatenate(([0], np.cumsum([len(sequence) for sequence in sequences])))
+        ids = np.fromiter((word_id for sequence in sequences for word_id in sequence), np.int32, offsets[-1])
+        return ids, offsets
+
+    def _forward(self, bigrams, trigrams):
+        # Class probabilities of every bigram/trigram pair
+        bigrams = np.concatenate([embeddings[bigrams] for embeddings in self.embeddings], axis=1)
+        trigrams = np.concatenate([embeddings[trigrams] for embeddings in self.embeddings], axis=1)
+        features = np.concatenate(
+            (_conv_max_pool(bigrams, *self.bigram_conv), _conv_max_pool(trigrams, *self.trigram_conv)), axis=1
+        )
+        logits = features @ self.dense[0] + self.dense[1]
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+    def predict(self, messages):
+        """
+        The (messages, classes) class probabilities of the messages. A message without any known word has no pairs
+        and gets the same probability for every class.
+        """
+        bigrams, trigrams, pair_messages = sentence_ngrams(*self.encode(messages))
+        sums = np.zeros((len(messages), self.num_classes), dtype=np.float32)
+        for start in range(0, len(bigrams), self.chunk_pairs):
+            end = start + self.chunk_pairs
+            # The pairs of a message are next to each other
+            present, starts = np.unique(pair_messages[start:end], return_index=True)
+            sums[present] += np.add.reduceat(self._forward(bigrams[start:end], trigrams[start:end]), starts, axis=0)
+        pairs = np.bincount(pair_messages, minlength=len(messages))
+        sums[pairs == 0] = 1.0 / self.num_classes
+        return sums / np.maximum(pairs, 1)[:, None]
+
+    def analyse(self, message, timeout=None):
+        # The class probabilities of one message, predicted in a batch with the messages of other threads
+        with self._batcher_lock:
+            if self._batcher is None:
+                self._batcher = MicroBatcher(self.predict, self.max_batch_size, self.max_wait)
+            batcher = self._batcher
+        return batcher(message, timeout)
+
+    def close(self):
+        with self._batcher_lock:
+            batcher, self._batcher = self._batcher, None
+        if batcher is not None:
+            batcher.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    dir_name = path.dirname(__file__)
+    config_file = path.join(dir_name, "../config.yaml")
+    config_dict = None
+    with open(config_file) as config:
+        config_dict = yaml.load(config, Loader=yaml.Loader)
+    tokenizer = load_tokenizer(path.join(dir_name, "..", config_dict["pretrained_dictionary"]))
+    sentiment_analyser = SentimentAnalyser.load(
+        path.join(dir_name, "../data/5_models/sentiment_classifier.h5"),
+        tokenizer,
+        max_batch_size=config_dict["sentiment_max_batch_size"],
+        max_wait=config_dict["sentiment_max_wait_ms"] / 1000,
+    )
+    # Messages from the command line, or one per line from stdin
+    messages = sys.argv[1:] or [line.strip() for line in sys.stdin]
+    for message, probabilities in zip(messages, sentiment_analyser.predict(messages)):
+        print(f"{int(np.argmax(probabilities))} {' '.join(f'{p:.3f}' for p in probabilities)} {message}")
+
+
+if __name__ == "__main__":
+    main()
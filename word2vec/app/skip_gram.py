@@ -1,26 +1,24 @@
-from .preprocessing.training_data.training_data_builder import load_training_data, load_tokenizer
+from .preprocessing.training_data.training_data_builder import load_training_data
+from .preprocessing.training_data.vocabulary import Vocabulary
+from .preprocessing.training_data.skip_gram_training_builder import SkipGramTrainingBuilder
+from .input_pipeline import array_dataset, stream_dataset, epoch_callback, fit, held_out_split, scaled_learning_rate
+from .checkpoint import similarity_correlation, training_settings
 from os import path
 from keras import Input, Model
 from keras.layers import Dot
 from keras.layers.core import Dense, Reshape
 from keras.layers.core.embedding import Embedding
+from keras.optimizers import RMSprop
 from codetiming import Timer
 import logging
 import yaml
 import numpy as np
 
 
-def batch(a_list, b_list, c_list, batch_size):
-    for i in range(0, min(len(a_list), len(b_list), len(c_list)), batch_size):
-        yield a_list[i: i + batch_size], b_list[i: i + batch_size], c_list[
-            i: i + batch_size
-        ]
-
-
 class Skipgram(object):
     logging.basicConfig(level=logging.INFO)
 
-    def __init__(self, vector_size, vocabulary_size):
+    def __init__(self, vector_size, vocabulary_size, learning_rate=0.001):
         dir_name = path.dirname(__file__)
         self.logger = logging.getLogger(__name__)
 
@@ -59,55 +57,93 @@ class Skipgram(object):
         output = Dense(1, activation="sigmoid")(dot_product_reshaped)
         self.model = Model(inputs=[focus_input, context_input], outputs=output)
         # Loss function is binary crossentropy as we only determine if real or fake context word
-        self.model.compile(loss="binary_crossentropy")
+        self.model.compile(loss="binary_crossentropy", optimizer=RMSprop(learning_rate=learning_rate))
         self.model.summary(print_fn=self.logger.info)
         if path.exists(self.model_file):
             self.model.load_weights(self.model_file)
 
-    def train_model(self, training_data_file, epochs=3):
+    def train_model(self, training_data_file, epochs=3, batch_size=100, checkpoints=None, early_stopping=None,
+                    held_out_fraction=0.0, evaluate=None):
+        # Column views into the memory mapped training data, batches are only read when trained on. The held out
+        # rows at the end aren't trained on, see fit for the checkpoints and the early stopping
         X_y = load_training_data(training_data_file)
-        word_pairs = X_y["X"]
-        focus_words, context_words = zip(*word_pairs)
-        focus_words = np.array(focus_words, dtype=np.intc)
-        context_words = np.array(context_words, dtype=np.intc)
-        labels = X_y["y"]
-        batch_size = min(100, len(labels))
+        columns, held_out = held_out_split(X_y.columns, int(len(X_y) * held_out_fraction))
+        validation = array_dataset(held_out, batch_size, self._to_model) if held_out else None
+        self._fit(
+            lambda epoch: array_dataset(columns, batch_size, self._to_model, seed=epoch), epochs, checkpoints,
+            early_stopping, validation, evaluate,
+        )
+
+    def train_stream(self, training_stream, epochs=3, checkpoints=None, early_stopping=None, evaluate=None):
+        # Trains on batches of pairs produced while training, see SkipGramTrainingBuilder.sg_training_stream. The
+        # stream isn't read in the exact same order twice, a resumed epoch skips as many batches as were trained on
+        columns = {"X": (np.int32, (2,)), "y": (np.int32, ())}
+        with training_stream:
+            self._fit(
+                lambda epoch: stream_dataset(training_stream, columns, self._to_model, epoch), epochs, checkpoints,
+                early_stopping, None, evaluate,
+            )
+
+    @staticmethod
+    def _to_model(batch):
+        return (batch["X"][:, 0], batch["X"][:, 1]), batch["y"]
+
+    def _fit(self, datasets, epochs, checkpoints, early_stopping, validation, evaluate):
         timer = Timer(
             name="Skip-gram training timer",
             text="Epoch training time: {minutes:.2f} minutes",
             logger=self.logger.info,
         )
-        for epoch in range(epochs):
-            loss = 0.0
-            timer.start()
-            for fw_batch, cw_batch, label_batch in batch(
-                focus_words, context_words, labels, batch_size
-            ):
-                loss += self.model.train_on_batch(
-                    x=[np.array(fw_batch), np.array(cw_batch)], y=np.array(label_batch)
-                )
-            timer.stop()
-            logging.info("Epoch #{}, loss: {}".format(epoch + 1, loss))
-            trained_embeddings = self.model.layers[2].get_weights()
-            self.model.layers[3].set_weights(trained_embeddings)
+        callback = epoch_callback(lambda epoch: timer.start(), lambda epoch: self._end_epoch(timer))
+        fit(self.model, datasets, epochs, [callback], checkpoints, early_stopping, validation, evaluate)
         self.model.save_weights(self.model_file)
 
+    def word_vectors(self):
+        return self.model.layers[2].get_weights()[0]
+
+    def _end_epoch(self, timer):
+        timer.stop()
+        trained_embeddings = self.model.layers[2].get_weights()
+        self.model.layers[3].set_weights(trained_embeddings)
+
 
 def main():
     dir_name = path.dirname(__file__)
     training_data_file = path.join(
         dir_name, "../data/4_training_data/skip_gram/training_data.dat"
     )
-    tokenizer = load_tokenizer(path.join(dir_name, "../data/4_training_data/dictionary.dat"))
-    vocabulary_size = len(tokenizer.word_index) + 1
+    vocabulary = Vocabulary.load(path.join(dir_name, "../data/4_training_data/dictionary.vocab"))
+    vocabulary_size = vocabulary.vocabulary_size()
     config_file = path.join(dir_name, "../config.yaml")
     config_dict = None
     with open(config_file) as config:
         config_dict = yaml.load(config, Loader=yaml.Loader)
     vector_size = config_dict["vector_size"]
     epochs = config_dict["epochs"]
-    skip_gram_model = Skipgram(vector_size, vocabulary_size)
-    skip_gram_model.train_model(training_data_file, epochs)
+    batch_size = config_dict["batch_size"]
+    learning_rate = scaled_learning_rate(
+        config_dict["learning_rate"], batch_size, config_dict["learning_rate_scaling"]
+    )
+    skip_gram_model = Skipgram(vector_size, vocabulary_size, learning_rate)
+    checkpoints, early_stopping, similarity = training_settings(config_dict, "skip_gram", vocabulary)
+    evaluate = (lambda: similarity_correlation(skip_gram_model.word_vectors(), *similarity)) if similarity else None
+    if config_dict["streaming_training"]:
+        skip_gram_training_builder = SkipGramTrainingBuilder(
+            path.join(dir_name, "..", config_dict["cleaned_directory"]),
+            config_dict["window_size"],
+            path.join(dir_name, "..", config_dict["vocabulary"]),
+            workers=config_dict["encoder_workers"],
+            negative_samples=config_dict["negative_samples"],
+            subsampling_threshold=config_dict["subsampling_threshold"],
+            seed=config_dict["seed"],
+        )
+        training_stream = skip_gram_training_builder.sg_training_stream(batch_size, config_dict["prefetch_batches"])
+        skip_gram_model.train_stream(training_stream, epochs, checkpoints, early_stopping, evaluate)
+    else:
+        skip_gram_model.train_model(
+            training_data_file, epochs, batch_size, checkpoints, early_stopping, config_dict["held_out_fraction"],
+            evaluate
+        )
 
 
 if __name__ == "__main__":
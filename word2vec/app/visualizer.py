@@ -2,9 +2,9 @@ import sys
 from os import path
 import numpy as np
 import yaml
-from sklearn.metrics.pairwise import euclidean_distances
 from sklearn.manifold import TSNE
-from app.preprocessing.training_data.training_data_builder import load_tokenizer
+from app.preprocessing.training_data.vocabulary import Vocabulary
+from app.embedding_index import EmbeddingIndex
 import matplotlib.pyplot as plt
 import plotly.graph_objs as go
 from sklearn.decomposition import PCA
@@ -17,7 +17,8 @@ class Visualizer(object):
         self.word_vectors = word_vectors
         self.word2id = word2id
         self.id2word = id2word
-        self.distance_matrix = euclidean_distances(word_vectors)
+        # Nearest words by cosine similarity, searched in blocks instead of a vocabulary x vocabulary distance matrix
+        self.index = EmbeddingIndex(word_vectors)
         self.three_dim = PCA(random_state=0).fit_transform(self.word_vectors)[:, :3]
 
     def start(self):
@@ -25,13 +26,13 @@ class Visualizer(object):
         self.visualize_tsne(words)
         self.visualize_pca(words)
 
+    def similar_words(self, word, topn=9):
+        ids, _ = self.index.search(self.word_vectors[self.word2id[word]], topn + 1)
+        # Padding and the out-of-vocabulary token (ids 0 and 1) aren't words
+        return [self.id2word[i] for i in ids[0] if i > 1 and i != self.word2id[word]][:topn]
+
     def visualize_tsne(self, words):
-        # similar_words = {
-        #     search_term: [
-        #         self.id2word[idx]
-        #         for idx in self.distance_matrix[self.word2id[search_term] - 1].argsort()[1:10] + 1]
-        #     for search_term in words.split(" ")
-        # }
+        # similar_words = {search_term: self.similar_words(search_term) for search_term in words}
         # words = sum([[k] + v for k, v in similar_words.items()], [])
         words_ids = [self.word2id[w] for w in words]
         selected_word_vectors = np.array([self.word_vectors[idx] for idx in words_ids])
@@ -104,11 +105,10 @@ def main():
     with open(config_file) as config:
         config_dict = yaml.load(config, Loader=yaml.Loader)
     vector_size = config_dict["vector_size"]
-    tokenizer = load_tokenizer(path.join(dir_name, "../data/4_training_data/dictionary.dat"))
-    reverse_word_map = dict(map(reversed, tokenizer.word_index.items()))
+    vocabulary = Vocabulary.load(path.join(dir_name, "../", config_dict["vocabulary"]))
     word_vectors_tmp = np.load(path.join(dir_name, f"../data/5_models/{word_vectors_file}"))
-    word_vectors = np.reshape(word_vectors_tmp, (len(tokenizer.word_index)+1, vector_size))
-    visualizer = Visualizer(vector_size, word_vectors, tokenizer.word_index, reverse_word_map)
+    word_vectors = np.reshape(word_vectors_tmp, (vocabulary.vocabulary_size(), vector_size))
+    visualizer = Visualizer(vector_size, word_vectors, vocabulary.word_index, vocabulary.index_word)
     visualizer.start()
 
 
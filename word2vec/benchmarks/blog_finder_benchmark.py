@@ -0,0 +1,71 @@
+import sys
+import time
+import numpy as np
+from app.blog_finder import BlogFinder
+from app.preprocessing.training_data.vocabulary import Vocabulary
+
+MESSAGES = 64
+VECTOR_SIZE = 100
+BLOGS = 500
+PARAGRAPHS_PER_BLOG = 20
+
+
+def _word(i):
+    # Letters only, the cleaning removes digits
+    return "w" + "".join(chr(ord("a") + int(digit)) for digit in str(i))
+
+
+def _blog_finder(vocabulary_size, lists):
+    random = np.random.default_rng(0)
+    words = ["", "<OOV>"] + [_word(i) for i in range(vocabulary_size - 2)]
+    vocabulary = Vocabulary.from_words(words, np.arange(vocabulary_size)[::-1].copy())
+    docs = {
+        f"blog{i}.md": list(range(i * PARAGRAPHS_PER_BLOG, (i + 1) * PARAGRAPHS_PER_BLOG)) for i in range(BLOGS)
+    }
+    return BlogFinder(
+        vocabulary,
+        random.normal(0, 0.1, (vocabulary_size, VECTOR_SIZE)).astype(np.float32),
+        random.normal(0, 0.1, (VECTOR_SIZE, vocabulary_size)).astype(np.float32),
+        np.zeros(vocabulary_size, dtype=np.float32),
+        random.normal(size=(BLOGS * PARAGRAPHS_PER_BLOG, VECTOR_SIZE)).astype(np.float32),
+        docs,
+        2,
+        lists=lists,
+    )
+
+
+def _timed(find, messages, one_at_a_time):
+    start = time.perf_counter()
+    if one_at_a_time:
+        for message in messages:
+            find([message])
+    else:
+        find(messages)
+    return (time.perf_counter() - start) / len(messages) * 1000
+
+
+def main():
+    # Vocabulary size, the softmax over it is what an inference step costs
+    vocabulary_size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    lists = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    blog_finder = _blog_finder(vocabulary_size, lists)
+    random = np.random.default_rng(1)
+    # Chat messages of 5 to 15 words
+    messages = [
+        " ".join(_word(i) for i in random.integers(0, vocabulary_size - 2, random.integers(5, 16)))
+        for _ in range(MESSAGES)
+    ]
+    print(f"{vocabulary_size} words, {BLOGS * PARAGRAPHS_PER_BLOG} paragraphs of {VECTOR_SIZE}, {MESSAGES} messages, "
+          f"{blog_finder.steps} inference steps")
+    for method in ("average", "infer"):
+        for probes in (None, 8):
+            find = lambda batch: blog_finder.find(batch, method=method, probes=probes)
+            single_ms = _timed(find, messages, True)
+            batched_ms = _timed(find, messages, False)
+            search = "exact" if probes is None else f"{probes} probes"
+            print(f"{method:7} {search:9}: {single_ms:7.3f} ms/message one at a time, "
+                  f"{batched_ms:7.3f} ms/message batched")
+
+
+if __name__ == "__main__":
+    main()
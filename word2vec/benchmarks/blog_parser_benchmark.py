@@ -0,0 +1,90 @@
+import sys
+import tempfile
+import time
+from os import path, listdir, makedirs
+from app.preprocessing.parsing.blog_parser import BlogParser, remove_links, remove_tags
+
+
+def _recursive_tag_remover(line):
+    # The tag remover the blog parser used to have, rebuilding the line and recursing once per tag
+    opening_tag_index = line.find("<")
+    closing_tag_index = line.find(">")
+    if 0 <= opening_tag_index < closing_tag_index:
+        if opening_tag_index > 0:
+            return _recursive_tag_remover(line[:opening_tag_index - 1] + line[closing_tag_index + 1:])
+        return _recursive_tag_remover(line[closing_tag_index + 1:])
+    return line
+
+
+def _recursive_link_remover(line):
+    # The link remover the blog parser used to have, rebuilding the line and recursing once per link
+    open_bracket_index = line.find("[")
+    close_bracket_index = line.find("]")
+    if 0 <= open_bracket_index < close_bracket_index:
+        open_parenthesis_index = line[close_bracket_index:].find("(")
+        close_parenthesis_index = line[close_bracket_index:].find(")")
+        if 0 <= open_parenthesis_index < close_parenthesis_index:
+            return _recursive_link_remover(line[:close_bracket_index + open_parenthesis_index] +
+                                           line[close_bracket_index + close_parenthesis_index + 1:])
+    return line
+
+
+def _read_lines(source_dir):
+    lines = []
+    for filename in sorted(listdir(source_dir)):
+        with open(path.join(source_dir, filename), encoding="utf-8", errors="ignore") as f:
+            lines.extend(" ".join(line.split()) for line in f)
+    return lines
+
+
+def _lines_per_second(remove, lines, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for line in lines:
+            remove(line)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(lines) / best
+
+
+def _recursive(line):
+    try:
+        return _recursive_tag_remover(_recursive_link_remover(line))
+    except RecursionError:
+        return None
+
+
+def _linear(line):
+    return remove_tags(remove_links(line))
+
+
+def main():
+    dir_name = path.dirname(__file__)
+    source_dir = sys.argv[1] if len(sys.argv) > 1 else path.join(dir_name, "../data/1_raw/blogs")
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    rounds = 3
+    lines = _read_lines(source_dir)
+    recursive_results = [_recursive(line) for line in lines]
+    too_deep = sum(1 for result in recursive_results if result is None)
+    mismatches = sum(
+        1 for line, result in zip(lines, recursive_results) if result is not None and _linear(line) != result
+    )
+    recursive = _lines_per_second(_recursive, lines, rounds)
+    linear = _lines_per_second(_linear, lines, rounds)
+    print(f"lines: {len(lines)}, mismatches: {mismatches}, too deep to recurse: {too_deep}")
+    print(f"recursive removers: {recursive:,.0f} lines/sec")
+    print(f"linear scan:        {linear:,.0f} lines/sec ({linear / recursive:.1f}x)")
+    # The whole stage, code blocks included, on all blog files
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        target_dir = path.join(tmp_dir, "parsed")
+        makedirs(target_dir)
+        parser = BlogParser(path.abspath(source_dir), target_dir=target_dir, manifest_dir=tmp_dir)
+        start = time.perf_counter()
+        parser.parse_blog_files(workers)
+        elapsed = time.perf_counter() - start
+    print(f"parse_blog_files with {workers} workers: {len(lines) / elapsed:,.0f} lines/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import sys
+import time
+from os import path, listdir
+from app.preprocessing.cleaning.rewrite_engine import RewriteEngine
+
+
+def _read_lines(source_dir):
+    lines = []
+    for filename in sorted(listdir(source_dir)):
+        with open(path.join(source_dir, filename), encoding="utf-8", errors="ignore") as f:
+            lines.extend(f)
+    return lines
+
+
+def _lines_per_second(rewrite, lines, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for line in lines:
+            rewrite(line)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(lines) / best
+
+
+def main():
+    dir_name = path.dirname(__file__)
+    source_dir = sys.argv[1] if len(sys.argv) > 1 else path.join(dir_name, "../data/1_raw/blogs")
+    rounds = 3
+    lines = _read_lines(source_dir)
+    engine = RewriteEngine()
+    mismatches = sum(1 for line in lines if engine.rewrite(line) != engine.rewrite_sequential(line))
+    sequential = _lines_per_second(engine.rewrite_sequential, lines, rounds)
+    compiled = _lines_per_second(engine.rewrite, lines, rounds)
+    print(f"lines: {len(lines)}, literal passes: {len(engine.literal_passes)}, mismatches: {mismatches}")
+    print(f"sequential re.sub: {sequential:,.0f} lines/sec")
+    print(f"rewrite engine:    {compiled:,.0f} lines/sec ({compiled / sequential:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import sys
+import time
+from itertools import chain
+import numpy as np
+from app.preprocessing.training_data.context_windows import context_windows
+
+
+def _cbow_samples(sample_text, window_size):
+    # The CBOW sample generator as it was before context_windows, one Python list per sample
+    buffer = np.zeros(window_size, dtype=np.intc).tolist()
+    buffered_sampled_text = list(chain(buffer, sample_text, buffer))
+    for sample_text_pos, focus_word_id in enumerate(sample_text):
+        context_word_ids = np.zeros(window_size * 2, dtype=np.intc).tolist()
+        start = sample_text_pos - window_size
+        end = sample_text_pos + window_size + 1
+        context_word_index = 0
+        buffered_sampled_text_index = sample_text_pos
+        for i in range(start, end):
+            if i == sample_text_pos:
+                buffered_sampled_text_index += 1
+                continue
+            context_word_ids[context_word_index] = buffered_sampled_text[buffered_sampled_text_index]
+            context_word_index += 1
+            buffered_sampled_text_index += 1
+        yield context_word_ids, focus_word_id
+
+
+def _best_time(build, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        build()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    number_of_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 30000
+    window_size = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    rounds = 3
+    random = np.random.default_rng(0)
+    lines = [random.integers(1, 100000, random.integers(0, 20)).tolist() for _ in range(number_of_lines)]
+    offsets = np.concatenate(([0], np.cumsum([len(line) for line in lines])))
+    ids = np.fromiter(chain.from_iterable(lines), dtype=np.int32, count=offsets[-1])
+    expected = [sample for line in lines for sample in _cbow_samples(line, window_size)]
+    X, y = context_windows(ids, offsets, window_size)
+    mismatches = int(np.sum(np.any(X != np.array([x for x, _ in expected]).reshape(X.shape), axis=1)))
+    mismatches += int(np.sum(y != np.array([focus_word_id for _, focus_word_id in expected])))
+    generator = _best_time(lambda: [sample for line in lines for sample in _cbow_samples(line, window_size)], rounds)
+    windows = _best_time(lambda: context_windows(ids, offsets, window_size), rounds)
+    print(f"lines: {number_of_lines}, words: {offsets[-1]}, window size: {window_size}, mismatches: {mismatches}")
+    print(f"sample generator: {offsets[-1] / generator:,.0f} words/sec")
+    print(f"context_windows:  {offsets[-1] / windows:,.0f} words/sec ({generator / windows:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
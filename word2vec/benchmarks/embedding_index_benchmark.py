@@ -0,0 +1,60 @@
+import sys
+import time
+import numpy as np
+from app.embedding_index import EmbeddingIndex
+
+QUERIES = 200
+K = 10
+
+
+def _vectors(rows, vector_size=100, clusters=1000, seed=0):
+    # Clustered like trained embeddings are, rather than uniformly random
+    random = np.random.default_rng(seed)
+    centers = random.normal(size=(clusters, vector_size)).astype(np.float32)
+    noise = random.normal(size=(rows, vector_size)).astype(np.float32)
+    return centers[random.integers(0, clusters, rows)] + 1.5 * noise
+
+
+def _timed(search, queries, one_at_a_time):
+    start = time.perf_counter()
+    if one_at_a_time:
+        ids = np.concatenate([search(query)[0] for query in queries])
+    else:
+        ids = search(queries)[0]
+    return ids, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    # An embeddings .npy (e.g. data/5_models/skip_gram_embeddings_19.npy), or the number of random vectors
+    if len(sys.argv) > 1 and sys.argv[1].endswith(".npy"):
+        vectors = np.load(sys.argv[1])
+        vectors = np.reshape(vectors, (-1, vectors.shape[-1]))
+    else:
+        vectors = _vectors(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
+    lists = int(sys.argv[2]) if len(sys.argv) > 2 else int(np.sqrt(len(vectors)) * 2)
+    random = np.random.default_rng(1)
+    queries = vectors[random.choice(len(vectors), QUERIES, replace=False)] + 0.1 * random.normal(
+        size=(QUERIES, vectors.shape[1])).astype(np.float32)
+    print(f"{len(vectors)} vectors of {vectors.shape[1]}, {QUERIES} queries, top {K}")
+
+    start = time.perf_counter()
+    exact = EmbeddingIndex(vectors)
+    print(f"exact index built in {time.perf_counter() - start:.2f} s")
+    start = time.perf_counter()
+    ivf = EmbeddingIndex(vectors, lists=lists)
+    print(f"ivf index ({lists} lists) built in {time.perf_counter() - start:.2f} s")
+
+    expected, batched_ms = _timed(lambda batch: exact.search(batch, K), queries, False)
+    _, single_ms = _timed(lambda query: exact.search(query, K), queries, True)
+    print(f"exact           : {single_ms:7.3f} ms/query one at a time, {batched_ms:7.3f} ms/query batched, "
+          f"recall@{K} 1.000")
+    for probes in (1, 4, 16, 64):
+        if probes >= lists:
+            break
+        ids, ms = _timed(lambda query: ivf.search(query, K, probes), queries, True)
+        recall = np.mean([len(set(e) & set(i)) / K for e, i in zip(expected, ids.reshape(QUERIES, K))])
+        print(f"ivf {probes:3} probes  : {ms:7.3f} ms/query one at a time, recall@{K} {recall:.3f}")
+
+
+if __name__ == "__main__":
+    main()
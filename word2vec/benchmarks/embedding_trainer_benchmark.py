@@ -0,0 +1,72 @@
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import cpu_count
+from os import path
+from app.embedding_trainer import CbowTrainer, GloveTrainer, SkipGramTrainer
+from app.preprocessing.training_data.training_data_builder import TrainingDataBuilder, load_training_data
+from app.preprocessing.training_data.cbow_training_builder import CbowTrainingBuilder
+from app.preprocessing.training_data.skip_gram_training_builder import SkipGramTrainingBuilder
+from app.preprocessing.training_data.glove_training_builder import GloveTrainingBuilder
+from benchmarks.encode_benchmark import _write_cleaned_corpus
+
+WINDOW_SIZE = 5
+VECTOR_SIZE = 100
+
+
+def _training_data(builder_class, build, corpus_dir, tmp_dir, name):
+    builder = builder_class(corpus_dir, WINDOW_SIZE, path.join(tmp_dir, "dictionary.vocab"), manifest_dir=tmp_dir)
+    builder.training_data_file = path.join(tmp_dir, name, "training_data.dat")
+    build(builder)
+    return builder, load_training_data(builder.training_data_file)
+
+
+def main():
+    dir_name = path.dirname(__file__)
+    source_dir = sys.argv[1] if len(sys.argv) > 1 else path.join(dir_name, "../data/1_raw/blogs")
+    max_threads = int(sys.argv[2]) if len(sys.argv) > 2 else cpu_count()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus_dir = path.join(tmp_dir, "cleaned")
+        os.makedirs(corpus_dir)
+        _write_cleaned_corpus(source_dir, path.join(corpus_dir, "corpus.txt"))
+        TrainingDataBuilder(corpus_dir, path.join(tmp_dir, "dictionary.vocab"), manifest_dir=tmp_dir).tokenize()
+        builder, cbow_data = _training_data(
+            CbowTrainingBuilder, CbowTrainingBuilder.build_cbow_training_data, corpus_dir, tmp_dir, "cbow"
+        )
+        _, skip_gram_data = _training_data(
+            SkipGramTrainingBuilder, SkipGramTrainingBuilder.build_sg_training_data, corpus_dir, tmp_dir, "skip_gram"
+        )
+        _, glove_data = _training_data(
+            GloveTrainingBuilder, GloveTrainingBuilder.build_glove_training_data, corpus_dir, tmp_dir, "glove"
+        )
+        vocabulary_size = builder.vocabulary_size()
+        # Every word of the corpus is the focus word of exactly one cbow sample
+        words = len(cbow_data)
+        print(f"words: {words}, vocabulary size: {vocabulary_size}, vector size: {VECTOR_SIZE}")
+        trainers = {
+            "skip_gram": (
+                lambda threads: SkipGramTrainer(vocabulary_size, VECTOR_SIZE, threads=threads), skip_gram_data
+            ),
+            "cbow": (
+                lambda threads: CbowTrainer(vocabulary_size, VECTOR_SIZE, builder.tokenizer.counts, threads=threads),
+                cbow_data,
+            ),
+            "glove": (lambda threads: GloveTrainer(vocabulary_size, VECTOR_SIZE, threads=threads), glove_data),
+        }
+        for name, (trainer, training_data) in trainers.items():
+            for threads in sorted({1, max_threads}):
+                start = time.perf_counter()
+                trainer(threads).train(training_data, epochs=1)
+                elapsed = time.perf_counter() - start
+                # GloVe trains on co-occurring word pairs, not on the words of the corpus
+                samples = f"{len(training_data) / elapsed:,.0f} pairs/sec" if name == "glove" else \
+                    f"{words / elapsed:,.0f} words/sec"
+                print(
+                    f"{name:10} {threads:2} threads: {samples}, "
+                    f"{words / elapsed / threads:,.0f} corpus words/sec per core"
+                )
+
+
+if __name__ == "__main__":
+    main()
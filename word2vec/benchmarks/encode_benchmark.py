@@ -0,0 +1,63 @@
+import os
+import sys
+import tempfile
+import time
+from os import path, listdir
+from app.preprocessing.cleaning.data_cleaner import clean_line
+from app.preprocessing.training_data.training_data_builder import TrainingDataBuilder
+
+
+def _write_cleaned_corpus(source_dir, cleaned_file):
+    # Cleaned in memory so the benchmark can run on the raw blogs, stop words are kept like for the blog corpus
+    with open(cleaned_file, "w", encoding="utf-8") as cleaned:
+        for filename in sorted(listdir(source_dir)):
+            with open(path.join(source_dir, filename), encoding="utf-8", errors="ignore") as f:
+                for line in f:
+                    cleaned.write(clean_line(line, []))
+
+
+def _tokens_per_second(encode, rounds):
+    best = None
+    tokens = 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        tokens = encode()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return tokens, tokens / best
+
+
+def main():
+    dir_name = path.dirname(__file__)
+    source_dir = sys.argv[1] if len(sys.argv) > 1 else path.join(dir_name, "../data/1_raw/blogs")
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    rounds = 3
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus_dir = path.join(tmp_dir, "cleaned")
+        vocabulary_file = path.join(tmp_dir, "dictionary.vocab")
+        os.makedirs(corpus_dir)
+        _write_cleaned_corpus(source_dir, path.join(corpus_dir, "corpus.txt"))
+        builder = TrainingDataBuilder(corpus_dir, vocabulary_file, manifest_dir=tmp_dir)
+        builder.tokenize()
+        lines = list(builder.training_line_generator())
+
+        def per_line():
+            return sum(len(builder.line_to_word_ids(line)) for line in lines)
+
+        def batched():
+            return sum(len(ids) for ids, _ in builder.encode_lines(lines))
+
+        tokens, sequential = _tokens_per_second(per_line, rounds)
+        _, batch = _tokens_per_second(batched, rounds)
+        builder.workers = workers
+        # The encoder processes are started before the first round and reused by the others
+        _, pool = _tokens_per_second(batched, rounds)
+        builder.close()
+    print(f"lines: {len(lines)}, tokens: {tokens}, vocabulary size: {builder.vocabulary_size()}")
+    print(f"line_to_word_ids:            {sequential:,.0f} tokens/sec")
+    print(f"encode_lines:                {batch:,.0f} tokens/sec ({batch / sequential:.1f}x)")
+    print(f"encode_lines, {workers} workers:     {pool:,.0f} tokens/sec ({pool / sequential:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
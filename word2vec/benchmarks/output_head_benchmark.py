@@ -0,0 +1,63 @@
+import resource
+import sys
+import time
+from multiprocessing import get_context
+import numpy as np
+
+WINDOW_SIZE = 5
+VECTOR_SIZE = 100
+BATCH_SIZE = 100
+
+
+def _epoch(model_name, output_head, vocabulary_size, batches):
+    # Runs in a process of its own, so that the peak memory is that of one model and output head only
+    from app.cbow import CBOW
+    from app.pvdm_classifier import BlogClassifier
+
+    random = np.random.default_rng(0)
+    # Zipfian word ids, like those of a vocabulary sorted by descending count
+    words = np.minimum(random.zipf(1.2, (batches * BATCH_SIZE, 2 * WINDOW_SIZE + 1)), vocabulary_size - 1)
+    paragraphs = random.integers(0, 1000, batches * BATCH_SIZE)
+    if model_name == "cbow":
+        model = CBOW(WINDOW_SIZE, VECTOR_SIZE, vocabulary_size, output_head)
+        X = words[:, 1:]
+    else:
+        word_vectors = random.random((vocabulary_size, VECTOR_SIZE), dtype=np.float32)
+        model = BlogClassifier(VECTOR_SIZE, vocabulary_size, WINDOW_SIZE, word_vectors, 1000, output_head)
+        # PV-DM samples start with the paragraph id
+        X = np.column_stack([paragraphs, words[:, 1:]])
+
+    def train_on_batch(rows):
+        # The batches as the input pipeline maps them for model.fit, without the reads and the shuffling
+        x, y = model._to_model({"X": X[rows].astype(np.int32), "y": words[rows, 0].astype(np.int32)})
+        return model.model.train_on_batch(x, y)
+
+    # The first batch builds the training function, it's left out of the timing
+    train_on_batch(slice(0, BATCH_SIZE))
+    start = time.perf_counter()
+    for i in range(batches):
+        train_on_batch(slice(i * BATCH_SIZE, (i + 1) * BATCH_SIZE))
+    elapsed = time.perf_counter() - start
+    # Peak resident set size, in kilobytes on Linux
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    vocabulary_size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    batches = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    context = get_context("spawn")
+    print(f"vocabulary size: {vocabulary_size}, {batches} batches of {BATCH_SIZE}")
+    for model_name in ("cbow", "pv-dm"):
+        baseline = None
+        for output_head in ("softmax", "sampled_softmax", "negative_sampling"):
+            with context.Pool(1) as pool:
+                elapsed, peak_mb = pool.apply(_epoch, (model_name, output_head, vocabulary_size, batches))
+            baseline = baseline or elapsed
+            print(
+                f"{model_name:6} {output_head:18} epoch: {elapsed:7.2f} s ({baseline / elapsed:4.1f}x), "
+                f"peak memory: {peak_mb:8.0f} MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
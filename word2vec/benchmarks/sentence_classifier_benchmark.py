@@ -0,0 +1,86 @@
+import resource
+import sys
+import time
+from multiprocessing import get_context
+import numpy as np
+
+VECTOR_SIZE = 100
+CLASSES = 6
+BATCH_SIZE = 100
+
+
+def _separate_tables_model(vocabulary_size, word_vectors):
+    # The classifier as it was before the tables were shared: a trainable and a frozen table per branch
+    from keras import Input, Model
+    from keras.layers import Conv1D, MaxPool1D
+    from keras.layers.core import Dense, Flatten
+    from keras.layers.core.embedding import Embedding
+    from keras.layers.merging import Concatenate
+    from keras.optimizers import RMSprop
+
+    branches = []
+    inputs = []
+    for length in (2, 3):
+        ngram_input = Input((length,), dtype="int32")
+        inputs.append(ngram_input)
+        tables = [
+            Embedding(vocabulary_size, VECTOR_SIZE, weights=[word_vectors], trainable=trainable)(ngram_input)
+            for trainable in (True, False)
+        ]
+        conv = Conv1D(filters=20, kernel_size=4, activation="relu")(Concatenate(axis=1)(tables))
+        branches.append(Flatten()(MaxPool1D(pool_size=2, padding="same")(conv)))
+    output = Dense(CLASSES, activation="softmax")(Concatenate(axis=1)(branches))
+    model = Model(inputs=inputs, outputs=output)
+    model.compile(loss="categorical_crossentropy", optimizer=RMSprop(learning_rate=0.001))
+    return model
+
+
+def _epoch(layout, vocabulary_size, batches):
+    # Runs in a process of its own, so that the peak memory is that of one model only
+    import tensorflow as tf
+    from app.sentence_classifier import SentenceClassifier
+
+    random = np.random.default_rng(0)
+    word_vectors = random.random((vocabulary_size, VECTOR_SIZE), dtype=np.float32)
+    if layout == "shared":
+        model = SentenceClassifier(VECTOR_SIZE, vocabulary_size, word_vectors, CLASSES).model
+    else:
+        model = _separate_tables_model(vocabulary_size, word_vectors)
+    del word_vectors
+    # Zipfian word ids, like those of a vocabulary sorted by descending count
+    words = np.minimum(random.zipf(1.2, (batches * BATCH_SIZE, 3)), vocabulary_size - 1).astype(np.int32)
+    labels = tf.one_hot(random.integers(0, CLASSES, batches * BATCH_SIZE), CLASSES)
+
+    def train_on_batch(rows):
+        return model.train_on_batch((words[rows, :2], words[rows]), labels[rows.start:rows.stop])
+
+    # The first batch builds the training function, it's left out of the timing
+    train_on_batch(slice(0, BATCH_SIZE))
+    start = time.perf_counter()
+    for i in range(batches):
+        train_on_batch(slice(i * BATCH_SIZE, (i + 1) * BATCH_SIZE))
+    elapsed = time.perf_counter() - start
+    trainable = int(sum(np.prod(weight.shape) for weight in model.trainable_weights))
+    frozen = int(sum(np.prod(weight.shape) for weight in model.non_trainable_weights))
+    # Peak resident set size, in kilobytes on Linux
+    return trainable, frozen, elapsed / batches, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    vocabulary_size = int(sys.argv[1]) if len(sys.argv) > 1 else 400000
+    batches = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    context = get_context("spawn")
+    print(f"vocabulary size: {vocabulary_size}, {batches} batches of {BATCH_SIZE}")
+    for layout in ("separate", "shared"):
+        with context.Pool(1) as pool:
+            trainable, frozen, step, peak_mb = pool.apply(_epoch, (layout, vocabulary_size, batches))
+        # RMSprop keeps one slot per trainable weight
+        print(
+            f"{layout:8} tables: {trainable:11,} trainable + {frozen:11,} frozen parameters, "
+            f"{(2 * trainable + frozen) * 4 / 2 ** 20:7.0f} MB with optimizer slots, "
+            f"step: {step * 1000:6.2f} ms, peak memory: {peak_mb:6.0f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import sys
+import time
+import threading
+import numpy as np
+from app.sentiment_analyser import SentimentAnalyser
+from app.sentence_classifier_weights import LAYERS
+
+VECTOR_SIZE = 100
+CLASSES = 6
+MESSAGES = 2048
+
+
+class _Tokenizer(object):
+    # Words are their ids, like texts_to_sequences of a tokenizer would make them
+    def texts_to_sequences(self, texts):
+        return [[int(word) for word in text.split()] for text in texts]
+
+
+def _weights(vocabulary_size):
+    random = np.random.default_rng(0)
+    weights = {
+        layer: [random.normal(0, 0.1, (vocabulary_size, VECTOR_SIZE)).astype(np.float32)] for layer in LAYERS[:2]
+    }
+    for conv in ("bigram_conv", "trigram_conv"):
+        weights[conv] = [random.normal(0, 0.1, (4, VECTOR_SIZE, 20)).astype(np.float32), np.zeros(20)]
+    weights["sentence_classes"] = [random.normal(0, 0.1, (60, CLASSES)).astype(np.float32), np.zeros(CLASSES)]
+    return weights
+
+
+def _batched(analyser, messages, batch_size):
+    start = time.perf_counter()
+    for batch in range(0, len(messages), batch_size):
+        analyser.predict(messages[batch:batch + batch_size])
+    return len(messages) / (time.perf_counter() - start)
+
+
+def _concurrent(analyser, messages, clients):
+    # clients threads, each analysing its share of the messages one after the other
+    latencies = []
+
+    def client(share):
+        for message in share:
+            start = time.perf_counter()
+            analyser.analyse(message)
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(messages[i::clients],)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return len(messages) / elapsed, np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000
+
+
+def main():
+    vocabulary_size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    weights = _weights(vocabulary_size)
+    random = np.random.default_rng(1)
+    # Chat messages of 1 to 20 known words
+    messages = [
+        " ".join(str(word) for word in random.integers(2, vocabulary_size, random.integers(1, 21)))
+        for _ in range(MESSAGES)
+    ]
+    print(f"{vocabulary_size} words of {VECTOR_SIZE}, {MESSAGES} messages")
+    analyser = SentimentAnalyser(_Tokenizer(), weights)
+    for batch_size in (1, 8, 32, 128, 512):
+        print(f"predict, batches of {batch_size:3}        : {_batched(analyser, messages, batch_size):9.0f} messages/s")
+    for max_wait in (0.0, 0.001, 0.002):
+        for clients in (1, 8, 64):
+            with SentimentAnalyser(_Tokenizer(), weights, max_wait=max_wait) as analyser:
+                throughput, p50, p99 = _concurrent(analyser, messages, clients)
+            print(f"analyse, {clients:2} clients, wait {max_wait * 1000:.0f} ms: {throughput:9.0f} messages/s, "
+                  f"latency p50 {p50:6.2f} ms p99 {p99:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 import unittest
 import logging
 from os import path
-from app.pvdm_classifier import batch
+import numpy as np
+from app.pvdm_classifier import BlogClassifier, batch
+from app.sampled_output import SampledOutput
 
 
 class BlogClassifierTest(unittest.TestCase):
@@ -26,3 +28,17 @@ class BlogClassifierTest(unittest.TestCase):
             self.logger.info(f"\nparagraph_ids:\n{paragraph_ids},\ncontext_word_ids:\n{context_word_ids}\n" +
                              f"focus_word_ids:\n{focus_word_ids}")
         pass
+
+    def test_sampled_unigrams(self):
+        # With word counts the sampled output head samples words by count, like the one of CBOW
+        word_counts = np.arange(20, 0, -1)
+        for counts in (word_counts, None):
+            classifier = BlogClassifier(vector_size=8, vocabulary_size=20, window_size=2,
+                                        word_vectors=np.zeros((20, 8), dtype=np.float32), num_paragraphs=4,
+                                        output_head="sampled_softmax", num_sampled=4, word_counts=counts)
+            output = [layer for layer in classifier.model.layers if isinstance(layer, SampledOutput)][0]
+            self.assertEqual(None if counts is None else counts.tolist(), output.word_counts)
+            loss = classifier.model.train_on_batch(
+                x=[np.arange(4), np.ones((4, 4), dtype=np.int32), np.arange(4)], y=np.zeros(4)
+            )
+            self.assertTrue(np.isfinite(loss))
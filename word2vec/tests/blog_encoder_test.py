@@ -0,0 +1,50 @@
+import unittest
+import logging
+import tempfile
+from os import path, makedirs
+import numpy as np
+from app.preprocessing.blog_encoder import BlogEmbeddings, BlogEncoder
+from app.preprocessing.training_data.vocabulary import Vocabulary, OOV_TOKEN
+
+WORDS = ["kafka", "streams", "spring", "boot", "docker"]
+
+
+class BlogEncoderTest(unittest.TestCase):
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.DEBUG)
+
+    def test_encode_blogs(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            blog_dir = path.join(tmp_dir, "blogs")
+            makedirs(blog_dir)
+            with open(path.join(blog_dir, "kafka.md"), "w") as blog:
+                blog.write("---\ntitle: Kafka\n---\nKafka streams with <b>Spring</b> Boot\n```\ndocker run\n```\n")
+            with open(path.join(blog_dir, "docker.md"), "w") as blog:
+                blog.write("Docker and Kubernetes\n")
+            vocabulary_file = path.join(tmp_dir, "dictionary.vocab")
+            vocabulary = Vocabulary.from_words(["", OOV_TOKEN] + WORDS, np.arange(len(WORDS) + 2)[::-1].copy())
+            vocabulary.save(vocabulary_file)
+            vectors = np.random.default_rng(0).normal(size=(len(WORDS) + 2, 8)).astype(np.float32)
+            vectors[:2] = 0
+            vectors_file = path.join(tmp_dir, "vectors.npy")
+            np.save(vectors_file, vectors)
+            store_file = path.join(tmp_dir, "blog_embeddings.h5")
+            encoder = BlogEncoder(blog_dir, store_file, vectors_file, vocabulary_file, path.join(tmp_dir, "manifests"))
+            encoder.encode_blogs()
+            with BlogEmbeddings(store_file) as blog_embeddings:
+                self.assertEqual(["docker.md", "kafka.md"], blog_embeddings.names)
+                for name in blog_embeddings.names:
+                    expected = encoder.encode_blog(path.join(blog_dir, name))
+                    self.assertEqual(np.float32, blog_embeddings[name].dtype)
+                    np.testing.assert_array_equal(expected, blog_embeddings[name])
+                # Code blocks aren't encoded, unknown words get the (zero) out-of-vocabulary row
+                kafka = blog_embeddings["kafka.md"]
+                self.assertTrue(any(np.array_equal(row, vectors[2]) for row in kafka))
+                self.assertFalse(any(np.array_equal(row, vectors[6]) for row in kafka))
+                docker = blog_embeddings["docker.md"]
+                np.testing.assert_array_equal(vectors[6], docker[0])
+                self.assertFalse(docker[1:].any())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import unittest
+import tempfile
+import logging
+import json
+from os import path
+import numpy as np
+from app.blog_finder import BlogFinder
+from app.preprocessing.training_data.vocabulary import Vocabulary
+
+VOCABULARY_SIZE = 500
+VECTOR_SIZE = 16
+BLOGS = 20
+
+
+def _word(i):
+    # Letters only, the cleaning removes digits
+    return "word" + "".join(chr(ord("a") + int(digit)) for digit in str(i))
+
+
+def _blog_finder(paragraph_vectors=None, **kwargs):
+    random = np.random.default_rng(0)
+    words = ["", "<OOV>"] + [_word(i) for i in range(VOCABULARY_SIZE - 2)]
+    vocabulary = Vocabulary.from_words(words, np.arange(VOCABULARY_SIZE)[::-1].copy())
+    word_vectors = random.normal(0, 0.3, (VOCABULARY_SIZE, VECTOR_SIZE)).astype(np.float32)
+    word_vectors[0] = 0
+    output_weights = random.normal(0, 0.3, (VECTOR_SIZE, VOCABULARY_SIZE)).astype(np.float32)
+    output_biases = np.zeros(VOCABULARY_SIZE, dtype=np.float32)
+    # Two paragraphs per blog post
+    docs = {f"blog{i}.md": [2 * i, 2 * i + 1] for i in range(BLOGS)}
+    if paragraph_vectors is None:
+        paragraph_vectors = _random_paragraph_vectors()
+    return BlogFinder(
+        vocabulary, word_vectors, output_weights, output_biases, paragraph_vectors, docs, 2, **kwargs
+    )
+
+
+def _random_paragraph_vectors():
+    return np.random.default_rng(3).normal(size=(2 * BLOGS, VECTOR_SIZE))
+
+
+def _paragraphs(seed=1):
+    random = np.random.default_rng(seed)
+    return [
+        " ".join(_word(i).title() for i in random.integers(0, VOCABULARY_SIZE - 2, 40)) for _ in range(2 * BLOGS)
+    ]
+
+
+class BlogFinderTest(unittest.TestCase):
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.DEBUG)
+
+    def test_gradient(self):
+        # Over the whole vocabulary, and over candidate words only
+        for candidates in (None, 50):
+            blog_finder = _blog_finder(candidates=candidates)
+            ids, offsets = blog_finder.encode(_paragraphs()[:3])
+            vectors = np.random.default_rng(2).normal(size=(3, VECTOR_SIZE)).astype(np.float64)
+            samples = blog_finder._samples(ids, offsets, vectors)
+            losses, gradient = blog_finder._loss_and_gradient(vectors, *samples)
+            for dimension in range(3):
+                shifted = vectors.copy()
+                shifted[:, dimension] += 1e-4
+                numeric = (blog_finder._loss_and_gradient(shifted, *samples)[0] - losses) / 1e-4
+                np.testing.assert_allclose(numeric, gradient[:, dimension], rtol=1e-2, atol=1e-4)
+        # At the starting vectors the loss over the candidates is the loss over the whole vocabulary
+        exact = _blog_finder(candidates=None)
+        np.testing.assert_allclose(
+            exact._loss_and_gradient(vectors, *exact._samples(ids, offsets, vectors))[0], losses, rtol=1e-4
+        )
+
+    def test_inference(self):
+        paragraphs = _paragraphs()
+        # Paragraph vectors as PV-DM would have trained them, by inferring them from the paragraphs
+        blog_finder = _blog_finder(_blog_finder().query_vectors(paragraphs))
+        ids, offsets = blog_finder.encode(paragraphs)
+        averages = blog_finder.query_vectors(paragraphs, "average")
+        samples = blog_finder._samples(ids, offsets, averages)
+        inferred = blog_finder.query_vectors(paragraphs)
+        self.assertLess(
+            blog_finder._loss_and_gradient(inferred, *samples)[0].mean(),
+            blog_finder._loss_and_gradient(averages, *samples)[0].mean(),
+        )
+        # Half of a paragraph mostly finds its blog post, though the weights are random
+        halves = [" ".join(paragraph.split()[:20]) for paragraph in paragraphs]
+        found = blog_finder.find(halves, k=3)
+        hits = [blogs[0][0] == f"blog{i // 2}.md" for i, blogs in enumerate(found)]
+        self.assertGreater(np.mean(hits), 0.75)
+        self.assertTrue(all(len(blogs) == 3 for blogs in found))
+        # A batch finds what the messages would one at a time
+        single = blog_finder.find(halves[5:6], k=3)[0]
+        self.assertEqual([blog for blog, _ in found[5]], [blog for blog, _ in single])
+        np.testing.assert_allclose([score for _, score in found[5]], [score for _, score in single], rtol=1e-5)
+
+    def test_find(self):
+        blog_finder = _blog_finder()
+        found = blog_finder.find(["", "unknown words only", "wordd worde wordf"], k=4, method="average")
+        self.assertEqual([], found[0])
+        self.assertEqual([], found[1])
+        scores = [score for _, score in found[2]]
+        self.assertEqual(sorted(scores, reverse=True), scores)
+        summed = blog_finder.find(["wordd worde wordf"], k=BLOGS, method="average", aggregate="sum")[0]
+        self.assertEqual(BLOGS, len(summed))
+        self.assertGreaterEqual(max(score for _, score in summed), scores[0])
+        with self.assertRaises(ValueError):
+            blog_finder.find(["wordd"], aggregate="mean")
+
+    def test_load(self):
+        blog_finder = _blog_finder()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            inference_file = path.join(temp_dir, "pv-dm_inference.npz")
+            np.savez(
+                inference_file, paragraph_vectors=_random_paragraph_vectors(),
+                word_vectors=blog_finder.word_vectors, output_weights=blog_finder.output_weights,
+                output_biases=blog_finder.output_biases,
+            )
+            doc_to_paragraph_ids_file = path.join(temp_dir, "doc_to_paragraph_ids.json")
+            with open(doc_to_paragraph_ids_file, "w") as doc_to_paragraph_ids:
+                json.dump({f"blog{i}.md": [2 * i, 2 * i + 1] for i in range(BLOGS)}, doc_to_paragraph_ids)
+            loaded = BlogFinder.load(inference_file, doc_to_paragraph_ids_file, blog_finder.vocabulary, 2)
+        messages = ["wordb wordc wordd", "wordh wordi"]
+        self.assertEqual(blog_finder.find(messages), loaded.find(messages))
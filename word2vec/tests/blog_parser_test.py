@@ -1,7 +1,8 @@
 import unittest
 import logging
-from os import path
-from app.preprocessing.parsing.blog_parser import BlogParser
+import tempfile
+from os import path, makedirs
+from app.preprocessing.parsing.blog_parser import BlogParser, remove_links, remove_tags
 
 
 class BlogParserTest(unittest.TestCase):
@@ -15,3 +16,33 @@ class BlogParserTest(unittest.TestCase):
         for line in parsed_blog_lines:
             self.logger.info(line)
 
+    def test_remove_tags(self):
+        # The character before a tag goes with it, also when the tag follows another one
+        self.assertEqual("Somebol text", remove_tags("Some <b>bold</b> text"))
+        self.assertEqual("Alinebreak", remove_tags("A  <br/><br/>linebreak"))
+        self.assertEqual("tex", remove_tags("<p>text</p>"))
+        # Nothing is removed after a ">" without a "<" before it
+        self.assertEqual("1 > 0 <b>bold</b>", remove_tags("1 > 0 <b>bold</b>"))
+        # Tags of html heavy lines don't recurse
+        self.assertEqual("text", remove_tags("<i>" * 100000 + "text"))
+
+    def test_remove_links(self):
+        self.assertEqual("See [the docs] and [this]", remove_links("See [the docs](http://a.b/c) and [this](d.html)"))
+        self.assertEqual("No links (really)", remove_links("No links (really)"))
+        self.assertEqual("[a] b", remove_links("[a](x) b"))
+
+    def test_parse_blog_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            blog_dir = path.join(tmp_dir, "blogs")
+            makedirs(blog_dir)
+            makedirs(path.join(tmp_dir, "parsed"))
+            for i in range(3):
+                with open(path.join(blog_dir, f"blog{i}.md"), "w") as blog:
+                    blog.write(f"---\ntitle: Blog {i}\n---\nRead  <b>the</b> [docs](http://x.y/{i})\n")
+                    blog.write("```java\nint i = 0;\n```\nThe end\n")
+            parser = BlogParser(blog_dir, target_dir=path.join(tmp_dir, "parsed"),
+                                manifest_dir=path.join(tmp_dir, "manifests"))
+            parser.parse_blog_files(workers=2)
+            for i in range(3):
+                with open(path.join(tmp_dir, "parsed", f"blog{i}.md")) as parsed:
+                    self.assertEqual("Readth [docs]\nThe end\n", parsed.read())
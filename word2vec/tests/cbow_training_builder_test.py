@@ -1,4 +1,5 @@
 import unittest
+import tempfile
 from os import path
 import logging
 from app.preprocessing.training_data.cbow_training_builder import CbowTrainingBuilder
@@ -10,18 +11,19 @@ class CbowTrainingBuilderTest(unittest.TestCase):
 
     def test_generate_cbow_training_samples(self):
         dir_name = path.dirname(__file__)
-        self.training_data_builder = CbowTrainingBuilder(
-            source_dir=path.join(dir_name, "test_data"),
-            window_size=2,
-            tokenizer_file=path.join(dir_name, "test_data/training/dictionary.dat"),
-            tokenizer_json=None,
-            dry_run=True,
-        )
-        super(CbowTrainingBuilder, self.training_data_builder).tokenize()
-        vocabulary_size, X_y = self.training_data_builder.build_cbow_training_data()
-        self.logger.info(
-            f"CBOW training samples: {X_y}, vocabulary size: {vocabulary_size}"
-        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.training_data_builder = CbowTrainingBuilder(
+                source_dir=path.join(dir_name, "test_data/cleaned"),
+                window_size=2,
+                vocabulary_file=path.join(tmp_dir, "dictionary.vocab"),
+                dry_run=True,
+                manifest_dir=tmp_dir,
+            )
+            super(CbowTrainingBuilder, self.training_data_builder).tokenize()
+            vocabulary_size, X_y = self.training_data_builder.build_cbow_training_data()
+            self.logger.info(
+                f"CBOW training samples: {X_y}, vocabulary size: {vocabulary_size}"
+            )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,55 @@
+import unittest
+import tempfile
+import logging
+import os
+from os import path
+import numpy as np
+from app.checkpoint import Checkpoints, EarlyStopping, load_similarity_pairs, similarity_correlation
+from app.preprocessing.training_data.vocabulary import Vocabulary
+
+
+class CheckpointTest(unittest.TestCase):
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.DEBUG)
+
+    def test_checkpoints(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            checkpoints = Checkpoints(path.join(temp_dir, "run"), max_to_keep=2)
+            self.assertIsNone(checkpoints.load())
+            for step in range(4):
+                checkpoints.save(step, {"weights": np.full(3, step, dtype=np.float32)}, {"epoch": step, "seed": [1, 2]})
+            self.assertEqual([2, 3], checkpoints.steps())
+            self.assertEqual([], [file for file in os.listdir(checkpoints.directory) if file.endswith(".tmp")])
+            arrays, state = checkpoints.load()
+            np.testing.assert_array_equal(np.full(3, 3, dtype=np.float32), arrays["weights"])
+            self.assertEqual({"epoch": 3, "seed": [1, 2]}, state)
+            # A checkpoint that was being written when the run crashed is ignored
+            with open(checkpoints._file(4) + ".tmp", "wb") as broken:
+                broken.write(b"PK")
+            self.assertEqual(3, checkpoints.load()[1]["epoch"])
+
+    def test_early_stopping(self):
+        early_stopping = EarlyStopping(patience=2, min_delta=0.1)
+        stops = [early_stopping.update(epoch, loss) for epoch, loss in enumerate([3, 2, 1.95, 1.91])]
+        self.assertEqual([False, False, False, True], stops)
+        self.assertEqual((2, 1), (early_stopping.best, early_stopping.best_epoch))
+        similarity = EarlyStopping(patience=1, mode="max")
+        self.assertFalse(similarity.update(0, 0.3))
+        self.assertFalse(similarity.update(1, 0.4))
+        self.assertTrue(similarity.update(2, 0.35))
+        restored = EarlyStopping(patience=1, mode="max")
+        restored.restore(similarity.state())
+        self.assertEqual(1, restored.best_epoch)
+
+    def test_similarity_correlation(self):
+        vocabulary = Vocabulary.from_words(["", "<OOV>", "cat", "dog", "car"], np.array([0, 0, 3, 2, 1]))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            similarity_file = path.join(temp_dir, "similarity.txt")
+            with open(similarity_file, "w") as similarity:
+                similarity.write("# word1 word2 score\nWord 1\tWord 2\tHuman (mean)\ncat dog 8.5\ncat car 2.0\n"
+                                 "dog car 1.0\ncat unicorn 5.0\n")
+            pairs, scores = load_similarity_pairs(similarity_file, vocabulary)
+        np.testing.assert_array_equal([[2, 3], [2, 4], [3, 4]], pairs)
+        np.testing.assert_array_equal([8.5, 2.0, 1.0], scores)
+        embeddings = np.array([[0, 0], [0, 0], [1, 0], [1, -0.1], [0.5, 1]])
+        self.assertAlmostEqual(1.0, similarity_correlation(embeddings, pairs, scores))
@@ -0,0 +1,92 @@
+import unittest
+import logging
+import tempfile
+from itertools import chain
+from os import path
+import numpy as np
+from app.preprocessing.training_data.context_windows import context_windows
+from app.preprocessing.training_data.cbow_training_builder import CbowTrainingBuilder
+from app.preprocessing.training_data.pvdm_classifier_training_builder import PVDMClassifierTrainingBuilder
+
+
+# The sample generators as they were before context_windows, one Python list per sample
+def _cbow_samples(sample_text, window_size):
+    buffer = np.zeros(window_size, dtype=np.intc).tolist()
+    buffered_sampled_text = list(chain(buffer, sample_text, buffer))
+    for sample_text_pos, focus_word_id in enumerate(sample_text):
+        context_word_ids = np.zeros(window_size * 2, dtype=np.intc).tolist()
+        start = sample_text_pos - window_size
+        end = sample_text_pos + window_size + 1
+        context_word_index = 0
+        buffered_sampled_text_index = sample_text_pos
+        for i in range(start, end):
+            if i == sample_text_pos:
+                buffered_sampled_text_index += 1
+                continue
+            context_word_ids[context_word_index] = buffered_sampled_text[buffered_sampled_text_index]
+            context_word_index += 1
+            buffered_sampled_text_index += 1
+        yield context_word_ids, focus_word_id
+
+
+def _pvdm_samples(paragraph, paragraph_id, window_size):
+    for context_word_ids, focus_word_id in _cbow_samples(paragraph, window_size):
+        if focus_word_id == 0:
+            continue
+        yield [paragraph_id] + context_word_ids, focus_word_id
+
+
+class ContextWindowsTest(unittest.TestCase):
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.DEBUG)
+
+    def _lines(self, number_of_lines, seed=1):
+        random = np.random.default_rng(seed)
+        return [random.integers(1, 100, random.integers(0, 20)).tolist() for _ in range(number_of_lines)]
+
+    def test_same_as_cbow_generator(self):
+        for window_size in (1, 2, 5):
+            lines = self._lines(300)
+            expected = [sample for line in lines for sample in _cbow_samples(line, window_size)]
+            offsets = np.concatenate(([0], np.cumsum([len(line) for line in lines])))
+            X, y = context_windows(list(chain.from_iterable(lines)), offsets, window_size)
+            self.assertEqual([x for x, _ in expected], X.tolist())
+            self.assertEqual([focus_word_id for _, focus_word_id in expected], y.tolist())
+
+    def test_same_as_pvdm_generator(self):
+        # Only the window size of the builder is needed to build samples
+        builder = PVDMClassifierTrainingBuilder.__new__(PVDMClassifierTrainingBuilder)
+        builder.window_size = 3
+        paragraphs = self._lines(100, seed=2)
+        paragraph_ids = list(range(7, 107))
+        expected = [
+            sample
+            for paragraph, paragraph_id in zip(paragraphs, paragraph_ids)
+            for sample in _pvdm_samples(paragraph, paragraph_id, 3)
+        ]
+        X, y = builder._build_samples_for_paragraphs(paragraphs, paragraph_ids)
+        self.assertEqual([x for x, _ in expected], X.tolist())
+        self.assertEqual([focus_word_id for _, focus_word_id in expected], y.tolist())
+
+    def test_cbow_training_builder(self):
+        dir_name = path.dirname(__file__)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            builder = CbowTrainingBuilder(
+                source_dir=path.join(dir_name, "test_data/cleaned"),
+                window_size=2,
+                vocabulary_file=path.join(tmp_dir, "dictionary.vocab"),
+                dry_run=True,
+                manifest_dir=tmp_dir,
+            )
+            builder.tokenize()
+            _, X_y = builder.build_cbow_training_data()
+            expected = [
+                sample for line in builder.training_line_generator()
+                for sample in _cbow_samples(builder.line_to_word_ids(line), 2)
+            ]
+            self.assertEqual([x for x, _ in expected], X_y["X"])
+            self.assertEqual([focus_word_id for _, focus_word_id in expected], X_y["y"])
+
+
+if __name__ == "__main__":
+    unittest.main()
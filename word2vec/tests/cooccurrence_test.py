@@ -0,0 +1,71 @@
+import unittest
+import logging
+from collections import Counter
+import numpy as np
+from app.preprocessing.training_data.cooccurrence import CooccurrenceCounter
+
+
+def _count_pairs(lines, window_size, distance_weighting=False):
+    # Every pair of positions within the window, the way the co-occurrences used to be counted line by line
+    counts = Counter()
+    for word_ids in lines:
+        for pos_i, word_i in enumerate(word_ids):
+            for pos_j, word_j in enumerate(word_ids):
+                distance = abs(pos_i - pos_j)
+                if 0 < distance <= window_size:
+                    counts[(word_i, word_j)] += 1.0 / distance if distance_weighting else 1.0
+    return counts
+
+
+class CooccurrenceCounterTest(unittest.TestCase):
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.DEBUG)
+
+    def _lines(self, vocabulary_size, number_of_lines, seed=1):
+        random = np.random.default_rng(seed)
+        return [random.integers(1, vocabulary_size, random.integers(0, 30)).tolist() for _ in range(number_of_lines)]
+
+    def _count(self, counter, lines, batch_lines):
+        for start in range(0, len(lines), batch_lines):
+            batch = lines[start:start + batch_lines]
+            offsets = np.concatenate(([0], np.cumsum([len(line) for line in batch])))
+            counter.update(np.array([word_id for line in batch for word_id in line], dtype=np.int32), offsets)
+        pairs = [pair for pairs, _ in counter.pairs(chunk_entries=50) for pair in pairs.tolist()]
+        counts = [count for _, counts in counter.pairs(chunk_entries=50) for count in counts.tolist()]
+        return pairs, counts
+
+    def test_count(self):
+        lines = self._lines(vocabulary_size=40, number_of_lines=200)
+        expected = _count_pairs(lines, window_size=3)
+        with CooccurrenceCounter(40, 3) as counter:
+            pairs, counts = self._count(counter, lines, batch_lines=7)
+        self.assertEqual(sorted(expected), [tuple(pair) for pair in pairs])
+        self.assertEqual([expected[tuple(pair)] for pair in pairs], counts)
+
+    def test_spill_and_merge(self):
+        lines = self._lines(vocabulary_size=300, number_of_lines=500)
+        expected = _count_pairs(lines, window_size=5, distance_weighting=True)
+        # A budget of a few hundred pairs: shards are spilled to disk every few batches
+        with CooccurrenceCounter(300, 5, distance_weighting=True, memory_budget=16 * 400) as counter:
+            pairs, counts = self._count(counter, lines, batch_lines=10)
+            self.assertGreater(len(counter._spilled), 1)
+        self.assertEqual(sorted(expected), [tuple(pair) for pair in pairs])
+        np.testing.assert_allclose([expected[tuple(pair)] for pair in pairs], counts)
+
+    def test_key_ranges(self):
+        lines = self._lines(vocabulary_size=300, number_of_lines=500)
+        with CooccurrenceCounter(300, 5, memory_budget=16 * 400) as counter:
+            pairs, counts = self._count(counter, lines, batch_lines=10)
+            key_ranges = counter.key_ranges(8)
+            ranged = [
+                (pair, count)
+                for lower, upper in key_ranges
+                for range_pairs, range_counts in counter.pairs(chunk_entries=50, lower=lower, upper=upper)
+                for pair, count in zip(range_pairs.tolist(), range_counts.tolist())
+            ]
+        self.assertEqual(8, len(key_ranges))
+        self.assertEqual(list(zip(pairs, counts)), ranged)
+
+
+if __name__ == "__main__":
+    unittest.main()
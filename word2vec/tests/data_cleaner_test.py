@@ -1,7 +1,10 @@
 import unittest
 import logging
-from os import path
-from app.preprocessing.cleaning.data_cleaner import DataCleaner
+import os
+import shutil
+import tempfile
+from os import path, listdir
+from app.preprocessing.cleaning.data_cleaner import DataCleaner, file_chunks, read_line_range
 
 
 class DataCleanerTest(unittest.TestCase):
@@ -14,3 +17,54 @@ class DataCleanerTest(unittest.TestCase):
         cleaned_lines = cleaner.clean_file(path.join(dir_name, "test_data/parsed/uncleaned.txt"))
         for line in cleaned_lines:
             self.logger.debug(line)
+
+    def test_read_line_range(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dirty_file = path.join(tmp_dir, "dirty.txt")
+            with open(dirty_file, "wb") as f:
+                f.write("first line\r\nsecond ´line\rthird\n\nlast line without newline".encode("utf-8"))
+            with open(dirty_file, encoding="utf-8", errors="ignore") as f:
+                expected_lines = list(f)
+            for chunk_size in [1, 2, 5, 13, 100]:
+                lines = [line for start, end in file_chunks(dirty_file, chunk_size)
+                         for line in read_line_range(dirty_file, start, end)]
+                self.assertEqual(expected_lines, lines, msg=f"chunk size: {chunk_size}")
+
+    def test_clean_files_in_parallel(self):
+        dir_name = path.dirname(__file__)
+        blog_dir = path.join(dir_name, "../data/1_raw/blogs")
+        blog_files = sorted(listdir(blog_dir))[:6]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source_dir = path.join(tmp_dir, "parsed")
+            os.mkdir(source_dir)
+            for blog_file in blog_files:
+                shutil.copy(path.join(blog_dir, blog_file), source_dir)
+            for target_dir, workers in [("sequential", 1), ("parallel", 3)]:
+                os.mkdir(path.join(tmp_dir, target_dir))
+                cleaner = DataCleaner(source_dir=source_dir, target_dir=path.join(tmp_dir, target_dir),
+                                      manifest_dir=path.join(tmp_dir, target_dir + "_manifests"))
+                cleaner.clean_files(workers=workers, chunk_size=2048)
+            for blog_file in blog_files:
+                with open(path.join(tmp_dir, "sequential", blog_file)) as sequential, \
+                        open(path.join(tmp_dir, "parallel", blog_file)) as parallel:
+                    self.assertEqual(sequential.read(), parallel.read())
+            self.assertEqual(sorted(blog_files), sorted(listdir(path.join(tmp_dir, "parallel"))))
+
+    def test_clean_files_incrementally(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source_dir = path.join(tmp_dir, "parsed")
+            target_dir = path.join(tmp_dir, "cleaned")
+            os.mkdir(source_dir)
+            os.mkdir(target_dir)
+            for name in ["one.txt", "two.txt"]:
+                with open(path.join(source_dir, name), "w") as f:
+                    f.write(f"this is file {name} with some words\n")
+            cleaner = DataCleaner(source_dir=source_dir, target_dir=target_dir, manifest_dir=tmp_dir)
+            cleaner.clean_files()
+            with open(path.join(source_dir, "two.txt"), "w") as f:
+                f.write("the second file has been edited\n")
+            os.remove(path.join(source_dir, "one.txt"))
+            cleaner.clean_files()
+            self.assertEqual(["two.txt"], listdir(target_dir))
+            with open(path.join(target_dir, "two.txt")) as f:
+                self.assertEqual("second file has been edited\n", f.read())
@@ -0,0 +1,79 @@
+import unittest
+import tempfile
+import logging
+import json
+from os import path
+import numpy as np
+from app.embedding_index import EmbeddingIndex
+from app.preprocessing.training_data.vocabulary import Vocabulary
+
+
+def _clustered_vectors(rows=5000, clusters=50, vector_size=32, seed=0):
+    random = np.random.default_rng(seed)
+    centers = random.normal(size=(clusters, vector_size))
+    return (centers[random.integers(0, clusters, rows)] + 0.3 * random.normal(size=(rows, vector_size))).astype(
+        np.float32)
+
+
+def _brute_force(vectors, queries, k):
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    scores = queries @ vectors.T
+    return np.argsort(-scores, axis=1)[:, :k], np.sort(scores, axis=1)[:, ::-1][:, :k]
+
+
+class EmbeddingIndexTest(unittest.TestCase):
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.DEBUG)
+
+    def test_exact_search(self):
+        vectors = _clustered_vectors()
+        queries = _clustered_vectors(100, seed=1)
+        expected_ids, expected_scores = _brute_force(vectors, queries, 10)
+        # Blocks and query batches smaller than the vectors and the queries
+        ids, scores = EmbeddingIndex(vectors, block_size=700).search(queries, 10, query_batch=32)
+        np.testing.assert_allclose(expected_scores, scores, rtol=1e-5)
+        np.testing.assert_array_equal(expected_ids[:, 0], ids[:, 0])
+
+    def test_approximate_search(self):
+        vectors = _clustered_vectors()
+        queries = _clustered_vectors(100, seed=1)
+        expected_ids, _ = _brute_force(vectors, queries, 10)
+        index = EmbeddingIndex(vectors, lists=50)
+        self.assertEqual(len(vectors), index.list_offsets[-1])
+        ids, scores = index.search(queries, 10, probes=5)
+        recall = np.mean([len(set(expected) & set(found)) / 10 for expected, found in zip(expected_ids, ids)])
+        self.logger.info(f"Recall@10 probing 5 of 50 lists: {recall}")
+        self.assertGreater(recall, 0.9)
+        self.assertTrue(np.all(np.diff(scores, axis=1) <= 0))
+        # Without probes the search is exact
+        np.testing.assert_array_equal(expected_ids[:, 0], index.search(queries, 10)[0][:, 0])
+
+    def test_save_load(self):
+        index = EmbeddingIndex(_clustered_vectors(500), np.arange(100, 600), [str(i) for i in range(500)], lists=8)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            index_file = path.join(temp_dir, "words.index.npz")
+            index.save(index_file)
+            loaded = EmbeddingIndex.load(index_file)
+        queries = _clustered_vectors(10, seed=1)
+        for probes in (None, 2):
+            for expected, actual in zip(index.search(queries, 5, probes), loaded.search(queries, 5, probes)):
+                np.testing.assert_array_equal(expected, actual)
+        self.assertEqual("7", loaded.key(107))
+
+    def test_word_and_paragraph_vectors(self):
+        vocabulary = Vocabulary.from_words(["", "<OOV>", "cat", "dog", "car"], np.array([0, 0, 3, 2, 1]))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            word_vectors_file = path.join(temp_dir, "word_vectors.npy")
+            np.save(word_vectors_file, np.array([[[0, 0], [1, 1], [1, 0], [1, 0.1], [0, 1]]]))
+            words = EmbeddingIndex.from_word_vectors(word_vectors_file, vocabulary)
+            paragraph_vectors_file = path.join(temp_dir, "paragraph_embeddings_0.npy")
+            np.save(paragraph_vectors_file, np.array([[[1, 0], [0, 1], [0.9, 0.1], [0.1, 0.9]]]))
+            doc_to_paragraph_ids_file = path.join(temp_dir, "doc_to_paragraph_ids.json")
+            with open(doc_to_paragraph_ids_file, "w") as doc_to_paragraph_ids:
+                json.dump({"a.txt": [0, 2], "b.txt": [1], "c.txt": [3]}, doc_to_paragraph_ids)
+            blogs = EmbeddingIndex.from_paragraph_vectors(paragraph_vectors_file, doc_to_paragraph_ids_file)
+        ids, _ = words.search(np.array([1, 0]), 2)
+        np.testing.assert_array_equal([[2, 3]], ids)
+        self.assertEqual("dog", words.key(3))
+        self.assertEqual(["a.txt", "c.txt"], [blog for blog, _ in blogs.nearest_keys(np.array([0.8, 0.2]), 2)])
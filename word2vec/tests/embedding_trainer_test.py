@@ -0,0 +1,127 @@
+import unittest
+import tempfile
+import logging
+from os import path
+import numpy as np
+from app.embedding_trainer import CbowTrainer, GloveTrainer, SkipGramTrainer, _scatter_add
+from app.checkpoint import Checkpoints, EarlyStopping
+from app.preprocessing.training_data.training_data_file import TrainingData
+from app.preprocessing.training_data.skip_gram_pairs import SkipGramPairs
+from app.preprocessing.training_data.context_windows import context_windows
+from app.preprocessing.training_data.cooccurrence import CooccurrenceCounter
+
+VOCABULARY_SIZE = 42
+
+
+def _lines(number_of_lines=3000, seed=0):
+    # Words 2..21 and 22..41 never occur in the same line
+    random = np.random.default_rng(seed)
+    groups = random.integers(0, 2, number_of_lines)
+    lines = [2 + 20 * group + random.integers(0, 20, 8) for group in groups]
+    return np.concatenate(lines).astype(np.int32), np.arange(0, 8 * number_of_lines + 1, 8)
+
+
+def _similarities(embeddings):
+    vectors = embeddings[2:] / np.linalg.norm(embeddings[2:], axis=1, keepdims=True)
+    similarities = vectors @ vectors.T
+    same_group = np.kron(np.eye(2), np.ones((20, 20))).astype(bool)
+    np.fill_diagonal(same_group, False)
+    return similarities[same_group].mean(), similarities[~np.kron(np.eye(2), np.ones((20, 20))).astype(bool)].mean()
+
+
+class _Crash(Exception):
+    pass
+
+
+class _CrashingCheckpoints(Checkpoints):
+    # Checkpoints of a run that crashes right after saving its crash_after-th checkpoint
+    def __init__(self, directory, crash_after, **kwargs):
+        super().__init__(directory, **kwargs)
+        self.crash_after = crash_after
+
+    def save(self, step, arrays, state):
+        checkpoint_file = super().save(step, arrays, state)
+        self.crash_after -= 1
+        if self.crash_after == 0:
+            raise _Crash()
+        return checkpoint_file
+
+
+def _skip_gram_data():
+    counts = np.array([0, 0] + [100] * 40)
+    pairs, labels = SkipGramPairs(counts, 2, negative_samples=2, subsampling_threshold=None, seed=0).pairs(*_lines())
+    return TrainingData({"X": pairs, "y": labels})
+
+
+class EmbeddingTrainerTest(unittest.TestCase):
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.DEBUG)
+
+    def _train(self, trainer, training_data):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            losses = trainer.train(training_data, epochs=3, embeddings_file=path.join(temp_dir, "embeddings"))
+            embeddings = np.load(path.join(temp_dir, "embeddings_2.npy"))
+        self.assertEqual((VOCABULARY_SIZE, 16), embeddings.shape)
+        self.assertLess(losses[-1], losses[0])
+        same, other = _similarities(embeddings)
+        self.logger.info(f"{type(trainer).__name__}: losses {losses}, similarity {same} vs {other}")
+        self.assertGreater(same, other + 0.2)
+
+    def test_scatter_add(self):
+        random = np.random.default_rng(0)
+        rows = random.integers(0, 10, 100)
+        values = random.random((100, 3))
+        expected = np.zeros((10, 3))
+        np.add.at(expected, rows, values)
+        actual = np.zeros((10, 3))
+        _scatter_add(actual, rows, values)
+        np.testing.assert_allclose(expected, actual)
+
+    def test_skip_gram(self):
+        self._train(SkipGramTrainer(VOCABULARY_SIZE, 16, threads=2, batch_size=512), _skip_gram_data())
+
+    def test_cbow(self):
+        X, y = context_windows(*_lines(), window_size=2)
+        training_data = TrainingData({"X": X, "y": y})
+        counts = np.array([0, 0] + [100] * 40)
+        self._train(CbowTrainer(VOCABULARY_SIZE, 16, counts, threads=2, batch_size=512), training_data)
+
+    def test_glove(self):
+        with CooccurrenceCounter(VOCABULARY_SIZE, 2) as counter:
+            counter.update(*_lines())
+            pairs, counts = next(counter.pairs())
+        training_data = TrainingData(
+            {"X": pairs.astype(np.int32), "y": np.log(counts).astype(np.float32), "count": counts.astype(np.float32)}
+        )
+        self._train(GloveTrainer(VOCABULARY_SIZE, 16, threads=2, batch_size=64), training_data)
+
+    def test_resume(self):
+        # One thread, so that the run is deterministic: crashing in the middle of the second epoch and resuming
+        # from the last checkpoint ends up with the same vectors as a run that never stopped
+        training_data = _skip_gram_data()
+        uninterrupted = SkipGramTrainer(VOCABULARY_SIZE, 16, threads=1, batch_size=512)
+        losses = uninterrupted.train(training_data, epochs=2)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            crashing = _CrashingCheckpoints(temp_dir, crash_after=10, every=32, max_to_keep=2)
+            with self.assertRaises(_Crash):
+                SkipGramTrainer(VOCABULARY_SIZE, 16, threads=1, batch_size=512).train(training_data, 2, None, crashing)
+            checkpoints = Checkpoints(temp_dir, every=32, max_to_keep=2)
+            self.assertEqual(2, len(checkpoints.steps()))
+            self.assertGreater(checkpoints.load()[1]["shard"], 0)
+            resumed = SkipGramTrainer(VOCABULARY_SIZE, 16, threads=1, batch_size=512)
+            self.assertEqual(losses, resumed.train(training_data, 2, None, checkpoints))
+        np.testing.assert_array_equal(uninterrupted.word_vectors, resumed.word_vectors)
+        np.testing.assert_array_equal(uninterrupted.context_vectors, resumed.context_vectors)
+
+    def test_early_stopping(self):
+        training_data = _skip_gram_data()
+        early_stopping = EarlyStopping(patience=1, min_delta=1.0)
+        losses = SkipGramTrainer(VOCABULARY_SIZE, 16, threads=2, batch_size=512).train(
+            training_data, 10, early_stopping=early_stopping, held_out=len(training_data) // 10
+        )
+        self.assertLess(len(losses), 10)
+        self.assertEqual(len(losses) - 2, early_stopping.best_epoch)
+
+
+if __name__ == "__main__":
+    unittest.main()
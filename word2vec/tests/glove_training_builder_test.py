@@ -1,7 +1,9 @@
 import unittest
+import tempfile
 from os import path
 import logging
 import pickle
+import numpy as np
 from app.preprocessing.training_data.glove_training_builder import GloveTrainingBuilder
 
 
@@ -11,16 +13,21 @@ class GloveTrainingBuilderTest(unittest.TestCase):
 
     def test_generate_glove_training_samples(self):
         dir_name = path.dirname(__file__)
-        self.training_data_builder = GloveTrainingBuilder(
-            source_dir=path.join(dir_name, "test_data"),
-            window_size=2,
-            tokenizer_file=path.join(dir_name, "test_data/training/dictionary.dat"),
-            tokenizer_json=None,
-            dry_run=True,
-        )
-        super(GloveTrainingBuilder, self.training_data_builder).tokenize()
-        vocabulary_size, X_y = self.training_data_builder.build_glove_training_data()
-        self.logger.info(f"Word pairs: {X_y}")
-        # with open(path.join(dir_name, "test_train_data/glove_test.dat"), "wb") as f:
-        #     pickle.dump(X_y, f)
-        self.assertEqual(89, vocabulary_size)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.training_data_builder = GloveTrainingBuilder(
+                source_dir=path.join(dir_name, "test_data/cleaned"),
+                window_size=2,
+                vocabulary_file=path.join(tmp_dir, "dictionary.vocab"),
+                dry_run=True,
+                manifest_dir=tmp_dir,
+            )
+            super(GloveTrainingBuilder, self.training_data_builder).tokenize()
+            vocabulary_size, X_y = self.training_data_builder.build_glove_training_data()
+            self.logger.info(f"Word pairs: {X_y}")
+            # with open(path.join(dir_name, "test_train_data/glove_test.dat"), "wb") as f:
+            #     pickle.dump(X_y, f)
+            self.assertEqual(89, vocabulary_size)
+            self.assertEqual(len(X_y["X"]), len(X_y["count"]))
+            # The counts aren't capped, the log counts are (at 70% of the largest word count)
+            word_count_cap = max(1, int(self.training_data_builder.max_word_count() * 0.7))
+            np.testing.assert_allclose(np.log(np.minimum(word_count_cap, X_y["count"])), X_y["y"])
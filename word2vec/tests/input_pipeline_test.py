@@ -0,0 +1,61 @@
+import unittest
+import tempfile
+import logging
+import numpy as np
+from keras import Input, Model
+from keras.layers import Dense
+from app.checkpoint import Checkpoints, EarlyStopping
+from app.input_pipeline import TrainingCheckpoint, array_dataset, fit, scaled_learning_rate
+
+
+class InputPipelineTest(unittest.TestCase):
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.DEBUG)
+
+    def test_scaled_learning_rate(self):
+        self.assertAlmostEqual(scaled_learning_rate(0.001, 400, "linear"), 0.004)
+        self.assertAlmostEqual(scaled_learning_rate(0.001, 400, "sqrt"), 0.002)
+        self.assertAlmostEqual(scaled_learning_rate(0.001, 400, "none"), 0.001)
+        with self.assertRaises(ValueError):
+            scaled_learning_rate(0.001, 400, "cubic")
+
+    def test_array_dataset(self):
+        X = np.arange(1000, dtype=np.int32).reshape(-1, 2)
+        y = np.arange(500, dtype=np.int32)
+        dataset = array_dataset({"X": X, "y": y}, 64, lambda batch: (batch["X"], batch["y"]))
+        epochs = []
+        for _ in range(2):
+            batches = [(x.numpy(), labels.numpy()) for x, labels in dataset]
+            self.assertTrue(all(len(labels) == 64 for _, labels in batches[:-1]))
+            x = np.concatenate([x for x, _ in batches])
+            labels = np.concatenate([labels for _, labels in batches])
+            # Every row once per epoch, its columns kept together
+            np.testing.assert_array_equal(np.sort(labels), y)
+            np.testing.assert_array_equal(x, X[labels])
+            epochs.append(labels)
+        self.assertFalse(np.array_equal(epochs[0], y))
+        self.assertFalse(np.array_equal(epochs[0], epochs[1]))
+
+    def test_fit_checkpoints(self):
+        X = np.random.default_rng(0).random((640, 4), dtype=np.float32)
+        columns = {"X": X, "y": X.sum(axis=1)}
+
+        def model():
+            inputs = Input((4,))
+            result = Model(inputs=inputs, outputs=Dense(1)(inputs))
+            result.compile(loss="mse", optimizer="adam")
+            return result
+
+        def datasets(epoch):
+            return array_dataset(columns, 64, lambda batch: (batch["X"], batch["y"]), seed=epoch)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            checkpoints = Checkpoints(temp_dir, max_to_keep=2, every=4)
+            early_stopping = EarlyStopping(patience=1, min_delta=1000.0)
+            trained = model()
+            fit(trained, datasets, 5, checkpoints=checkpoints, early_stopping=early_stopping)
+            # The loss can't improve by 1000, so the second epoch is the last
+            self.assertEqual(0, early_stopping.best_epoch)
+            restored = model()
+            self.assertEqual((2, 0), TrainingCheckpoint(checkpoints, restored).restore())
+            np.testing.assert_array_equal(trained.get_weights()[0], restored.get_weights()[0])
@@ -0,0 +1,53 @@
+import unittest
+import logging
+import os
+import tempfile
+from os import path
+from app.preprocessing.manifest import StageManifest
+
+
+class StageManifestTest(unittest.TestCase):
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.DEBUG)
+
+    def _write(self, file_name, content):
+        with open(file_name, "w") as f:
+            f.write(content)
+
+    def test_is_up_to_date(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = path.join(tmp_dir, "source.txt")
+            target = path.join(tmp_dir, "target.txt")
+            self._write(source, "source")
+            self._write(target, "target")
+            manifest = StageManifest("test", tmp_dir)
+            self.assertFalse(manifest.is_up_to_date("source", [source], [target], {"window_size": 2}))
+            manifest.record("source", [source], [target], {"window_size": 2})
+            manifest.save()
+
+            manifest = StageManifest("test", tmp_dir)
+            self.assertTrue(manifest.is_up_to_date("source", [source], [target], {"window_size": 2}))
+            self.assertFalse(manifest.is_up_to_date("source", [source], [target], {"window_size": 3}))
+            self._write(target, "stale target")
+            self.assertFalse(manifest.is_up_to_date("source", [source], [target], {"window_size": 2}))
+            self._write(target, "target")
+            self._write(source, "edited source")
+            self.assertFalse(manifest.is_up_to_date("source", [source], [target], {"window_size": 2}))
+            os.remove(target)
+            self.assertFalse(manifest.is_up_to_date("source", [source], [target], {"window_size": 2}))
+
+    def test_forget(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = path.join(tmp_dir, "source.txt")
+            target = path.join(tmp_dir, "target.txt")
+            self._write(source, "source")
+            self._write(target, "target")
+            manifest = StageManifest("test", tmp_dir)
+            manifest.record("source", [source], [target])
+            manifest.forget("source", remove_outputs=True)
+            self.assertFalse(path.exists(target))
+            self.assertEqual([], manifest.keys())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+import logging
+import tempfile
+from os import path, makedirs
+from app.preprocessing.parsing.movie_parser import MovieParser, parse_id_list
+
+MOVIE_LINES = [
+    "L1045 +++$+++ u0 +++$+++ m0 +++$+++ BIANCA +++$+++ They do not!",
+    "L1044 +++$+++ u2 +++$+++ m0 +++$+++ CAMERON +++$+++ They do to!",
+    "L985 +++$+++ u0 +++$+++ m0 +++$+++ BIANCA +++$+++ I hope so.",
+    "L984 +++$+++ u2 +++$+++ m0 +++$+++ CAMERON +++$+++ She okay?",
+    "L925 +++$+++ u0 +++$+++ m0 +++$+++ BIANCA",
+]
+MOVIE_CONVERSATIONS = [
+    "u0 +++$+++ u2 +++$+++ m0 +++$+++ ['L1044', 'L1045']",
+    "u0 +++$+++ u2 +++$+++ m0 +++$+++ ['L984', 'L985', 'L925', 'L1']",
+    "u0 +++$+++ u2 +++$+++ m0 +++$+++ []",
+]
+
+
+class MovieParserTest(unittest.TestCase):
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.DEBUG)
+
+    def test_parse_id_list(self):
+        self.assertEqual(["L194", "L195"], parse_id_list("['L194', 'L195']\n"))
+        self.assertEqual(["L1"], parse_id_list('["L1",]'))
+        self.assertEqual([], parse_id_list("[]"))
+        with self.assertRaises(ValueError):
+            parse_id_list("__import__('os').system('ls')")
+
+    def test_parse_movie_conversations(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            movie_lines = path.join(tmp_dir, "movie_lines.txt")
+            movie_conversations = path.join(tmp_dir, "movie_conversations.txt")
+            with open(movie_lines, "w") as f:
+                f.write("\n".join(MOVIE_LINES) + "\n")
+            with open(movie_conversations, "w") as f:
+                f.write("\n".join(MOVIE_CONVERSATIONS) + "\n")
+            makedirs(path.join(tmp_dir, "parsed"))
+            parser = MovieParser(movie_lines, movie_conversations, path.join(tmp_dir, "parsed"),
+                                 path.join(tmp_dir, "manifests"))
+            with open(parser.parse_movie_conversations()) as parsed:
+                # Utterances not in the movie lines (or without a text) are left out
+                self.assertEqual(["They do to! They do not!", "She okay? I hope so.", ""], parsed.read().splitlines())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import tempfile
+import logging
+from os import path
+import numpy as np
+from app.pretrained_glove import convert_glove, load_glove, align_vectors, corpus_vectors
+from app.preprocessing.training_data.vocabulary import Vocabulary
+
+
+def _write_glove(glove_file, words, vectors, trailing_newline=True):
+    with open(glove_file, "w", encoding="utf-8") as glove:
+        lines = [f"{word} " + " ".join(f"{value:.5f}" for value in vector) for word, vector in zip(words, vectors)]
+        glove.write("\n".join(lines) + ("\n" if trailing_newline else ""))
+
+
+class PretrainedGloveTest(unittest.TestCase):
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.DEBUG)
+
+    def test_convert_glove(self):
+        # Words that aren't plain ascii, or are comments or numbers to a text parser
+        words = ["the", "#hashtag", "café", "-0.5", "'s"] + [f"word{i}" for i in range(200)]
+        vectors = np.random.default_rng(0).normal(size=(len(words), 7)).round(5).astype(np.float32)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            glove_file = path.join(temp_dir, "glove.txt")
+            _write_glove(glove_file, words, vectors, trailing_newline=False)
+            results = []
+            # Chunks of a few lines, parsed in this process and by workers
+            for workers, chunk_bytes in ((1, 1 << 20), (1, 300), (2, 300)):
+                vectors_file = path.join(temp_dir, f"vectors_{workers}_{chunk_bytes}.npy")
+                vocabulary_file = path.join(temp_dir, f"vectors_{workers}_{chunk_bytes}.vocab")
+                convert_glove(glove_file, vectors_file, vocabulary_file, workers, chunk_bytes)
+                loaded_vectors, vocabulary = load_glove(vectors_file, vocabulary_file)
+                self.assertIsInstance(loaded_vectors, np.memmap)
+                self.assertEqual(np.float32, loaded_vectors.dtype)
+                results.append((np.array(loaded_vectors), vocabulary.words_by_id()))
+                # The row of a word is its id, padding and out-of-vocabulary are zeros
+                np.testing.assert_array_equal(np.arange(2, len(words) + 2), vocabulary.lookup(words))
+                np.testing.assert_array_equal(vectors, loaded_vectors[vocabulary.lookup(words)])
+                np.testing.assert_array_equal(np.zeros((2, 7)), loaded_vectors[:2])
+                self.assertEqual(vocabulary.oov_id, vocabulary.lookup(["unknown"])[0])
+        for vectors, words_by_id in results[1:]:
+            np.testing.assert_array_equal(results[0][0], vectors)
+            self.assertEqual(results[0][1], words_by_id)
+
+    def test_align_vectors(self):
+        pretrained_words = ["the", "a", "cat", "dog", "car", "tree", "house"]
+        pretrained = Vocabulary.from_words(["", "<OOV>"] + pretrained_words, np.zeros(9, dtype=np.int64))
+        vectors = np.arange(9 * 3, dtype=np.float32).reshape(9, 3)
+        corpus = Vocabulary.from_words(
+            ["", "<OOV>", "the", "chatbot", "dog", "cat", "kubernetes"], np.array([0, 0, 50, 20, 10, 1, 5])
+        )
+        aligned_vectors, aligned, report = align_vectors(vectors, pretrained, corpus, tail=2, min_count=2)
+        # Corpus words with a vector and seen twice, by count, then the most frequent other pretrained words
+        self.assertEqual(["the", "dog", "a", "car"], aligned.words_by_id()[2:])
+        np.testing.assert_array_equal([0, 0, 50, 10, 0, 0], aligned.counts)
+        np.testing.assert_array_equal(np.zeros((2, 3)), aligned_vectors[:2])
+        np.testing.assert_array_equal(vectors[pretrained.lookup(["the", "dog", "a", "car"])], aligned_vectors[2:])
+        self.assertEqual(2, report["oov_words"])
+        self.assertAlmostEqual(25 / 86, report["oov_token_rate"])
+        self.assertEqual([["chatbot", 20], ["kubernetes", 5]], report["most_frequent_oov"])
+        # With the ids of the corpus vocabulary, words without a pretrained vector don't shift the others
+        by_corpus_id = corpus_vectors(vectors, pretrained, corpus)
+        self.assertEqual((7, 3), by_corpus_id.shape)
+        np.testing.assert_array_equal(vectors[pretrained.lookup(["the", "dog", "cat"])], by_corpus_id[[2, 4, 5]])
+        np.testing.assert_array_equal(np.zeros((4, 3)), by_corpus_id[[0, 1, 3, 6]])
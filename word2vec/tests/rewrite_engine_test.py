@@ -0,0 +1,39 @@
+import unittest
+import logging
+import random
+from os import path
+from app.preprocessing.cleaning.rewrite_engine import RewriteEngine, CONTRACTIONS
+from app.preprocessing.cleaning.data_cleaner import clean_line
+
+
+class RewriteEngineTest(unittest.TestCase):
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.DEBUG)
+
+    def setUp(self):
+        self.engine = RewriteEngine()
+
+    def test_rewrite(self):
+        self.assertEqual("i am sure it is not ", self.engine.rewrite("I'm  sure it isn`t 42 http://x.org"))
+        self.assertEqual("let is go rock and roll\n", self.engine.rewrite("Let's go -- rock 'n roll!\n"))
+        self.assertEqual("do not", clean_line("Don’t the", stop_words=["the"]))
+
+    def test_same_as_sequential_on_corpus(self):
+        dir_name = path.dirname(__file__)
+        with open(path.join(dir_name, "../data/1_raw/blogs/2007-12-04-scale-with-scala.md"), encoding="utf-8") as f:
+            for line in f:
+                self.assertEqual(self.engine.rewrite_sequential(line), self.engine.rewrite(line))
+
+    def test_same_as_sequential_on_random_lines(self):
+        # Lines glued together from patterns, replacements and separators are the likeliest to expose
+        # rewrites that interact with each other
+        fragments = [pattern for pattern, _ in CONTRACTIONS] + [replacement for _, replacement in CONTRACTIONS]
+        fragments += list("'`’´-\t\n ans12.,") + ["http://", "https://a-b.c", " -- ", "3,000.5"]
+        random_generator = random.Random(42)
+        for _ in range(20000):
+            line = "".join(random_generator.choice(fragments) for _ in range(random_generator.randint(1, 10)))
+            self.assertEqual(self.engine.rewrite_sequential(line), self.engine.rewrite(line), msg=repr(line))
+
+
+if __name__ == "__main__":
+    unittest.main()
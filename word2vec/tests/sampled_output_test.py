@@ -0,0 +1,56 @@
+import unittest
+import logging
+import numpy as np
+from keras import Input, Model
+from keras.optimizers import Adam
+from app.sampled_output import SampledOutput, sampled_loss
+
+
+class SampledOutputTest(unittest.TestCase):
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.DEBUG)
+
+    def _model(self, loss, word_counts=None):
+        hidden_input = Input((8,))
+        target_input = Input((1,), dtype="int32")
+        output = SampledOutput(1000, num_sampled=16, loss=loss, word_counts=word_counts)([hidden_input, target_input])
+        model = Model(inputs=[hidden_input, target_input], outputs=output)
+        model.compile(loss=sampled_loss, optimizer=Adam(learning_rate=0.01))
+        return model
+
+    def test_sampled_output(self):
+        random = np.random.default_rng(0)
+        hidden = random.random((32, 8), dtype=np.float32)
+        targets = random.integers(0, 1000, 32)
+        word_counts = np.arange(1000, 0, -1)
+        for loss, counts in [("sampled_softmax", None), ("negative_sampling", None), ("sampled_softmax", word_counts)]:
+            model = self._model(loss, counts)
+            # Trained on integer targets, the (sampled) loss is the model's output
+            before = model.evaluate([hidden, targets], np.zeros(32), verbose=0)
+            losses = [model.train_on_batch(x=[hidden, targets], y=np.zeros(32)) for _ in range(20)]
+            self.assertTrue(np.all(np.isfinite(losses)))
+            self.assertLess(model.evaluate([hidden, targets], np.zeros(32), verbose=0), before)
+            # Outside of training, the cross entropy of the targets over the whole vocabulary
+            kernel, bias = model.layers[-1].get_weights()
+            logits = hidden @ kernel.T + bias
+            expected = np.log(np.exp(logits).sum(axis=1)) - logits[np.arange(32), targets]
+            np.testing.assert_allclose(expected, model.predict([hidden, targets]), rtol=1e-4)
+
+    def test_held_out_loss(self):
+        # The held out loss of the early stopping goes down as the model learns, rather than staying 1 / vocabulary.
+        # The targets are spread over the vocabulary, as the words sampled are mostly the first ones.
+        random = np.random.default_rng(1)
+        hidden = random.random((256, 8), dtype=np.float32)
+        targets = random.choice(1000, 20, replace=False)[random.integers(0, 20, 256)]
+        for loss in ("sampled_softmax", "negative_sampling"):
+            model = self._model(loss)
+            held_out = [model.evaluate([hidden[192:], targets[192:]], np.zeros(64), verbose=0)]
+            for _ in range(3):
+                model.fit([hidden[:192], targets[:192]], np.zeros(192), batch_size=32, epochs=5, verbose=0)
+                held_out.append(model.evaluate([hidden[192:], targets[192:]], np.zeros(64), verbose=0))
+            self.assertGreater(held_out[0], np.log(1000) * 0.9)
+            self.assertLess(held_out[-1], held_out[0] - 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+import logging
+import numpy as np
+import tensorflow as tf
+from app.sentence_classifier import SentenceClassifier
+
+VOCABULARY_SIZE = 50
+VECTOR_SIZE = 8
+CLASSES = 6
+
+
+class SentenceClassifierTest(unittest.TestCase):
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.DEBUG)
+
+    def test_sparse_embedding_gradient(self):
+        random = np.random.default_rng(0)
+        word_vectors = random.normal(size=(VOCABULARY_SIZE, VECTOR_SIZE)).astype(np.float32)
+        model = SentenceClassifier(VECTOR_SIZE, VOCABULARY_SIZE, word_vectors, CLASSES).model
+        bigrams = np.array([[2, 3], [4, 5]], dtype=np.int32)
+        trigrams = np.array([[2, 3, 4], [4, 5, 6]], dtype=np.int32)
+        labels = tf.one_hot([1, 4], CLASSES)
+        table = model.get_layer("word_embedding").embeddings
+        # The gradient of the shared table is the rows of the words of the batch, not a table sized one
+        with tf.GradientTape() as tape:
+            loss = tf.reduce_mean(tf.keras.losses.categorical_crossentropy(labels, model((bigrams, trigrams))))
+        gradient = tape.gradient(loss, table)
+        self.assertIsInstance(gradient, tf.IndexedSlices)
+        self.assertEqual({2, 3, 4, 5, 6}, set(gradient.indices.numpy().tolist()))
+        # So a training step only changes those rows, and never the frozen table
+        model.train_on_batch((bigrams, trigrams), labels)
+        changed = np.flatnonzero(np.any(table.numpy() != word_vectors, axis=1))
+        self.assertEqual([2, 3, 4, 5, 6], changed.tolist())
+        np.testing.assert_array_equal(word_vectors, model.get_layer("frozen_word_embedding").embeddings.numpy())
+
+
+if __name__ == "__main__":
+    unittest.main()
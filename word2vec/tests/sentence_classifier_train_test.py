@@ -1,7 +1,10 @@
 import unittest
 from os import path
 import logging
-from app.preprocessing.training_data.sentence_classifier_training_builder import SentenceClassifierTrainingBuilder
+import numpy as np
+from app.preprocessing.training_data.sentence_classifier_training_builder import (
+    SentenceClassifierTrainingBuilder, _generate_training_samples, sentence_batches, sentence_ngrams
+)
 
 
 class SentenceClassifierTrainingBuilderTest(unittest.TestCase):
@@ -28,6 +31,38 @@ class SentenceClassifierTrainingBuilderTest(unittest.TestCase):
             self.assertEqual(len(bigrams), len(trigrams), msg=f"Error! Bigrams and trigrams not same length: bigrams: {len(bigrams)}, trigrams: {len(trigrams)}")
             self.assertEqual(len(trigrams), len(y), msg=f"Error! Labels not same length as training samples: labels: {len(y)}, training samples: {len(trigrams)}")
 
+    def test_sentence_ngrams(self):
+        # The pairs of many sentences at once are those of every sentence on its own
+        sentences = [[5, 8, 13, 2, 9], [], [7], [3, 4], [6, 6, 6]]
+        offsets = np.concatenate(([0], np.cumsum([len(sentence) for sentence in sentences])))
+        bigrams, trigrams, pair_sentences = sentence_ngrams(np.concatenate(sentences).astype(np.int32), offsets)
+        for i, sentence in enumerate(sentences):
+            expected_bigrams, expected_trigrams = _generate_training_samples(sentence) if sentence else ([], [])
+            self.assertEqual(expected_bigrams, bigrams[pair_sentences == i].tolist())
+            self.assertEqual(expected_trigrams, trigrams[pair_sentences == i].tolist())
+
+    def test_sentence_batches(self):
+        random = np.random.default_rng(0)
+        lengths = random.integers(1, 12, 500)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        ids = random.integers(2, 1000, offsets[-1]).astype(np.int32)
+        labels = random.integers(0, 6, 500).astype(np.int32)
+        bigrams, trigrams, sentences = sentence_ngrams(ids, offsets)
+        expected = sorted(zip(map(tuple, bigrams), map(tuple, trigrams), labels[sentences]))
+        for bucket_messages in (0, 50):
+            batches = list(sentence_batches(ids, offsets, labels, 64, 1, bucket_messages=bucket_messages,
+                                            chunk_batches=2))
+            self.assertTrue(all(len(batch["y"]) == 64 for batch in batches[:-1]))
+            # Every pair once, with the label of its sentence
+            pairs = sorted(
+                (tuple(bigram), tuple(trigram), label) for batch in batches
+                for bigram, trigram, label in zip(batch["bigrams"], batch["trigrams"], batch["y"])
+            )
+            self.assertEqual(expected, pairs)
+        # Only the pairs of the given messages
+        held_out = list(sentence_batches(ids, offsets, labels, 64, messages=np.arange(490, 500)))
+        self.assertEqual(int(np.sum(sentences >= 490)), sum(len(batch["y"]) for batch in held_out))
+
 
 if __name__ == '__main__':
     unittest.main()
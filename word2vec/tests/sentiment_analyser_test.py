@@ -0,0 +1,189 @@
+import unittest
+import tempfile
+import threading
+import logging
+from os import path
+import h5py
+import numpy as np
+from app.sentiment_analyser import SentimentAnalyser
+from app.sentence_classifier_weights import LAYERS, load_layer_weights
+from app.micro_batcher import MicroBatcher
+from app.preprocessing.training_data.vocabulary import Vocabulary
+
+VOCABULARY_SIZE = 50
+VECTOR_SIZE = 8
+CLASSES = 6
+
+
+class _Tokenizer(object):
+    # The part of the Keras Tokenizer the analyser uses: known words to ids, unknown words left out
+    def __init__(self, words):
+        self.word_index = {word: i + 2 for i, word in enumerate(words)}
+
+    def texts_to_sequences(self, texts):
+        return [[self.word_index[word] for word in text.lower().split() if word in self.word_index] for text in texts]
+
+
+def _weights(seed=0):
+    random = np.random.default_rng(seed)
+    weights = {
+        layer: [random.normal(0, 0.3, (VOCABULARY_SIZE, VECTOR_SIZE)).astype(np.float32)] for layer in LAYERS[:2]
+    }
+    for conv in ("bigram_conv", "trigram_conv"):
+        weights[conv] = [random.normal(0, 0.3, (4, VECTOR_SIZE, 20)).astype(np.float32), random.normal(0, 0.1, 20)]
+    # One max pooled bigram position and two trigram positions of 20 filters
+    weights["sentence_classes"] = [
+        random.normal(0, 0.3, (60, CLASSES)).astype(np.float32), random.normal(0, 0.1, CLASSES)
+    ]
+    return weights
+
+
+def _pair_probabilities(weights, bigram, trigram):
+    # The forward pass of SentenceClassifier for one bigram/trigram pair, written out
+    def conv(ngram, layers, kernel, bias):
+        # The trainable and the frozen embeddings of the n-gram, one after the other
+        x = np.concatenate([weights[layer][0][ngram] for layer in layers])
+        return [
+            np.maximum(sum(x[position + i] @ kernel[i] for i in range(4)) + bias, 0) for position in range(len(x) - 3)
+        ]
+
+    bigram_conv = conv(bigram, LAYERS[:2], *weights["bigram_conv"])
+    trigram_conv = conv(trigram, LAYERS[:2], *weights["trigram_conv"])
+    # Max pooled by 2, the last trigram position on its own
+    features = np.concatenate([bigram_conv[0], np.maximum(trigram_conv[0], trigram_conv[1]), trigram_conv[2]])
+    logits = features @ weights["sentence_classes"][0] + weights["sentence_classes"][1]
+    return np.exp(logits) / np.exp(logits).sum()
+
+
+def _save_weights(model_file, weights):
+    # Laid out like Keras save_weights lays out the weights of a model
+    with h5py.File(model_file, "w") as model:
+        model.attrs["layer_names"] = [layer.encode("utf-8") for layer in weights]
+        for layer, layer_weights in weights.items():
+            names = [f"{layer}/weight_{i}:0" for i in range(len(layer_weights))]
+            group = model.create_group(layer)
+            group.attrs["weight_names"] = [name.encode("utf-8") for name in names]
+            for name, weight in zip(names, layer_weights):
+                group[name] = weight
+
+
+class SentimentAnalyserTest(unittest.TestCase):
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.DEBUG)
+
+    def setUp(self):
+        self.weights = _weights()
+        self.tokenizer = _Tokenizer([f"w{chr(ord('a') + i)}" for i in range(VOCABULARY_SIZE - 2)])
+
+    def test_predict(self):
+        messages = ["wa wb wc wd", "we", "", "unknown words", "wf wg"]
+        probabilities = SentimentAnalyser(self.tokenizer, self.weights, chunk_pairs=2).predict(messages)
+        self.assertEqual((len(messages), CLASSES), probabilities.shape)
+        np.testing.assert_allclose(np.ones(len(messages)), probabilities.sum(axis=1), rtol=1e-5)
+        # The mean over the pairs of the message: (wa wb, wa wb wc), (wb wc, wb wc wd), (wc wd, wc wd 0)
+        expected = np.mean([
+            _pair_probabilities(self.weights, [2, 3], [2, 3, 4]),
+            _pair_probabilities(self.weights, [3, 4], [3, 4, 5]),
+            _pair_probabilities(self.weights, [4, 5], [4, 5, 0]),
+        ], axis=0)
+        np.testing.assert_allclose(expected, probabilities[0], rtol=1e-4)
+        np.testing.assert_allclose(_pair_probabilities(self.weights, [6, 0], [0, 6, 0]), probabilities[1], rtol=1e-4)
+        # Without known words every class is as likely
+        np.testing.assert_allclose(np.full((2, CLASSES), 1 / CLASSES), probabilities[2:4])
+
+    def test_load(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            model_file = path.join(temp_dir, "sentiment_classifier.h5")
+            _save_weights(model_file, self.weights)
+            loaded = SentimentAnalyser.load(model_file, self.tokenizer)
+        messages = ["wa wb wc", "wd we"]
+        np.testing.assert_array_equal(
+            SentimentAnalyser(self.tokenizer, self.weights).predict(messages), loaded.predict(messages)
+        )
+
+    def test_migrate_weights(self):
+        random = np.random.default_rng(1)
+        tables = [random.normal(size=(VOCABULARY_SIZE, VECTOR_SIZE)).astype(np.float32) for _ in range(4)]
+        # An embedding table per branch, as named layers and as the layers Keras named
+        for layers in (
+            ["bigram_embedding", "frozen_bigram_embedding", "trigram_embedding", "frozen_trigram_embedding",
+             "bigram_conv", "trigram_conv", "sentence_classes"],
+            ["embedding", "embedding_1", "embedding_2", "embedding_3", "conv1d", "conv1d_1", "dense"],
+        ):
+            old = dict(zip(layers, [[table] for table in tables] + [self.weights[layer] for layer in LAYERS[2:]]))
+            with tempfile.TemporaryDirectory() as temp_dir:
+                model_file = path.join(temp_dir, "sentiment_classifier.h5")
+                _save_weights(model_file, old)
+                migrated = load_layer_weights(model_file)
+            self.assertEqual(list(LAYERS), list(migrated))
+            np.testing.assert_allclose((tables[0] + tables[2]) / 2, migrated["word_embedding"][0])
+            np.testing.assert_array_equal(tables[1], migrated["frozen_word_embedding"][0])
+            for layer in LAYERS[2:]:
+                for expected, actual in zip(self.weights[layer], migrated[layer]):
+                    np.testing.assert_array_equal(expected, actual)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            model_file = path.join(temp_dir, "sentiment_classifier.h5")
+            _save_weights(model_file, {"dense": self.weights["sentence_classes"]})
+            with self.assertRaises(ValueError):
+                load_layer_weights(model_file)
+
+    def test_other_vocabulary(self):
+        # Weights of a classifier trained with another vocabulary (e.g. the whole pretrained vocabulary) are refused
+        # rather than looked up with the ids of this one
+        words = [f"w{chr(ord('a') + i)}" for i in range(VOCABULARY_SIZE - 2)]
+        vocabulary = Vocabulary.from_words(["", "<OOV>"] + words, np.zeros(VOCABULARY_SIZE, dtype=np.int64))
+        smaller = Vocabulary.from_words(["", "<OOV>"] + words[:20], np.zeros(22, dtype=np.int64))
+        # And so are those migrated from an embedding table per branch
+        old = dict(zip(
+            ["bigram_embedding", "frozen_bigram_embedding", "trigram_embedding", "frozen_trigram_embedding",
+             "bigram_conv", "trigram_conv", "sentence_classes"],
+            [self.weights["word_embedding"]] * 4 + [self.weights[layer] for layer in LAYERS[2:]],
+        ))
+        for weights in (self.weights, old):
+            with tempfile.TemporaryDirectory() as temp_dir:
+                model_file = path.join(temp_dir, "sentiment_classifier.h5")
+                _save_weights(model_file, weights)
+                tables = load_layer_weights(model_file, VOCABULARY_SIZE)["word_embedding"]
+                self.assertEqual((VOCABULARY_SIZE, VECTOR_SIZE), tables[0].shape)
+                SentimentAnalyser.load(model_file, vocabulary)
+                with self.assertRaisesRegex(ValueError, "retrain the classifier"):
+                    load_layer_weights(model_file, smaller.vocabulary_size())
+                with self.assertRaisesRegex(ValueError, "retrain the classifier"):
+                    SentimentAnalyser.load(model_file, smaller)
+
+    def test_analyse(self):
+        messages = [" ".join(f"w{chr(ord('a') + (i * j) % 40)}" for j in range(1 + i % 7)) for i in range(64)]
+        with SentimentAnalyser(self.tokenizer, self.weights, max_batch_size=16, max_wait=0.01) as analyser:
+            expected = analyser.predict(messages)
+            results = [None] * len(messages)
+
+            def analyse(i):
+                results[i] = analyser.analyse(messages[i], timeout=10)
+
+            threads = [threading.Thread(target=analyse, args=(i,)) for i in range(len(messages))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        np.testing.assert_allclose(expected, np.array(results), rtol=1e-5)
+
+    def test_micro_batcher(self):
+        batches = []
+
+        def handle_batch(requests):
+            batches.append(len(requests))
+            if "fail" in requests:
+                raise ValueError("fail")
+            return [request * 2 for request in requests]
+
+        with MicroBatcher(handle_batch, max_batch_size=4, max_wait=1) as batcher:
+            futures = [batcher.submit(i) for i in range(10)]
+            self.assertEqual([i * 2 for i in range(10)], [future.result(10) for future in futures])
+            # Full batches go without waiting for max_wait
+            self.assertEqual([4, 4], batches[:2])
+        self.assertEqual(10, sum(batches))
+        with MicroBatcher(handle_batch, max_wait=0) as batcher:
+            with self.assertRaises(ValueError):
+                batcher("fail", timeout=10)
+        with self.assertRaises(RuntimeError):
+            batcher.submit(1)
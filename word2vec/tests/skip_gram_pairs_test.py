@@ -0,0 +1,88 @@
+import unittest
+import logging
+from collections import Counter
+import numpy as np
+from app.preprocessing.training_data.skip_gram_pairs import AliasTable, SkipGramPairs
+
+
+class SkipGramPairsTest(unittest.TestCase):
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.DEBUG)
+
+    counts = np.array([0, 0, 500, 200, 100, 50, 20, 10, 5, 1], dtype=np.int64)
+
+    def _lines(self, number_of_lines, seed=1):
+        random = np.random.default_rng(seed)
+        lines = [random.integers(1, len(self.counts), random.integers(0, 15)) for _ in range(number_of_lines)]
+        offsets = np.concatenate(([0], np.cumsum([len(line) for line in lines])))
+        return np.concatenate(lines).astype(np.int32), offsets
+
+    def test_alias_table(self):
+        weights = np.array([0.0, 1.0, 2.0, 3.0, 4.0])
+        samples = AliasTable(weights).sample(200000, np.random.default_rng(0))
+        frequencies = np.bincount(samples, minlength=len(weights)) / len(samples)
+        np.testing.assert_allclose(weights / weights.sum(), frequencies, atol=0.01)
+
+    def test_pairs(self):
+        ids, offsets = self._lines(50)
+        skip_gram_pairs = SkipGramPairs(self.counts, 2, negative_samples=3, subsampling_threshold=None, seed=0)
+        pairs, labels = skip_gram_pairs.pairs(ids, offsets)
+        expected = Counter()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            line = ids[start:end].tolist()
+            for i, target in enumerate(line):
+                for j, context in enumerate(line):
+                    if 0 < abs(i - j) <= 2:
+                        expected[(target, context)] += 1
+        self.assertEqual(expected, Counter(map(tuple, pairs[labels == 1].tolist())))
+        self.assertEqual(3 * sum(expected.values()), int(np.sum(labels == 0)))
+        negatives = pairs[labels == 0]
+        self.assertTrue(np.all(negatives[:, 1] > 1))
+        # Every positive target comes with 3 negatives
+        self.assertEqual(
+            Counter({target: 3 * count for target, count in Counter(pairs[labels == 1][:, 0].tolist()).items()}),
+            Counter(negatives[:, 0].tolist()),
+        )
+
+    def test_seed(self):
+        ids, offsets = self._lines(50)
+        first = SkipGramPairs(self.counts, 2, seed=7).pairs(ids, offsets)
+        second = SkipGramPairs(self.counts, 2, seed=7).pairs(ids, offsets)
+        other = SkipGramPairs(self.counts, 2, seed=8).pairs(ids, offsets)
+        np.testing.assert_array_equal(first[0], second[0])
+        np.testing.assert_array_equal(first[1], second[1])
+        self.assertFalse(np.array_equal(first[0], other[0]))
+        # Reseeded, the pairs are those of new pairs with that seed, from the same tables
+        tables = SkipGramPairs(self.counts, 2, seed=8)
+        reseeded = tables.with_seed(7)
+        self.assertIs(tables.negative_table, reseeded.negative_table)
+        for expected, actual in zip(first, reseeded.pairs(ids, offsets)):
+            np.testing.assert_array_equal(expected, actual)
+
+    def test_subsampling(self):
+        ids, offsets = self._lines(2000)
+        pairs, labels = SkipGramPairs(self.counts, 2, subsampling_threshold=0.01, seed=0).pairs(ids, offsets)
+        positives = Counter(pairs[labels == 1][:, 0].tolist())
+        unsampled, unsampled_labels = SkipGramPairs(self.counts, 2, subsampling_threshold=None, seed=0).pairs(
+            ids, offsets
+        )
+        all_positives = Counter(unsampled[unsampled_labels == 1][:, 0].tolist())
+        # The most frequent word is dropped far more often than the rarest
+        self.assertLess(positives[2] / all_positives[2], 0.5 * positives[9] / all_positives[9])
+
+    def test_batches(self):
+        ids, offsets = self._lines(200)
+        encoded_lines = [(ids[offsets[i]:offsets[i + 20]], offsets[i:i + 21] - offsets[i]) for i in range(0, 200, 20)]
+        batches = list(SkipGramPairs(self.counts, 2, seed=3).batches(encoded_lines, 100))
+        self.assertTrue(all(len(labels) == 100 for _, labels in batches[:-1]))
+        self.assertTrue(0 < len(batches[-1][1]) <= 100)
+        skip_gram_pairs = SkipGramPairs(self.counts, 2, seed=3)
+        expected = [skip_gram_pairs.pairs(batch_ids, batch_offsets) for batch_ids, batch_offsets in encoded_lines]
+        np.testing.assert_array_equal(
+            np.concatenate([pairs for pairs, _ in expected]), np.concatenate([pairs for pairs, _ in batches])
+        )
+        self.assertEqual(np.int32, batches[0][0].dtype)
+
+
+if __name__ == "__main__":
+    unittest.main()
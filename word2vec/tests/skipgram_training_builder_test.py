@@ -1,4 +1,5 @@
 import unittest
+import tempfile
 from os import path
 import logging
 from app.preprocessing.training_data.skip_gram_training_builder import (
@@ -12,14 +13,15 @@ class SkipgramTrainingBuilderTest(unittest.TestCase):
 
     def test_generate_sg_training_samples(self):
         dir_name = path.dirname(__file__)
-        self.training_data_builder = SkipGramTrainingBuilder(
-            source_dir=path.join(dir_name, "test_data"),
-            window_size=2,
-            tokenizer_file=path.join(dir_name, "test_data/training/dictionary.dat"),
-            tokenizer_json=None,
-            dry_run=True,
-        )
-        super(SkipGramTrainingBuilder, self.training_data_builder).tokenize()
-        vocabulary_size, X_y = self.training_data_builder.build_sg_training_data()
-        self.logger.info(f"Skip grams: {X_y}")
-        self.assertEqual(89, vocabulary_size)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.training_data_builder = SkipGramTrainingBuilder(
+                source_dir=path.join(dir_name, "test_data/cleaned"),
+                window_size=2,
+                vocabulary_file=path.join(tmp_dir, "dictionary.vocab"),
+                dry_run=True,
+                manifest_dir=tmp_dir,
+            )
+            super(SkipGramTrainingBuilder, self.training_data_builder).tokenize()
+            vocabulary_size, X_y = self.training_data_builder.build_sg_training_data()
+            self.logger.info(f"Skip grams: {X_y}")
+            self.assertEqual(89, vocabulary_size)
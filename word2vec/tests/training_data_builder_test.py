@@ -1,5 +1,7 @@
 import unittest
-from app.preprocessing.training_data.training_data_builder import TrainingDataBuilder
+import tempfile
+from app.preprocessing.training_data.training_data_builder import TrainingDataBuilder, load_training_data
+from app.preprocessing.training_data.vocabulary import Vocabulary
 from os import path
 import logging
 
@@ -10,11 +12,91 @@ class TrainingDataBuilderTest(unittest.TestCase):
 
     def test_generate_training_data(self):
         dir_name = path.dirname(__file__)
-        self.training_data_builder = TrainingDataBuilder(
-            source_dir=path.join(dir_name, "test_data"),
-            tokenizer_file=path.join(dir_name, "test_data/training/dictionary.dat"),
-            tokenizer_json_file=None
-        )
-        self.training_data_builder.tokenize()
-        self.logger.info(f"Training data: {self.training_data_builder.vocabulary()}")
-        self.assertEqual(89, self.training_data_builder.vocabulary_size())
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            vocabulary_file = path.join(tmp_dir, "dictionary.vocab")
+            self.training_data_builder = TrainingDataBuilder(
+                source_dir=path.join(dir_name, "test_data/cleaned"),
+                vocabulary_file=vocabulary_file,
+                manifest_dir=tmp_dir,
+            )
+            self.training_data_builder.tokenize()
+            self.logger.info(f"Training data: {self.training_data_builder.vocabulary()}")
+            self.assertEqual(89, self.training_data_builder.vocabulary_size())
+            self.assertEqual(89, Vocabulary.load(vocabulary_file).vocabulary_size())
+
+    def test_vocabulary_pruning(self):
+        dir_name = path.dirname(__file__)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.training_data_builder = TrainingDataBuilder(
+                source_dir=path.join(dir_name, "test_data/cleaned"),
+                vocabulary_file=path.join(tmp_dir, "dictionary.vocab"),
+                manifest_dir=tmp_dir,
+                max_size=10,
+            )
+            self.training_data_builder.tokenize()
+            self.assertEqual(12, self.training_data_builder.vocabulary_size())
+
+    def test_encode_lines(self):
+        dir_name = path.dirname(__file__)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            vocabulary_file = path.join(tmp_dir, "dictionary.vocab")
+            self.training_data_builder = TrainingDataBuilder(
+                source_dir=path.join(dir_name, "test_data/cleaned"),
+                vocabulary_file=vocabulary_file,
+                manifest_dir=tmp_dir,
+            )
+            self.training_data_builder.tokenize()
+            expected = [
+                self.training_data_builder.line_to_word_ids(line)
+                for line in self.training_data_builder.training_line_generator()
+            ]
+            self.assertEqual(expected, list(self.training_data_builder.training_word_ids()))
+            # Encoded by a pool of workers, in small batches to check that the order is kept
+            self.training_data_builder = TrainingDataBuilder(
+                source_dir=path.join(dir_name, "test_data/cleaned"),
+                vocabulary_file=vocabulary_file,
+                manifest_dir=tmp_dir,
+                workers=2,
+            )
+            lines = list(self.training_data_builder.training_line_generator())
+            batches = list(self.training_data_builder.encode_lines(lines, batch_lines=3))
+            self.assertEqual(-(-len(lines) // 3), len(batches))
+            word_ids = [
+                ids[start:end].tolist() for ids, offsets in batches for start, end in zip(offsets, offsets[1:])
+            ]
+            self.assertEqual(expected, word_ids)
+            # The same processes encode every call, until the builder is closed
+            pool = self.training_data_builder._pool
+            self.assertEqual(expected, list(self.training_data_builder.training_word_ids()))
+            self.assertIs(pool, self.training_data_builder._pool)
+            self.training_data_builder.close()
+            self.assertIsNone(self.training_data_builder._pool)
+
+    def test_build_training_samples(self):
+        dir_name = path.dirname(__file__)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.training_data_builder = TrainingDataBuilder(
+                source_dir=path.join(dir_name, "test_data/cleaned"),
+                vocabulary_file=path.join(tmp_dir, "dictionary.vocab"),
+                manifest_dir=tmp_dir,
+            )
+            self.training_data_builder.tokenize()
+
+            def file_samples(clean_file):
+                word_ids = [ids for ids in self.training_data_builder.file_word_ids(clean_file) if len(ids) >= 2]
+                # In two chunks
+                yield [ids[:2] for ids in word_ids[:5]], [len(ids) for ids in word_ids[:5]]
+                yield [ids[:2] for ids in word_ids[5:]], [len(ids) for ids in word_ids[5:]]
+
+            expected_X, expected_y = self.training_data_builder.build_training_samples(
+                "test", None, file_samples, dry_run=True
+            )
+            training_data_file = path.join(tmp_dir, "training_data.dat")
+            # Built twice: the second time from the per file cache
+            for _ in range(2):
+                with self.training_data_builder.training_data_writer(training_data_file) as writer:
+                    self.training_data_builder.build_training_samples("test", None, file_samples, writer=writer)
+                X_y = load_training_data(training_data_file)
+                self.assertEqual(expected_X, X_y["X"].tolist())
+                self.assertEqual(expected_y, X_y["y"].tolist())
+                self.assertEqual(self.training_data_builder.tokenizer.fingerprint(), X_y.vocabulary)
@@ -0,0 +1,87 @@
+import unittest
+import logging
+import pickle
+import tempfile
+from os import path
+import numpy as np
+from app.preprocessing.training_data.training_data_file import (
+    TrainingDataWriter,
+    convert_training_data,
+    is_training_data_file,
+    load_training_data,
+    save_training_data,
+)
+
+
+class TrainingDataFileTest(unittest.TestCase):
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.DEBUG)
+
+    def test_write_in_batches(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            training_data_file = path.join(tmp_dir, "training_data.dat")
+            columns = {"X": (np.int32, (4,)), "y": (np.int32, ())}
+            with TrainingDataWriter(training_data_file, "fingerprint", columns) as writer:
+                writer.append(X=[[1, 2, 3, 4], [5, 6, 7, 8]], y=[9, 10])
+                writer.append(X=[], y=[])
+                writer.append(X=np.array([[11, 12, 13, 14]]), y=np.array([15]))
+                with self.assertRaises(ValueError):
+                    writer.append(X=[[1, 2]], y=[3])
+            X_y = load_training_data(training_data_file)
+            self.assertIsInstance(X_y["X"], np.memmap)
+            self.assertEqual(np.int32, X_y["X"].dtype)
+            self.assertEqual([[1, 2, 3, 4], [5, 6, 7, 8], [11, 12, 13, 14]], X_y["X"].tolist())
+            self.assertEqual([9, 10, 15], X_y["y"].tolist())
+            self.assertEqual("fingerprint", X_y.vocabulary)
+            self.assertEqual(3, len(X_y))
+
+    def test_write_sequences(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            training_data_file = path.join(tmp_dir, "training_data.dat")
+            columns = {"ids": (np.int32, ()), "lengths": (np.int32, ()), "y": (np.int32, ())}
+            with TrainingDataWriter(training_data_file, columns=columns, sequences={"ids": "lengths"}) as writer:
+                writer.append(ids=[1, 2, 3, 4, 5], lengths=[3, 2], y=[0, 1])
+                writer.append(ids=[6], lengths=[1], y=[2])
+                with self.assertRaises(ValueError):
+                    writer.append(ids=[7, 8], lengths=[1], y=[3])
+            X_y = load_training_data(training_data_file)
+            self.assertEqual(3, len(X_y))
+            self.assertEqual([1, 2, 3, 4, 5, 6], X_y["ids"].tolist())
+            self.assertEqual([0, 3, 5, 6], X_y.offsets("ids").tolist())
+            self.assertEqual([0, 1, 2], X_y["y"].tolist())
+
+    def test_save_glove_training_data(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            training_data_file = path.join(tmp_dir, "training_data.dat")
+            save_training_data(training_data_file, {"X": [[1, 2], [2, 1]], "y": [0.0, 0.6931]})
+            X_y = load_training_data(training_data_file)
+            self.assertEqual(np.float32, X_y["y"].dtype)
+            np.testing.assert_allclose([0.0, 0.6931], X_y["y"])
+            save_training_data(training_data_file, {"X": [], "y": []})
+            self.assertEqual(0, len(load_training_data(training_data_file)))
+
+    def test_convert_pickled_training_data(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            training_data_file = path.join(tmp_dir, "training_data.dat")
+            with open(training_data_file, "wb") as f:
+                pickle.dump({"X": [[1, 2], [3, 4]], "y": [1, 0]}, f)
+            self.assertEqual([[1, 2], [3, 4]], load_training_data(training_data_file)["X"].tolist())
+            self.assertTrue(convert_training_data(training_data_file))
+            self.assertTrue(is_training_data_file(training_data_file))
+            self.assertEqual([1, 0], load_training_data(training_data_file)["y"].tolist())
+            self.assertFalse(convert_training_data(training_data_file))
+
+    def test_convert_pickled_sentence_training_data(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            training_data_file = path.join(tmp_dir, "training_data.dat")
+            X = [[[[1, 2], [2, 3]], [[1, 2, 3], [2, 3, 0]]], [[[4, 0]], [[0, 4, 0]]]]
+            with open(training_data_file, "wb") as f:
+                pickle.dump({"X": X, "y": [[2, 2], [5]]}, f)
+            X_y = load_training_data(training_data_file)
+            self.assertEqual([[1, 2], [2, 3], [4, 0]], X_y["bigrams"].tolist())
+            self.assertEqual([[1, 2, 3], [2, 3, 0], [0, 4, 0]], X_y["trigrams"].tolist())
+            self.assertEqual([2, 2, 5], X_y["y"].tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()
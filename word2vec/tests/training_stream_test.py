@@ -0,0 +1,90 @@
+import unittest
+import tempfile
+import threading
+import logging
+from collections import Counter
+from os import path
+import numpy as np
+from app.preprocessing.training_data.training_stream import TrainingStream
+from app.preprocessing.training_data.cbow_training_builder import CbowTrainingBuilder
+from app.preprocessing.training_data.glove_training_builder import GloveTrainingBuilder
+
+
+def _shard_samples(shard, epoch):
+    # Shard i holds the samples 100 * i up to 100 * i + 37, in chunks of 10
+    samples = np.arange(100 * shard, 100 * shard + 37)
+    for start in range(0, len(samples), 10):
+        yield samples[start:start + 10, None], -samples[start:start + 10]
+
+
+class TrainingStreamTest(unittest.TestCase):
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.DEBUG)
+
+    def test_epochs(self):
+        with TrainingStream(range(5), _shard_samples, batch_size=16, prefetch=2, seed=3) as training_stream:
+            epochs = [list(training_stream.epoch(epoch)) for epoch in range(3)]
+            again = list(training_stream.epoch(0))
+        expected = sorted(100 * shard + i for shard in range(5) for i in range(37))
+        for batches in epochs:
+            self.assertTrue(all(len(y) == 16 for _, y in batches[:-1]))
+            X = np.concatenate([X for X, _ in batches])
+            y = np.concatenate([y for _, y in batches])
+            self.assertEqual(expected, sorted(X[:, 0].tolist()))
+            np.testing.assert_array_equal(-X[:, 0], y)
+        # Another order every epoch, the same order for the same epoch
+        self.assertNotEqual(epochs[0][0][1].tolist(), epochs[1][0][1].tolist())
+        self.assertEqual([y.tolist() for _, y in epochs[0]], [y.tolist() for _, y in again])
+
+    def test_error(self):
+        def failing_samples(shard, epoch):
+            yield from _shard_samples(shard, epoch)
+            raise ValueError("broken shard")
+
+        training_stream = TrainingStream(range(3), failing_samples, batch_size=16)
+        with self.assertRaises(ValueError):
+            list(training_stream.epoch(0))
+
+    def test_stop_early(self):
+        # The producer stops when the training loop stops taking batches, even with a full queue
+        training_stream = TrainingStream(range(50), _shard_samples, batch_size=4, prefetch=1)
+        for i, _ in enumerate(training_stream.epoch(0)):
+            if i == 2:
+                break
+        self.assertFalse(any(thread.name.startswith("training-stream") for thread in threading.enumerate()))
+
+    def _builder(self, builder_class, temp_dir):
+        dir_name = path.dirname(__file__)
+        training_data_builder = builder_class(
+            source_dir=path.join(dir_name, "test_data/cleaned"),
+            window_size=2,
+            vocabulary_file=path.join(temp_dir, "dictionary.vocab"),
+            dry_run=True,
+            manifest_dir=path.join(temp_dir, "manifests"),
+        )
+        super(builder_class, training_data_builder).tokenize()
+        return training_data_builder
+
+    def test_builder_streams(self):
+        # A streamed epoch holds the same samples as the training data built by a dry run
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cbow_training_builder = self._builder(CbowTrainingBuilder, temp_dir)
+            _, X_y = cbow_training_builder.build_cbow_training_data()
+            with cbow_training_builder.cbow_training_stream(batch_size=32, prefetch=4) as training_stream:
+                batches = list(training_stream.epoch(0))
+            self.assertEqual(
+                Counter(tuple(x) + (y,) for x, y in zip(X_y["X"], X_y["y"])),
+                Counter(tuple(x) + (y,) for X, Y in batches for x, y in zip(X.tolist(), Y.tolist())),
+            )
+            glove_training_builder = self._builder(GloveTrainingBuilder, temp_dir)
+            _, X_y = glove_training_builder.build_glove_training_data()
+            with glove_training_builder.glove_training_stream(batch_size=32, shards=4) as training_stream:
+                batches = list(training_stream.epoch(1))
+            streamed = {tuple(x): y for X, Y in batches for x, y in zip(X.tolist(), Y.tolist())}
+            self.assertEqual(len(X_y["X"]), sum(len(Y) for _, Y in batches))
+            self.assertEqual(sorted(map(tuple, X_y["X"])), sorted(streamed))
+            np.testing.assert_allclose(X_y["y"], [streamed[tuple(x)] for x in X_y["X"]], rtol=1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+import logging
+import tempfile
+from os import path
+import numpy as np
+from app.preprocessing.training_data.vocabulary import Vocabulary, VocabularyBuilder, text_to_words
+
+
+class VocabularyTest(unittest.TestCase):
+    logger = logging.getLogger(__name__)
+    logging.basicConfig(level=logging.DEBUG)
+
+    texts = ["the cat sat on the mat", "The dog, the cat!", "a dog sat"]
+
+    def test_word_ids(self):
+        vocabulary = VocabularyBuilder().update(self.texts).build()
+        # by descending count, words with the same count in the order they were first seen; 1 is the oov id
+        self.assertEqual(["", "UNK", "the", "cat", "sat", "dog", "on", "mat", "a"], vocabulary.words_by_id())
+        self.assertEqual(9, vocabulary.vocabulary_size())
+        self.assertEqual(4, vocabulary.max_word_count())
+        self.assertEqual([[2, 3, 1, 5]], vocabulary.texts_to_sequences(["The cat bird dog"]))
+        self.assertEqual(["the", "dog", "the", "cat"], text_to_words("The dog, the cat!"))
+
+    def test_merge(self):
+        merged = VocabularyBuilder().update(self.texts[:1]).merge(VocabularyBuilder().update(self.texts[1:]))
+        self.assertEqual(
+            VocabularyBuilder().update(self.texts).build().words_by_id(), merged.build().words_by_id()
+        )
+        self.assertEqual(3, merged.document_count)
+
+    def test_pruning(self):
+        vocabulary = VocabularyBuilder().update(self.texts).build(min_count=2)
+        self.assertEqual(["", "UNK", "the", "cat", "sat", "dog"], vocabulary.words_by_id())
+        vocabulary = VocabularyBuilder().update(self.texts).build(max_size=2)
+        self.assertEqual(["", "UNK", "the", "cat"], vocabulary.words_by_id())
+        self.assertEqual([[2, 1, 1]], vocabulary.texts_to_sequences(["the mat dog"]))
+
+    def test_save_load(self):
+        vocabulary = VocabularyBuilder().update(self.texts).build()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            vocabulary_file = path.join(tmp_dir, "dictionary.vocab")
+            vocabulary.save(vocabulary_file)
+            loaded = Vocabulary.load(vocabulary_file)
+            self.assertEqual(vocabulary.word_index, loaded.word_index)
+            np.testing.assert_array_equal(vocabulary.counts, loaded.counts)
+            np.testing.assert_array_equal(vocabulary.docs, loaded.docs)
+            self.assertEqual(3, loaded.document_count)
+            self.assertEqual(vocabulary.fingerprint(), loaded.fingerprint())
+            ids, offsets = loaded.encode(self.texts)
+            self.assertEqual(np.int32, ids.dtype)
+            self.assertEqual([0, 6, 10, 13], offsets.tolist())
+            self.assertEqual([5, 2, 3], ids[offsets[1]:offsets[2]].tolist()[1:])
+
+
+if __name__ == "__main__":
+    unittest.main()